@@ -58,6 +58,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.auditoria.AuditoriaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -108,6 +109,18 @@ if config('USE_SQLITE', default=False, cast=bool):
     }
 
 
+# Cache
+# Em produção com vários processos, usar um backend compartilhado (o docker-compose
+# usa Redis): as chaves de versão do expediente, das escalas e das habilidades
+# avisam os demais processos por ele. Ver core/checks.py.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='agendamento'),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -209,6 +222,33 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 WHATSAPP_TOKEN = config('WHATSAPP_TOKEN', default='')
 WHATSAPP_WEBHOOK_VERIFY_TOKEN = config('WHATSAPP_WEBHOOK_VERIFY_TOKEN', default='')
 
+# Agenda
+AGENDA_INTERVALO_MINUTOS = config('AGENDA_INTERVALO_MINUTOS', default=15, cast=int)  # Granularidade dos horários livres
+AGENDA_BUSCA_MAXIMO_DIAS = config('AGENDA_BUSCA_MAXIMO_DIAS', default=31, cast=int)
+AGENDA_CALENDARIO_MAXIMO_DIAS = config('AGENDA_CALENDARIO_MAXIMO_DIAS', default=62, cast=int)  # Período máximo do feed do calendário
+AGENDA_JANELA_CACHE_DIAS = config('AGENDA_JANELA_CACHE_DIAS', default=60, cast=int)  # Dias com disponibilidade pré-calculada
+AGENDA_RESERVA_TTL_SEGUNDOS = config('AGENDA_RESERVA_TTL_SEGUNDOS', default=300, cast=int)  # Validade da reserva de horário
+AGENDA_ICS_DIAS_PASSADOS = config('AGENDA_ICS_DIAS_PASSADOS', default=30, cast=int)  # Período publicado no feed .ics
+AGENDA_ICS_DIAS_FUTUROS = config('AGENDA_ICS_DIAS_FUTUROS', default=180, cast=int)
+
+# Relatórios
+RELATORIO_EXPORTACAO_MAXIMO_DIAS = config('RELATORIO_EXPORTACAO_MAXIMO_DIAS', default=366, cast=int)  # Período máximo de uma exportação
+RELATORIO_DIRETORIO = config('RELATORIO_DIRETORIO', default=str(BASE_DIR / 'relatorios'))  # Arquivos gerados em segundo plano (fora de MEDIA_ROOT)
+RELATORIO_RETENCAO_DIAS = config('RELATORIO_RETENCAO_DIAS', default=7, cast=int)
+RELATORIO_TAREFA_EXPIRACAO_MINUTOS = config('RELATORIO_TAREFA_EXPIRACAO_MINUTOS', default=30, cast=int)  # Tarefa parada há mais tempo volta para a fila
+
+# Auditoria
+AUDITORIA_MODO = config('AUDITORIA_MODO', default='sincrono')  # 'sincrono': grava antes da resposta; 'assincrono': thread em segundo plano, sem garantia
+AUDITORIA_LOTE_TAMANHO = config('AUDITORIA_LOTE_TAMANHO', default=100, cast=int)  # Logs por INSERT
+AUDITORIA_LOTE_SEGUNDOS = config('AUDITORIA_LOTE_SEGUNDOS', default=2, cast=float)  # Tempo máximo de um log na fila
+AUDITORIA_VALORES_CACHE_TAMANHO = config('AUDITORIA_VALORES_CACHE_TAMANHO', default=10000, cast=int)  # Modelos, IPs e user agents em memória, por tabela
+AUDITORIA_RETENCAO_MESES = config('AUDITORIA_RETENCAO_MESES', default=12, cast=int)  # Meses no banco, contando o atual; os anteriores vão para arquivo
+AUDITORIA_PARTICOES_FUTURAS = config('AUDITORIA_PARTICOES_FUTURAS', default=3, cast=int)  # Partições mensais criadas com antecedência (PostgreSQL)
+AUDITORIA_ARQUIVO_DIRETORIO = config('AUDITORIA_ARQUIVO_DIRETORIO', default=str(BASE_DIR / 'auditoria_arquivo'))  # Meses arquivados (.jsonl.gz)
+
+# Dashboard
+DASHBOARD_CACHE_SEGUNDOS = config('DASHBOARD_CACHE_SEGUNDOS', default=300, cast=int)  # Limite de vida do snapshot (próximos agendamentos)
+
 # Logging
 LOGGING = {
     'version': 1,
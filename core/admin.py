@@ -1,9 +1,25 @@
+import json
+import uuid
+
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.admin import UserAdmin
+from django.db import connection
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
 from django.utils.html import format_html
+from .auditoria import carregar_valores
+from .forms import AgendamentoAdminForm, SerieAgendamentoForm, ServicoForm
+from .habilidades import funcionarios_habilitados
+from .recorrencia import criar_serie
+from .reservas import confirmar_agendamento
 from .models import (
     Usuario, Funcionario, Cargo, Servico, 
-    Agendamento, ConfiguracaoEmpresa, LogAuditoria
+    Agendamento, SerieAgendamento, ConfiguracaoEmpresa, LogAuditoria,
+    EnderecoAuditoria, ModeloAuditoria,
+    HorarioFuncionamento, DataFechamento, TurnoFuncionario, AusenciaFuncionario
 )
 
 
@@ -65,22 +81,50 @@ class CargoAdmin(admin.ModelAdmin):
     total_funcionarios.short_description = "Funcionários"
 
 
+class TurnoFuncionarioInline(admin.TabularInline):
+    model = TurnoFuncionario
+    extra = 0
+
+
+class AusenciaFuncionarioInline(admin.TabularInline):
+    model = AusenciaFuncionario
+    extra = 0
+
+
+class HabilitadoParaServicoFilter(admin.SimpleListFilter):
+    """Filtra funcionários pelo índice de habilidades em memória"""
+    title = 'habilitado para o serviço'
+    parameter_name = 'habilitado_para'
+    
+    def lookups(self, request, model_admin):
+        return Servico.objects.filter(ativo=True).values_list('pk', 'nome')
+    
+    def queryset(self, request, queryset):
+        if self.value() and self.value().isdigit():
+            return queryset.filter(pk__in=funcionarios_habilitados(int(self.value())))
+        return queryset
+
+
 @admin.register(Funcionario)
 class FuncionarioAdmin(admin.ModelAdmin):
     """Admin para modelo Funcionario"""
     
+    inlines = [TurnoFuncionarioInline, AusenciaFuncionarioInline]
+    filter_horizontal = ['servicos']
+    
     list_display = [
         'codigo_funcionario', 'usuario', 'cargo', 
         'data_contratacao', 'salario', 'ativo'
     ]
-    list_filter = ['cargo', 'ativo', 'data_contratacao']
+    list_filter = ['cargo', 'ativo', HabilitadoParaServicoFilter, 'data_contratacao']
     search_fields = [
         'codigo_funcionario', 'usuario__first_name', 
         'usuario__last_name', 'cargo__nome'
     ]
     ordering = ['-data_contratacao']
     
-    readonly_fields = ['codigo_funcionario', 'data_criacao']
+    readonly_fields = ['codigo_funcionario', 'data_criacao', 'link_calendario']
+    actions = ['gerar_novo_link_calendario']
     
     fieldsets = [
         ('Informações Básicas', {
@@ -89,27 +133,45 @@ class FuncionarioAdmin(admin.ModelAdmin):
         ('Dados de Contratação', {
             'fields': ['data_contratacao', 'data_demissao', 'salario']
         }),
+        ('Serviços', {
+            'fields': ['servicos']
+        }),
         ('Observações', {
             'fields': ['observacoes', 'ativo'],
             'classes': ['collapse']
         }),
         ('Controle', {
-            'fields': ['data_criacao'],
+            'fields': ['data_criacao', 'link_calendario'],
             'classes': ['collapse']
         }),
     ]
+    
+    def link_calendario(self, obj):
+        if not obj.pk:
+            return '-'
+        return reverse('core:agenda_funcionario_ics', args=[obj.token_calendario])
+    link_calendario.short_description = "Link da agenda (.ics)"
+    
+    def gerar_novo_link_calendario(self, request, queryset):
+        # update() direto: trocar o link não deve invalidar escala e disponibilidade
+        for funcionario_id in queryset.values_list('pk', flat=True):
+            Funcionario.objects.filter(pk=funcionario_id).update(token_calendario=uuid.uuid4())
+        self.message_user(request, 'Novos links de agenda gerados; os links antigos deixaram de funcionar.')
+    gerar_novo_link_calendario.short_description = "Gerar novo link da agenda (.ics)"
 
 
 @admin.register(Servico)
 class ServicoAdmin(admin.ModelAdmin):
     """Admin para modelo Servico"""
     
+    form = ServicoForm
+    
     list_display = ['nome', 'preco', 'duracao_formatada', 'ativo', 'data_criacao']
     list_filter = ['ativo', 'data_criacao']
     search_fields = ['nome', 'descricao']
     ordering = ['nome']
     
-    readonly_fields = ['data_criacao']
+    readonly_fields = ['data_criacao', 'data_atualizacao']
     
     fieldsets = [
         ('Informações do Serviço', {
@@ -119,7 +181,7 @@ class ServicoAdmin(admin.ModelAdmin):
             'fields': ['preco', 'duracao_minutos']
         }),
         ('Controle', {
-            'fields': ['data_criacao'],
+            'fields': ['data_criacao', 'data_atualizacao'],
             'classes': ['collapse']
         }),
     ]
@@ -129,6 +191,8 @@ class ServicoAdmin(admin.ModelAdmin):
 class AgendamentoAdmin(admin.ModelAdmin):
     """Admin para modelo Agendamento"""
     
+    form = AgendamentoAdminForm
+    
     list_display = [
         'cliente', 'funcionario', 'servico', 
         'data_agendamento', 'status', 'valor_final'
@@ -155,7 +219,7 @@ class AgendamentoAdmin(admin.ModelAdmin):
             'classes': ['collapse']
         }),
         ('Controle', {
-            'fields': ['criado_por', 'data_criacao', 'data_atualizacao'],
+            'fields': ['criado_por', 'serie', 'data_criacao', 'data_atualizacao'],
             'classes': ['collapse']
         }),
     ]
@@ -163,7 +227,42 @@ class AgendamentoAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         if not change:  # Novo agendamento
             obj.criado_por = request.user
-        super().save_model(request, obj, form, change)
+        # Grava com a agenda do funcionário travada, como o formulário da interface
+        confirmar_agendamento(obj)
+
+
+@admin.register(SerieAgendamento)
+class SerieAgendamentoAdmin(admin.ModelAdmin):
+    """Admin para séries de agendamentos recorrentes"""
+    
+    form = SerieAgendamentoForm
+    
+    list_display = [
+        'cliente', 'funcionario', 'servico', 'regra',
+        'primeira_data', 'quantidade', 'data_limite'
+    ]
+    list_filter = ['regra', 'servico', 'funcionario']
+    search_fields = [
+        'cliente__first_name', 'cliente__last_name',
+        'funcionario__usuario__first_name', 'funcionario__usuario__last_name'
+    ]
+    ordering = ['-primeira_data']
+    
+    def get_readonly_fields(self, request, obj=None):
+        # As ocorrências já criadas não acompanham mudanças na regra
+        if obj:
+            return [
+                'cliente', 'funcionario', 'servico', 'regra', 'primeira_data',
+                'quantidade', 'data_limite', 'criado_por', 'data_criacao'
+            ]
+        return []
+    
+    def save_model(self, request, obj, form, change):
+        if change:
+            super().save_model(request, obj, form, change)
+        else:
+            obj.criado_por = request.user
+            criar_serie(obj, request=request, inicios=form.inicios)
 
 
 @admin.register(ConfiguracaoEmpresa)
@@ -198,6 +297,117 @@ class ConfiguracaoEmpresaAdmin(admin.ModelAdmin):
     readonly_fields = ['data_atualizacao']
 
 
+@admin.register(HorarioFuncionamento)
+class HorarioFuncionamentoAdmin(admin.ModelAdmin):
+    """Admin para faixas de horário de funcionamento"""
+    
+    list_display = ['dia_semana', 'hora_inicio', 'hora_fim']
+    list_filter = ['dia_semana']
+    ordering = ['dia_semana', 'hora_inicio']
+
+
+@admin.register(DataFechamento)
+class DataFechamentoAdmin(admin.ModelAdmin):
+    """Admin para feriados e datas fechadas"""
+    
+    list_display = ['data', 'descricao', 'recorrente']
+    list_filter = ['recorrente']
+    search_fields = ['descricao']
+    ordering = ['-data']
+
+
+# Parâmetros da paginação por cursor do changelist de auditoria
+ANTES_VAR = 'antes'
+DEPOIS_VAR = 'depois'
+# Usuários considerados na busca por nome (cada um vira um id na consulta dos logs)
+BUSCA_MAXIMO_USUARIOS = 100
+
+
+def contagem_estimada(queryset):
+    """
+    Quantidade de linhas do queryset. No PostgreSQL é a estimativa do
+    planejador (EXPLAIN, a partir das estatísticas em pg_class), sem
+    percorrer a tabela; nos outros bancos, COUNT(*).
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plano = cursor.fetchone()[0]
+    if isinstance(plano, str):
+        plano = json.loads(plano)
+    return int(plano[0]['Plan']['Plan Rows'])
+
+
+def _cursor(log):
+    return f'{log.timestamp.isoformat()}_{log.pk}'
+
+
+def _ler_cursor(valor):
+    momento, _, pk = valor.rpartition('_')
+    momento = parse_datetime(momento)
+    if momento is None or not pk.isdigit():
+        raise IncorrectLookupParameters
+    return momento, int(pk)
+
+
+class ChangeListAuditoria(ChangeList):
+    """
+    Changelist dos logs por cursor em (timestamp, id): cada página é uma
+    consulta com LIMIT no índice, sem OFFSET e sem COUNT(*) da tabela
+    inteira (a quantidade exibida é estimada, ver contagem_estimada)
+    """
+    
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for parametro in (ANTES_VAR, DEPOIS_VAR):
+            lookup_params.pop(parametro, None)
+        return lookup_params
+    
+    def get_ordering(self, request, queryset):
+        # O cursor só funciona na ordem do índice
+        return ['-timestamp', '-pk']
+    
+    def get_results(self, request):
+        tamanho = self.list_per_page
+        antes, depois = request.GET.get(ANTES_VAR), request.GET.get(DEPOIS_VAR)
+        if depois:
+            momento, pk = _ler_cursor(depois)
+            pagina = list(self.queryset.filter(timestamp__gte=momento).exclude(
+                timestamp=momento, pk__lte=pk
+            ).order_by('timestamp', 'pk')[:tamanho + 1])
+            mais_recentes, mais_antigos = len(pagina) > tamanho, True
+            pagina = pagina[:tamanho][::-1]
+        else:
+            queryset = self.queryset
+            if antes:
+                momento, pk = _ler_cursor(antes)
+                # Um só intervalo no índice (um OR das condições faria o banco ordenar o resultado)
+                queryset = queryset.filter(timestamp__lte=momento).exclude(timestamp=momento, pk__gte=pk)
+            pagina = list(queryset[:tamanho + 1])
+            mais_recentes, mais_antigos = bool(antes), len(pagina) > tamanho
+            pagina = pagina[:tamanho]
+        carregar_valores(pagina)
+        
+        self.result_list = pagina
+        self.result_count = contagem_estimada(self.queryset)
+        self.contagem_exata = connection.vendor != 'postgresql'
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = bool(pagina)
+        self.can_show_all = False
+        self.multi_page = mais_recentes or mais_antigos
+        self.paginator = None
+        
+        self.url_mais_recentes = self.url_anteriores = self.url_mais_antigos = None
+        if mais_recentes and pagina:
+            self.url_mais_recentes = self.get_query_string(remove=[ANTES_VAR, DEPOIS_VAR])
+            self.url_anteriores = self.get_query_string({DEPOIS_VAR: _cursor(pagina[0])}, [ANTES_VAR])
+        if mais_antigos and pagina:
+            self.url_mais_antigos = self.get_query_string({ANTES_VAR: _cursor(pagina[-1])}, [DEPOIS_VAR])
+
+
 @admin.register(LogAuditoria)
 class LogAuditoriaAdmin(admin.ModelAdmin):
     """Admin para logs de auditoria (apenas leitura)"""
@@ -206,17 +416,49 @@ class LogAuditoriaAdmin(admin.ModelAdmin):
         'timestamp', 'usuario', 'acao', 'modelo', 
         'objeto_repr', 'ip_address'
     ]
-    list_filter = ['acao', 'modelo', 'timestamp']
-    search_fields = [
-        'usuario__username', 'usuario__first_name', 'usuario__last_name',
-        'modelo', 'objeto_repr', 'ip_address'
-    ]
-    ordering = ['-timestamp']
+    list_filter = ['acao', 'modelo_auditado', 'timestamp']
+    list_select_related = ['usuario']
+    sortable_by = []
+    show_full_result_count = False
+    # Só para exibir a caixa de busca; a busca é feita em get_search_results
+    search_fields = ['usuario__username', 'modelo_auditado__valor', 'endereco_ip__valor', 'objeto_id']
+    search_help_text = 'Início do nome do usuário ou do modelo, IP ou id do objeto'
+    ordering = ['-timestamp', '-id']
     
     readonly_fields = [
         'usuario', 'acao', 'modelo', 'objeto_id', 'objeto_repr',
         'detalhes', 'ip_address', 'user_agent', 'timestamp'
     ]
+    # Modelo, IP e user agent aparecem como texto, não como as chaves estrangeiras
+    fields = readonly_fields
+    
+    def get_changelist(self, request, **kwargs):
+        return ChangeListAuditoria
+    
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Busca só pelo que tem índice: id do objeto, IP exato ou início do
+        nome do usuário/modelo. Usuários e modelos são procurados nas suas
+        tabelas (pequenas) e os logs filtrados pelos ids encontrados.
+        """
+        termo = search_term.strip()
+        if not termo:
+            return queryset, False
+        if termo.isdigit():
+            return queryset.filter(objeto_id=int(termo)), False
+        
+        endereco = EnderecoAuditoria.chave(termo)
+        if endereco is not None:
+            ids = EnderecoAuditoria.objects.filter(valor=endereco).values_list('pk', flat=True)
+            return queryset.filter(endereco_ip_id__in=list(ids)), False
+        
+        usuarios = Usuario.objects.filter(
+            Q(username__istartswith=termo) | Q(first_name__istartswith=termo) | Q(last_name__istartswith=termo)
+        ).values_list('pk', flat=True)[:BUSCA_MAXIMO_USUARIOS]
+        modelos = ModeloAuditoria.objects.filter(valor__istartswith=termo).values_list('pk', flat=True)
+        return queryset.filter(
+            Q(usuario_id__in=list(usuarios)) | Q(modelo_auditado_id__in=list(modelos))
+        ), False
     
     def has_add_permission(self, request):
         return False
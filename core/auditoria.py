@@ -0,0 +1,392 @@
+"""
+Gravação em lote dos logs de auditoria
+
+LogAuditoria.registrar não faz mais um INSERT por chamada: monta o log e o
+entrega a enfileirar(), que o coloca na fila da requisição depois do commit
+da transação em andamento (alterações desfeitas não são registradas). Logs
+do mesmo objeto na mesma requisição (o do signal e o da view, por exemplo)
+são mesclados em um só. A fila é entregue quando atinge
+AUDITORIA_LOTE_TAMANHO logs, quando o mais antigo passa de
+AUDITORIA_LOTE_SEGUNDOS ou no fim da requisição (AuditoriaMiddleware); fora
+de requisições (comandos, shell) cada log é entregue na hora.
+
+AUDITORIA_MODO define o que acontece com os logs entregues:
+
+- 'sincrono': gravados com bulk_create na própria thread, antes da resposta
+  (um INSERT por requisição).
+- 'assincrono': vão para uma fila única do processo, gravada em lotes por
+  uma thread em segundo plano. A resposta não espera o banco; os logs
+  ainda na fila se perdem se o processo for morto.
+
+Os signals guardam em detalhes['alteracoes'] só os campos alterados
+({campo: [antes, depois]}), comparando com o estado carregado do banco
+(EstadoOriginalMixin), e não registram saves sem alteração.
+
+Modelo, IP e user agent ficam em tabelas próprias (ValorAuditoria), cada
+valor gravado uma vez; o log guarda só ids pequenos. Um LRU por processo
+(AUDITORIA_VALORES_CACHE_TAMANHO entradas por tabela) mapeia valor -> id e
+id -> valor: com o cache aquecido, registrar e exibir logs não consultam
+essas tabelas, e os valores que faltam são buscados (ou criados) uma vez
+por lote.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Campos que mudam sozinhos em todo save ou que não devem ir para o log
+CAMPOS_IGNORADOS = {'last_login', 'data_atualizacao'}
+CAMPOS_SENSIVEIS = {'password'}
+
+_local = threading.local()
+_gravador = None
+_trava = threading.Lock()
+_codificador = DjangoJSONEncoder()
+
+
+def _valor_json(valor):
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    try:
+        return _codificador.default(valor)
+    except TypeError:
+        return str(valor)
+
+
+def alteracoes(objeto):
+    """
+    {campo: [antes, depois]} com os campos alterados desde que o objeto foi
+    carregado do banco, ou None se o estado anterior não é conhecido
+    """
+    original = objeto._estado_original
+    if not original:
+        return None
+    resultado = {}
+    for field in objeto._meta.concrete_fields:
+        campo = field.attname
+        if campo in CAMPOS_IGNORADOS or campo not in original:
+            continue
+        antes, depois = original[campo], getattr(objeto, campo)
+        if antes == depois:
+            continue
+        if campo in CAMPOS_SENSIVEIS:
+            resultado[campo] = ['***', '***']
+        else:
+            resultado[campo] = [_valor_json(antes), _valor_json(depois)]
+    return resultado
+
+
+class CacheValores:
+    """LRU valor -> id (e id -> valor) de uma tabela de ValorAuditoria"""
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.ids = OrderedDict()
+        self.valores = OrderedDict()
+        self.trava = threading.Lock()
+
+    def _guardar(self, valor, id):
+        tamanho = settings.AUDITORIA_VALORES_CACHE_TAMANHO
+        for mapa, chave, item in ((self.ids, valor, id), (self.valores, id, valor)):
+            mapa[chave] = item
+            mapa.move_to_end(chave)
+            if len(mapa) > tamanho:
+                mapa.popitem(last=False)
+
+    def id_em_cache(self, valor):
+        with self.trava:
+            id = self.ids.get(valor)
+            if id is not None:
+                self.ids.move_to_end(valor)
+            return id
+
+    def ids_de(self, valores):
+        """{valor: id}, gravando os valores novos; valores inválidos ficam de fora"""
+        resultado, faltando = {}, set()
+        with self.trava:
+            for valor in valores:
+                if valor in self.ids:
+                    self.ids.move_to_end(valor)
+                    resultado[valor] = self.ids[valor]
+                else:
+                    faltando.add(valor)
+        if not faltando:
+            return resultado
+
+        modelo, campo = self.modelo, self.modelo.CAMPO_CHAVE
+        chaves = {}
+        for valor in faltando:
+            chave = modelo.chave(valor)
+            if chave is not None:
+                chaves.setdefault(chave, []).append(valor)
+
+        def buscar(procuradas):
+            return dict(modelo.objects.filter(**{f'{campo}__in': procuradas}).values_list(campo, 'pk'))
+
+        encontrados = buscar(list(chaves))
+        novas = [chave for chave in chaves if chave not in encontrados]
+        if novas:
+            # Outro processo pode gravar o mesmo valor ao mesmo tempo
+            modelo.objects.bulk_create([modelo.novo(chaves[chave][0]) for chave in novas], ignore_conflicts=True)
+            encontrados.update(buscar(novas))
+        with self.trava:
+            for chave, id in encontrados.items():
+                for valor in chaves[chave]:
+                    self._guardar(valor, id)
+                    resultado[valor] = id
+        return resultado
+
+    def valores_de(self, ids):
+        """{id: valor}"""
+        resultado, faltando = {}, set()
+        with self.trava:
+            for id in ids:
+                if id in self.valores:
+                    self.valores.move_to_end(id)
+                    resultado[id] = self.valores[id]
+                else:
+                    faltando.add(id)
+        if faltando:
+            encontrados = dict(self.modelo.objects.filter(pk__in=faltando).values_list('pk', 'valor'))
+            with self.trava:
+                for id, valor in encontrados.items():
+                    self._guardar(valor, id)
+            resultado.update(encontrados)
+        return resultado
+
+
+_caches = {}
+
+
+def _cache(modelo):
+    if modelo not in _caches:
+        with _trava:
+            _caches.setdefault(modelo, CacheValores(modelo))
+    return _caches[modelo]
+
+
+def id_em_cache(modelo, valor):
+    """Id do valor se ele já está no cache, sem consultar o banco"""
+    return _cache(modelo).id_em_cache(valor)
+
+
+def valores_de(modelo, ids):
+    return _cache(modelo).valores_de(ids)
+
+
+def limpar_cache_valores():
+    _caches.clear()
+
+
+def resolver_valores(logs):
+    """Preenche os ids de modelo, IP e user agent atribuídos aos logs e ainda não resolvidos"""
+    from .models import LogAuditoria
+    for campo in LogAuditoria.CAMPOS_VALOR.values():
+        attname = f'{campo}_id'
+        pendentes = [
+            log for log in logs
+            if getattr(log, attname) is None and log.__dict__.get('_valores', {}).get(campo) is not None
+        ]
+        if pendentes:
+            ids = _cache(LogAuditoria._meta.get_field(campo).related_model).ids_de(
+                {log._valores[campo] for log in pendentes}
+            )
+            for log in pendentes:
+                setattr(log, attname, ids.get(log._valores[campo]))
+
+
+def carregar_valores(logs):
+    """Carrega os textos de modelo, IP e user agent dos logs lidos do banco, uma consulta por tabela"""
+    from .models import LogAuditoria
+    for campo in LogAuditoria.CAMPOS_VALOR.values():
+        attname = f'{campo}_id'
+        ids = {getattr(log, attname) for log in logs} - {None}
+        if not ids:
+            continue
+        valores = valores_de(LogAuditoria._meta.get_field(campo).related_model, ids)
+        for log in logs:
+            id = getattr(log, attname)
+            if id is not None:
+                log.__dict__.setdefault('_valores', {})[campo] = valores[id]
+
+
+def _descartar(log):
+    logger.exception('Falha ao gravar log de auditoria (%s %s %s)', log.acao, log.modelo, log.objeto_id)
+
+
+def gravar(logs):
+    """
+    Grava os logs com bulk_create. Se o lote falhar, os logs são gravados um
+    a um, cada um no seu savepoint, e só os que falharem são registrados no
+    log e descartados
+    """
+    from .models import LogAuditoria
+    try:
+        # Fora do savepoint: os valores novos de modelo, IP e user agent já
+        # estão no cache e não podem ser desfeitos junto com o lote
+        resolver_valores(logs)
+        with transaction.atomic():
+            LogAuditoria.objects.bulk_create(logs, batch_size=settings.AUDITORIA_LOTE_TAMANHO)
+        return
+    except Exception:
+        if len(logs) == 1:
+            _descartar(logs[0])
+            return
+    
+    for log in logs:
+        # Lotes anteriores ao que falhou já tinham recebido o id
+        log.pk = None
+        try:
+            with transaction.atomic():
+                LogAuditoria.objects.bulk_create([log])
+        except Exception:
+            _descartar(log)
+
+
+class GravadorAuditoria(threading.Thread):
+    """Thread do modo assíncrono: junta os logs da fila do processo em lotes"""
+
+    FIM = object()
+
+    def __init__(self):
+        super().__init__(name='gravador-auditoria', daemon=True)
+        self.fila = queue.SimpleQueue()
+
+    def run(self):
+        encerrar = False
+        while not encerrar:
+            lote = []
+            primeiro = self.fila.get()
+            if primeiro is self.FIM:
+                return
+            lote.append(primeiro)
+            limite = time.monotonic() + settings.AUDITORIA_LOTE_SEGUNDOS
+            while len(lote) < settings.AUDITORIA_LOTE_TAMANHO:
+                try:
+                    log = self.fila.get(timeout=max(limite - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if log is self.FIM:
+                    encerrar = True
+                    break
+                lote.append(log)
+            self.gravar(lote)
+
+    def gravar(self, lote):
+        close_old_connections()
+        gravar(lote)
+
+    def encerrar(self, timeout=5):
+        """Grava o que restou na fila e encerra a thread"""
+        self.fila.put(self.FIM)
+        self.join(timeout)
+
+
+def _gravador_do_processo():
+    """Gravador assíncrono deste processo, iniciado no primeiro uso (e após um fork)"""
+    global _gravador
+    with _trava:
+        if _gravador is None or not _gravador.is_alive():
+            _gravador = GravadorAuditoria()
+            _gravador.start()
+            atexit.register(_gravador.encerrar)
+    return _gravador
+
+
+def _entregar(logs):
+    if settings.AUDITORIA_MODO == 'assincrono':
+        gravador = _gravador_do_processo()
+        for log in logs:
+            gravador.fila.put(log)
+    else:
+        gravar(logs)
+
+
+def _chave(log):
+    """Logs com a mesma chave na mesma requisição viram um só"""
+    if log.objeto_id is None:
+        return None
+    return log.modelo, log.objeto_id, log.acao == 'delete'
+
+
+def _mesclar(existente, novo):
+    if novo.acao == 'create':
+        existente.acao = 'create'
+    # O log feito pela view (com request) identifica quem fez a alteração
+    if novo.ip_address is not None or novo.user_agent is not None or existente.usuario_id is None:
+        existente.usuario_id = novo.usuario_id or existente.usuario_id
+        existente.ip_address = novo.ip_address or existente.ip_address
+        existente.user_agent = novo.user_agent or existente.user_agent
+    existente.objeto_repr = novo.objeto_repr or existente.objeto_repr
+
+    detalhes = dict(existente.detalhes)
+    mudancas = dict(detalhes.get('alteracoes', {}))
+    for campo, (antes, depois) in novo.detalhes.get('alteracoes', {}).items():
+        mudancas[campo] = [mudancas[campo][0] if campo in mudancas else antes, depois]
+    detalhes.update({chave: valor for chave, valor in novo.detalhes.items() if chave != 'alteracoes'})
+    if mudancas:
+        detalhes['alteracoes'] = mudancas
+    existente.detalhes = detalhes
+
+
+def _adicionar(log):
+    if not getattr(_local, 'requisicoes', 0):
+        _entregar([log])
+        return
+
+    fila = getattr(_local, 'fila', None)
+    if not fila:
+        fila = _local.fila = []
+        _local.indice = {}
+        _local.desde = time.monotonic()
+    chave = _chave(log)
+    if chave in _local.indice:
+        _mesclar(_local.indice[chave], log)
+    else:
+        fila.append(log)
+        if chave is not None:
+            _local.indice[chave] = log
+
+    if (
+        len(fila) >= settings.AUDITORIA_LOTE_TAMANHO
+        or time.monotonic() - _local.desde >= settings.AUDITORIA_LOTE_SEGUNDOS
+    ):
+        descarregar()
+
+
+def enfileirar(log):
+    """Coloca o log (ainda não salvo) na fila, após o commit da transação em andamento"""
+    transaction.on_commit(lambda: _adicionar(log))
+
+
+def descarregar():
+    """Entrega os logs pendentes da requisição na thread atual"""
+    fila = getattr(_local, 'fila', None)
+    if fila:
+        _local.fila = []
+        _local.indice = {}
+        _entregar(fila)
+
+
+class AuditoriaMiddleware:
+    """Entrega os logs de auditoria enfileirados durante a requisição antes da resposta"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.requisicoes = getattr(_local, 'requisicoes', 0) + 1
+        try:
+            return self.get_response(request)
+        finally:
+            _local.requisicoes -= 1
+            if not _local.requisicoes:
+                descarregar()
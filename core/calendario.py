@@ -0,0 +1,138 @@
+"""
+Feed de agendamentos para o calendário
+
+Uma única consulta por período traz só as colunas exibidas, já com cliente,
+serviço e funcionário unidos, e o JSON é gerado em blocos enquanto as linhas
+chegam do banco. A versão do período (maior data_atualizacao e quantidade de
+agendamentos) vira o ETag, então o polling dos navegadores sem mudanças custa
+uma consulta agregada e uma resposta 304.
+
+O mesmo período alimenta o feed iCalendar (.ics) de cada funcionário, com os
+VEVENTs gerados um a um a partir do iterador de agendamentos.
+"""
+import json
+from datetime import timezone as dt_timezone
+
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import Agendamento
+
+CAMPOS = [
+    'pk', 'data_agendamento', 'data_fim', 'status', 'funcionario_id',
+    'cliente__first_name', 'cliente__last_name', 'servico__nome',
+    'funcionario__usuario__first_name', 'funcionario__usuario__last_name',
+]
+
+
+def agendamentos_no_periodo(inicio, fim, funcionario_ids=None):
+    """Agendamentos não cancelados que se sobrepõem a [inicio, fim)"""
+    agendamentos = Agendamento.objects.sobrepondo(inicio, fim).exclude(status='cancelado')
+    if funcionario_ids:
+        agendamentos = agendamentos.filter(funcionario_id__in=funcionario_ids)
+    return agendamentos.order_by()
+
+
+def versao_periodo(agendamentos):
+    """(quantidade, maior data_atualizacao) dos agendamentos do período"""
+    versao = agendamentos.aggregate(total=Count('pk'), ultima=Max('data_atualizacao'))
+    return versao['total'], versao['ultima']
+
+
+def etag_periodo(agendamentos, versao=None):
+    """ETag da versão atual dos agendamentos do período"""
+    total, ultima = versao or versao_periodo(agendamentos)
+    return f"{total}-{ultima.timestamp() if ultima else 0}"
+
+
+def _evento(linha):
+    (pk, inicio, fim, status, funcionario_id, cliente_nome, cliente_sobrenome,
+     servico, funcionario_nome, funcionario_sobrenome) = linha
+    return {
+        'id': pk,
+        'title': f'{cliente_nome} {cliente_sobrenome} - {servico}'.strip(),
+        'start': timezone.localtime(inicio).isoformat(),
+        'end': timezone.localtime(fim).isoformat(),
+        'status': status,
+        'funcionario': funcionario_id,
+        'funcionario_nome': f'{funcionario_nome} {funcionario_sobrenome}'.strip(),
+    }
+
+
+def eventos_json(agendamentos, tamanho_bloco=500):
+    """Gera a lista de eventos em JSON compacto, em blocos"""
+    codificar = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+    linhas = agendamentos.order_by('data_agendamento').values_list(*CAMPOS).iterator(
+        chunk_size=tamanho_bloco
+    )
+    yield '['
+    bloco = []
+    for i, linha in enumerate(linhas):
+        bloco.append(('' if i == 0 else ',') + codificar(_evento(linha)))
+        if len(bloco) >= tamanho_bloco:
+            yield ''.join(bloco)
+            bloco = []
+    yield ''.join(bloco) + ']'
+
+
+CAMPOS_ICS = [
+    'pk', 'data_agendamento', 'data_fim', 'data_atualizacao',
+    'cliente__first_name', 'cliente__last_name', 'servico__nome', 'observacoes',
+]
+
+
+def _escapar_ics(texto):
+    return (
+        (texto or '').replace('\\', '\\\\').replace(';', '\\;')
+        .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def _linha_ics(linha):
+    """Termina a linha com CRLF, dobrando a cada 75 octetos (RFC 5545, 3.1)"""
+    if len(linha.encode('utf-8')) <= 75:
+        return linha + '\r\n'
+    partes, atual, limite = [], '', 75
+    for caractere in linha:
+        if len((atual + caractere).encode('utf-8')) > limite:
+            partes.append(atual)
+            atual, limite = caractere, 74  # A continuação começa com um espaço
+        else:
+            atual += caractere
+    partes.append(atual)
+    return '\r\n '.join(partes) + '\r\n'
+
+
+def _data_ics(momento):
+    return momento.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def eventos_ics(agendamentos, nome_calendario, dominio):
+    """Gera o arquivo iCalendar evento a evento"""
+    yield ''.join(_linha_ics(linha) for linha in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//SaaS Agendamento//Agenda do Funcionario//PT-BR',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escapar_ics(nome_calendario)}',
+    ])
+    linhas = agendamentos.order_by('data_agendamento').values_list(*CAMPOS_ICS).iterator(
+        chunk_size=500
+    )
+    for pk, inicio, fim, atualizado, nome, sobrenome, servico, observacoes in linhas:
+        evento = [
+            'BEGIN:VEVENT',
+            f'UID:agendamento-{pk}@{dominio}',
+            f'DTSTAMP:{_data_ics(atualizado)}',
+            f'LAST-MODIFIED:{_data_ics(atualizado)}',
+            f'DTSTART:{_data_ics(inicio)}',
+            f'DTEND:{_data_ics(fim)}',
+            f'SUMMARY:{_escapar_ics(f"{servico} - {nome} {sobrenome}".strip())}',
+            'STATUS:CONFIRMED',
+        ]
+        if observacoes:
+            evento.append(f'DESCRIPTION:{_escapar_ics(observacoes)}')
+        evento.append('END:VEVENT')
+        yield ''.join(_linha_ics(linha) for linha in evento)
+    yield _linha_ics('END:VCALENDAR')
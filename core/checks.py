@@ -0,0 +1,49 @@
+"""
+Verificações de configuração (manage.py check)
+
+Expediente, escalas e habilidades ficam compilados na memória de cada
+processo, e as chaves de versão no cache avisam os demais processos quando
+as regras mudam. Com um cache local ao processo (LocMemCache) ou sem cache
+(DummyCache), os outros workers e o worker de relatórios continuam usando
+regras antigas.
+"""
+import os
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+CACHES_LOCAIS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def _cache_local():
+    return settings.CACHES['default']['BACKEND'] in CACHES_LOCAIS
+
+
+@register(Tags.caches)
+def verificar_cache_com_varios_workers(app_configs, **kwargs):
+    """Erro com cache local e mais de um worker (WEB_CONCURRENCY, lido pelo gunicorn)"""
+    workers = int(os.environ.get('WEB_CONCURRENCY') or 1)
+    if _cache_local() and workers > 1:
+        return [Error(
+            f'O cache padrão ({settings.CACHES["default"]["BACKEND"]}) não é compartilhado '
+            f'entre os {workers} workers: alterações de expediente, escalas e habilidades '
+            'não chegariam aos demais processos.',
+            hint='Configure CACHE_BACKEND e CACHE_LOCATION com um cache compartilhado (ex.: Redis).',
+            id='core.E001',
+        )]
+    return []
+
+
+@register(Tags.caches, deploy=True)
+def verificar_cache_compartilhado(app_configs, **kwargs):
+    if _cache_local():
+        return [Warning(
+            'O cache padrão é local ao processo; o worker de relatórios e outros processos '
+            'não recebem as invalidações de expediente, escalas e habilidades.',
+            hint='Configure CACHE_BACKEND e CACHE_LOCATION com um cache compartilhado (ex.: Redis).',
+            id='core.W001',
+        )]
+    return []
@@ -0,0 +1,89 @@
+"""
+Detecção de conflitos de horário na agenda dos funcionários
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Agendamento, Servico
+
+CHAVE_DURACAO_MAXIMA = 'servicos:duracao_maxima'
+
+
+def duracao_maxima_servicos():
+    """
+    Retorna a maior duração (em minutos) entre os serviços cadastrados. O
+    valor fica no cache até um serviço ser salvo ou excluído.
+    """
+    maximo = cache.get(CHAVE_DURACAO_MAXIMA)
+    if maximo is None:
+        maximo = Servico.objects.aggregate(maximo=Max('duracao_minutos'))['maximo'] or 0
+        cache.set(CHAVE_DURACAO_MAXIMA, maximo, None)
+    return maximo
+
+
+def invalidar_duracao_maxima():
+    cache.delete(CHAVE_DURACAO_MAXIMA)
+
+
+def buscar_conflitos(funcionario, inicio, fim, excluir_pk=None):
+    """
+    Retorna os agendamentos ativos do funcionário que se sobrepõem ao
+    intervalo [inicio, fim).
+
+    Nenhum agendamento que comece antes de ``inicio - duração máxima`` pode
+    terminar depois de ``inicio``, então a busca fica limitada a uma janela
+    fixa do índice (funcionario, data_agendamento), independente do tamanho
+    do histórico. O fim de cada agendamento vem da coluna ``data_fim``.
+    """
+    candidatos = Agendamento.objects.ativos().sobrepondo(inicio, fim).filter(
+        funcionario=funcionario
+    ).select_related('servico', 'cliente').order_by('data_agendamento')
+
+    if excluir_pk:
+        candidatos = candidatos.exclude(pk=excluir_pk)
+
+    return list(candidatos)
+
+
+def primeiro_conflito(funcionario, inicio, fim, excluir_pk=None):
+    """Retorna o primeiro agendamento conflitante ou None"""
+    conflitos = buscar_conflitos(funcionario, inicio, fim, excluir_pk=excluir_pk)
+    return conflitos[0] if conflitos else None
+
+
+def conflitos_com_duracao(servico, duracao_minutos, agora=None):
+    """
+    Retorna os pares (agendamento, conflitante) que passariam a se sobrepor
+    se o serviço durasse ``duracao_minutos``. Só os agendamentos pendentes
+    do serviço (Servico.agendamentos_pendentes) mudam de duração; eles são
+    comparados com a agenda ativa dos mesmos funcionários, já com os
+    outros pendentes do serviço também alterados.
+    """
+    agora = agora or timezone.now()
+    duracao = timedelta(minutes=duracao_minutos)
+    pendentes = list(servico.agendamentos_pendentes(agora).only(
+        'pk', 'funcionario_id', 'data_agendamento'
+    ))
+    if not pendentes:
+        return []
+
+    vizinhos = Agendamento.objects.ativos().filter(
+        funcionario_id__in={agendamento.funcionario_id for agendamento in pendentes},
+        data_fim__gt=agora,
+        data_agendamento__lt=max(agendamento.data_agendamento for agendamento in pendentes) + duracao,
+    ).select_related('servico', 'cliente').order_by('funcionario_id', 'data_agendamento', 'pk')
+    pendentes_ids = {agendamento.pk for agendamento in pendentes}
+
+    conflitos = []
+    anterior = fim_anterior = None
+    for agendamento in vizinhos:
+        fim = agendamento.data_agendamento + duracao if agendamento.pk in pendentes_ids else agendamento.data_fim
+        if (anterior is not None and anterior.funcionario_id == agendamento.funcionario_id
+                and agendamento.data_agendamento < fim_anterior):
+            conflitos.append((anterior, agendamento))
+        if anterior is None or anterior.funcionario_id != agendamento.funcionario_id or fim > fim_anterior:
+            anterior, fim_anterior = agendamento, fim
+    return conflitos
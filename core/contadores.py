@@ -0,0 +1,107 @@
+"""
+Contadores de usuários, clientes, funcionários e serviços ativos
+
+Cada contador é uma linha de ContadorEntidade. Os signals de Usuario,
+Funcionario e Servico comparam o estado anterior do objeto com o atual e
+somam +1/-1 com UPDATE ... SET valor = valor + delta, na mesma transação do
+save, então o dashboard lê os totais sem COUNT(*) sobre as tabelas.
+Alterações feitas com queryset.update() não passam pelos signals; o comando
+reconciliar_contadores corrige essa diferença.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import ContadorEntidade, Funcionario, Servico, Usuario
+
+# nome do contador: (modelo, filtros que o objeto precisa atender para contar)
+CONTADORES = {
+    'usuarios': (Usuario, {'ativo': True}),
+    'clientes': (Usuario, {'tipo': 'cliente', 'ativo': True}),
+    'funcionarios': (Funcionario, {'ativo': True}),
+    'servicos': (Servico, {'ativo': True}),
+}
+
+
+def contar(nome):
+    """Valor do contador calculado direto da tabela"""
+    modelo, filtros = CONTADORES[nome]
+    return modelo.objects.filter(**filtros).count()
+
+
+def contadores_do_objeto(objeto, original=False):
+    """
+    Nomes dos contadores em que o objeto entra. Com original=True usa o
+    estado carregado do banco.
+    """
+    if original:
+        valor = objeto.valor_original
+    else:
+        def valor(campo):
+            return getattr(objeto, campo)
+    return {
+        nome for nome, (modelo, filtros) in CONTADORES.items()
+        if isinstance(objeto, modelo)
+        and all(valor(campo) == esperado for campo, esperado in filtros.items())
+    }
+
+
+def aplicar(nome, delta):
+    """Soma delta ao contador, criando a linha (com a contagem real) se faltar"""
+    contador = ContadorEntidade.objects.filter(nome=nome)
+    if contador.update(valor=F('valor') + delta):
+        return
+    try:
+        with transaction.atomic():
+            # O objeto alterado já está gravado, então a contagem o inclui
+            ContadorEntidade.objects.create(nome=nome, valor=contar(nome))
+    except IntegrityError:
+        contador.update(valor=F('valor') + delta)
+
+
+def registrar_alteracao(objeto, created):
+    atuais = contadores_do_objeto(objeto)
+    anteriores = set() if created else contadores_do_objeto(objeto, original=True)
+    for nome in atuais - anteriores:
+        aplicar(nome, 1)
+    for nome in anteriores - atuais:
+        aplicar(nome, -1)
+
+
+def registrar_exclusao(objeto):
+    for nome in contadores_do_objeto(objeto, original=bool(objeto._estado_original)):
+        aplicar(nome, -1)
+
+
+def obter_contadores():
+    """{nome: valor} de todos os contadores, em uma consulta"""
+    valores = dict(ContadorEntidade.objects.filter(
+        nome__in=CONTADORES
+    ).values_list('nome', 'valor'))
+    for nome in CONTADORES.keys() - valores.keys():
+        aplicar(nome, 0)
+        valores[nome] = ContadorEntidade.objects.get(nome=nome).valor
+    return valores
+
+
+def reconciliar_contadores():
+    """
+    Recalcula todos os contadores a partir das tabelas. Retorna
+    {nome: (valor anterior, valor correto)} dos que estavam errados.
+    """
+    corrigidos = {}
+    with transaction.atomic():
+        existentes = {
+            contador.nome: contador
+            for contador in ContadorEntidade.objects.select_for_update().filter(nome__in=CONTADORES)
+        }
+        for nome in CONTADORES:
+            correto = contar(nome)
+            contador = existentes.get(nome)
+            if contador is None:
+                ContadorEntidade.objects.create(nome=nome, valor=correto)
+                corrigidos[nome] = (None, correto)
+            elif contador.valor != correto:
+                corrigidos[nome] = (contador.valor, correto)
+                contador.valor = correto
+                contador.save(update_fields=['valor'])
+    return corrigidos
@@ -0,0 +1,387 @@
+"""
+Busca de horários livres na agenda dos funcionários
+
+A agenda de cada funcionário é representada como um vetor booleano com um
+elemento por minuto do período consultado (linhas = funcionários). Os
+agendamentos são marcados de uma só vez com um vetor de diferenças e soma
+acumulada, e os horários de início válidos saem de uma única comparação
+vetorizada, sem testar candidato por candidato.
+
+Os minutos livres de cada funcionário por dia ficam pré-calculados em
+DisponibilidadeDiaria para os próximos AGENDA_JANELA_CACHE_DIAS dias. Os
+signals de Agendamento atualizam apenas o funcionário e os dias afetados, e
+as buscas leem esses snapshots em vez de recalcular a partir dos agendamentos.
+
+A atribuição automática (atribuir_funcionario) usa a mesma matriz para todos
+os funcionários habilitados de uma vez e escolhe o primeiro horário livre.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .escala import mascara_trabalho
+from .expediente import MINUTOS_DIA
+from .habilidades import funcionarios_habilitados
+from .models import Agendamento, Funcionario, DisponibilidadeDiaria, ReservaHorario
+from .reservas import travar_funcionario
+
+
+def inicio_do_dia(data, fuso=None):
+    """Retorna o datetime (com fuso) da meia-noite local da data"""
+    return datetime.combine(data, time.min, tzinfo=fuso or timezone.get_current_timezone())
+
+
+def minuto_relativo(momento, data_inicio, fuso=None):
+    """
+    Converte um datetime no índice do minuto (horário local) contado a partir
+    de data_inicio. Retorna (índice, True se sobram segundos no minuto)
+    """
+    local = momento.astimezone(fuso or timezone.get_current_timezone())
+    dias = (local.date() - data_inicio).days
+    minuto = dias * MINUTOS_DIA + local.hour * 60 + local.minute
+    return minuto, bool(local.second or local.microsecond)
+
+
+def momentos_dos_minutos(data_inicio, minutos, fuso=None):
+    """Operação inversa de minuto_relativo para um vetor de índices"""
+    fuso = fuso or timezone.get_current_timezone()
+    dias = {}
+    momentos = []
+    for minuto in minutos:
+        dia, resto = divmod(int(minuto), MINUTOS_DIA)
+        if dia not in dias:
+            dias[dia] = inicio_do_dia(data_inicio + timedelta(days=dia), fuso)
+        momentos.append(dias[dia] + timedelta(minutes=resto))
+    return momentos
+
+
+def minutos_locais(momentos, data_inicio, n_dias, arredondar_para_cima=False, fuso=None):
+    """
+    Versão vetorizada de minuto_relativo: vetor com o índice do minuto local
+    de cada datetime, contado a partir de data_inicio e limitado a
+    [0, n_dias * 1440]. Com arredondar_para_cima, minuto parcial conta inteiro.
+
+    A posição de cada momento entre as meias-noites locais do período sai de
+    um searchsorted; só os momentos em dias com mudança de horário de verão
+    passam por minuto_relativo.
+    """
+    fuso = fuso or timezone.get_current_timezone()
+    momentos = list(momentos)
+    meias_noites = np.array([
+        inicio_do_dia(data_inicio + timedelta(days=dia), fuso).timestamp() for dia in range(n_dias + 1)
+    ])
+    segundos = np.fromiter((momento.timestamp() for momento in momentos), dtype=np.float64, count=len(momentos))
+
+    dias = np.clip(np.searchsorted(meias_noites, segundos, side='right') - 1, 0, n_dias - 1)
+    decorridos = (segundos - meias_noites[dias]) / 60
+    minutos = dias * MINUTOS_DIA + (np.ceil(decorridos) if arredondar_para_cima else np.floor(decorridos))
+
+    trocas = np.flatnonzero(np.diff(meias_noites) != MINUTOS_DIA * 60)
+    if len(trocas):
+        no_periodo = (segundos >= meias_noites[0]) & (segundos < meias_noites[-1])
+        for i in np.flatnonzero(np.isin(dias, trocas) & no_periodo):
+            minuto, fracao = minuto_relativo(momentos[i], data_inicio, fuso)
+            minutos[i] = minuto + 1 if arredondar_para_cima and fracao else minuto
+
+    return np.clip(minutos, 0, n_dias * MINUTOS_DIA).astype(np.int64)
+
+
+def _marcar_intervalos(funcionario_ids, intervalos, data_inicio, n_dias):
+    """
+    Matriz booleana (funcionários x minutos) com os minutos cobertos pelos
+    intervalos (funcionario_id, início, fim)
+    """
+    total = n_dias * MINUTOS_DIA
+    indices = {funcionario_id: i for i, funcionario_id in enumerate(funcionario_ids)}
+    diferencas = np.zeros((len(funcionario_ids), total + 1), dtype=np.int32)
+
+    intervalos = list(intervalos)
+    if intervalos:
+        funcionarios, inicios, fins = zip(*intervalos)
+        linhas = np.fromiter(
+            (indices[funcionario_id] for funcionario_id in funcionarios), dtype=np.intp, count=len(funcionarios)
+        )
+        np.add.at(diferencas, (linhas, minutos_locais(inicios, data_inicio, n_dias)), 1)
+        # Minuto parcialmente ocupado conta como ocupado
+        np.add.at(diferencas, (linhas, minutos_locais(fins, data_inicio, n_dias, arredondar_para_cima=True)), -1)
+
+    return np.cumsum(diferencas[:, :total], axis=1) > 0
+
+
+def mapa_ocupacao(funcionario_ids, data_inicio, n_dias):
+    """
+    Matriz booleana (funcionários x minutos) com os minutos ocupados por
+    agendamentos ativos no período
+    """
+    fuso = timezone.get_current_timezone()
+    agendamentos = Agendamento.objects.ativos().sobrepondo(
+        inicio_do_dia(data_inicio, fuso),
+        inicio_do_dia(data_inicio + timedelta(days=n_dias), fuso),
+    ).filter(funcionario_id__in=funcionario_ids).values_list('funcionario_id', 'data_agendamento', 'data_fim')
+    return _marcar_intervalos(funcionario_ids, agendamentos, data_inicio, n_dias)
+
+
+def mapa_reservado(funcionario_ids, data_inicio, n_dias):
+    """
+    Matriz booleana (funcionários x minutos) com os minutos bloqueados por
+    reservas de horário ainda válidas. Reservas expiram em minutos, então
+    não entram nos snapshots diários.
+    """
+    fuso = timezone.get_current_timezone()
+    reservas = ReservaHorario.objects.filter(
+        funcionario_id__in=funcionario_ids,
+        expira_em__gt=timezone.now(),
+        inicio__lt=inicio_do_dia(data_inicio + timedelta(days=n_dias), fuso),
+        fim__gt=inicio_do_dia(data_inicio, fuso),
+    ).values_list('funcionario_id', 'inicio', 'fim')
+    return _marcar_intervalos(funcionario_ids, reservas, data_inicio, n_dias)
+
+
+def mapa_livre(funcionario_ids, data_inicio, n_dias):
+    """
+    Matriz booleana (funcionários x minutos) com os minutos livres para
+    atendimento: escala de trabalho (expediente, turnos e ausências) menos
+    agendamentos
+    """
+    return mascara_trabalho(funcionario_ids, data_inicio, n_dias) & ~mapa_ocupacao(
+        funcionario_ids, data_inicio, n_dias
+    )
+
+
+def janela_cache():
+    """Retorna (primeiro dia, dia seguinte ao último) da janela pré-calculada"""
+    hoje = timezone.localdate()
+    return hoje, hoje + timedelta(days=settings.AGENDA_JANELA_CACHE_DIAS)
+
+
+def _salvar_snapshots(funcionario_ids, data_inicio, livre, substituir=True):
+    """
+    Grava os dias de livre (funcionários x dias x minutos) que estão na
+    janela. Com substituir=False, snapshots já existentes são mantidos.
+    """
+    primeiro, limite = janela_cache()
+    compactado = np.packbits(livre, axis=-1)
+    snapshots = []
+    for i, funcionario_id in enumerate(funcionario_ids):
+        for dia in range(livre.shape[1]):
+            data = data_inicio + timedelta(days=dia)
+            if primeiro <= data < limite:
+                snapshots.append(DisponibilidadeDiaria(
+                    funcionario_id=funcionario_id,
+                    data=data,
+                    minutos_livres=compactado[i, dia].tobytes(),
+                ))
+    if not substituir:
+        DisponibilidadeDiaria.objects.bulk_create(snapshots, batch_size=500, ignore_conflicts=True)
+        return
+    DisponibilidadeDiaria.objects.bulk_create(
+        snapshots,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['funcionario', 'data'],
+        update_fields=['minutos_livres', 'atualizado_em'],
+    )
+
+
+def recalcular_disponibilidade(funcionario_ids, data_inicio, n_dias):
+    """Recalcula e grava os snapshots dos funcionários no período"""
+    funcionario_ids = list(funcionario_ids)
+    if not funcionario_ids or n_dias <= 0:
+        return
+    livre = mapa_livre(funcionario_ids, data_inicio, n_dias)
+    _salvar_snapshots(
+        funcionario_ids, data_inicio,
+        livre.reshape(len(funcionario_ids), n_dias, MINUTOS_DIA)
+    )
+
+
+def atualizar_disponibilidade(dias):
+    """
+    Atualiza os snapshots afetados por uma alteração de agenda. ``dias`` é
+    um iterável de (funcionario_id, data); dias fora da janela são ignorados.
+
+    A linha de cada funcionário fica travada (travar_funcionario) até o fim
+    da transação: uma alteração concorrente na agenda dele espera o commit
+    desta e recalcula já vendo os dois agendamentos, em vez de sobrescrever
+    o snapshot com a visão da própria transação.
+    """
+    primeiro, limite = janela_cache()
+    por_funcionario = defaultdict(set)
+    for funcionario_id, data in dias:
+        if primeiro <= data < limite:
+            por_funcionario[funcionario_id].add(data)
+
+    with transaction.atomic():
+        # Sempre na mesma ordem, para duas transações não se travarem
+        for funcionario_id in sorted(por_funcionario):
+            travar_funcionario(funcionario_id)
+        for funcionario_id, datas in por_funcionario.items():
+            inicio = min(datas)
+            recalcular_disponibilidade([funcionario_id], inicio, (max(datas) - inicio).days + 1)
+
+
+def invalidar_disponibilidade(funcionario_ids=None):
+    """Descarta snapshots; eles são recalculados na próxima leitura"""
+    snapshots = DisponibilidadeDiaria.objects.all()
+    if funcionario_ids is not None:
+        snapshots = snapshots.filter(funcionario_id__in=funcionario_ids)
+    snapshots.delete()
+
+
+def mapa_livre_em_cache(funcionario_ids, data_inicio, n_dias):
+    """
+    Mesmo resultado de mapa_livre, lido dos snapshots diários. Dias sem
+    snapshot (fora da janela ou invalidados) são recalculados e gravados.
+    """
+    funcionario_ids = list(funcionario_ids)
+    indices = {funcionario_id: i for i, funcionario_id in enumerate(funcionario_ids)}
+    livre = np.zeros((len(funcionario_ids), n_dias, MINUTOS_DIA), dtype=bool)
+    encontrados = np.zeros((len(funcionario_ids), n_dias), dtype=bool)
+
+    snapshots = list(DisponibilidadeDiaria.objects.filter(
+        funcionario_id__in=indices,
+        data__gte=data_inicio,
+        data__lt=data_inicio + timedelta(days=n_dias),
+    ).values_list('funcionario_id', 'data', 'minutos_livres'))
+
+    if snapshots:
+        linhas = [indices[funcionario_id] for funcionario_id, _, _ in snapshots]
+        dias = [(data - data_inicio).days for _, data, _ in snapshots]
+        bits = np.frombuffer(
+            b''.join(bytes(minutos) for _, _, minutos in snapshots), dtype=np.uint8
+        ).reshape(len(snapshots), -1)
+        livre[linhas, dias] = np.unpackbits(bits, axis=1, count=MINUTOS_DIA).astype(bool)
+        encontrados[linhas, dias] = True
+
+    faltando = np.flatnonzero(~encontrados.all(axis=1))
+    if len(faltando):
+        ids_faltando = [funcionario_ids[i] for i in faltando]
+        recalculado = mapa_livre(ids_faltando, data_inicio, n_dias).reshape(
+            len(faltando), n_dias, MINUTOS_DIA
+        )
+        livre[faltando] = recalculado
+        # Uma leitura não trava a agenda: se uma alteração gravou o snapshot
+        # enquanto este era calculado, o dela prevalece
+        _salvar_snapshots(ids_faltando, data_inicio, recalculado, substituir=False)
+
+    return livre.reshape(len(funcionario_ids), -1)
+
+
+def inicios_validos(livre, duracao_minutos, intervalo_minutos, minimo=0):
+    """
+    Matriz booleana com os minutos em que um atendimento de duracao_minutos
+    pode começar: todos os minutos [t, t + duração) estão livres, t é múltiplo
+    do intervalo e t >= minimo
+    """
+    linhas, total = livre.shape
+    validos = np.zeros((linhas, total), dtype=bool)
+    if duracao_minutos > total:
+        return validos
+
+    bloqueados = np.zeros((linhas, total + 1), dtype=np.int32)
+    np.cumsum(~livre, axis=1, out=bloqueados[:, 1:])
+    candidatos = np.arange(0, total - duracao_minutos + 1, intervalo_minutos)
+    validos[:, candidatos] = (
+        bloqueados[:, candidatos + duracao_minutos] == bloqueados[:, candidatos]
+    )
+    validos[:, :max(minimo, 0)] = False
+    return validos
+
+
+def funcionarios_ativos():
+    """Funcionários que podem receber agendamentos"""
+    return Funcionario.objects.filter(
+        ativo=True, data_demissao__isnull=True
+    ).select_related('usuario', 'cargo')
+
+
+def buscar_horarios_livres(servico, data_inicio, data_fim, funcionarios=None):
+    """
+    Retorna uma lista de (funcionario, [datetimes de início livres]) para o
+    serviço entre data_inicio e data_fim (datas locais, inclusivas). Só entram
+    funcionários habilitados para o serviço.
+    """
+    if funcionarios is None:
+        funcionarios = funcionarios_ativos()
+    habilitados = funcionarios_habilitados(servico)
+    funcionarios = [f for f in funcionarios if f.pk in habilitados]
+    n_dias = (data_fim - data_inicio).days + 1
+    if not funcionarios or n_dias <= 0:
+        return []
+
+    ids = [funcionario.pk for funcionario in funcionarios]
+    livre = mapa_livre_em_cache(ids, data_inicio, n_dias) & ~mapa_reservado(ids, data_inicio, n_dias)
+
+    # Não oferecer horários que já passaram
+    agora, fracao = minuto_relativo(timezone.now(), data_inicio)
+    validos = inicios_validos(
+        livre,
+        servico.duracao_minutos,
+        settings.AGENDA_INTERVALO_MINUTOS,
+        minimo=agora + 1 if fracao else agora,
+    )
+
+    return [
+        (funcionario, momentos_dos_minutos(data_inicio, np.flatnonzero(validos[i])))
+        for i, funcionario in enumerate(funcionarios)
+    ]
+
+
+def carga_do_dia(funcionario_ids, data):
+    """Quantidade de agendamentos ativos de cada funcionário na data local"""
+    carga = dict(Agendamento.objects.ativos().do_dia(data).filter(
+        funcionario_id__in=funcionario_ids
+    ).values('funcionario_id').annotate(total=Count('id')).values_list('funcionario_id', 'total'))
+    return {funcionario_id: carga.get(funcionario_id, 0) for funcionario_id in funcionario_ids}
+
+
+def atribuir_funcionario(servico, inicio, fim, funcionarios=None, preferidos=()):
+    """
+    Escolhe o funcionário habilitado com o horário livre mais cedo para o
+    serviço entre os datetimes inicio e fim (o atendimento inteiro precisa
+    caber no intervalo). Retorna (funcionario, início) ou None.
+
+    Todos os candidatos são avaliados em uma única matriz de disponibilidade.
+    Empates no horário favorecem os ``preferidos`` (ids) e, depois, quem tem
+    menos agendamentos no dia.
+    """
+    if funcionarios is None:
+        funcionarios = funcionarios_ativos()
+    habilitados = funcionarios_habilitados(servico)
+    funcionarios = [f for f in funcionarios if f.pk in habilitados]
+    fuso = timezone.get_current_timezone()
+    data_inicio = timezone.localtime(inicio, fuso).date()
+    n_dias = (timezone.localtime(fim, fuso).date() - data_inicio).days + 1
+    if not funcionarios or fim <= inicio:
+        return None
+
+    ids = [funcionario.pk for funcionario in funcionarios]
+    livre = mapa_livre_em_cache(ids, data_inicio, n_dias) & ~mapa_reservado(ids, data_inicio, n_dias)
+    # Minutos depois de fim não podem ser usados pelo atendimento
+    limite, _ = minuto_relativo(fim, data_inicio, fuso)
+    livre[:, limite:] = False
+
+    minimo, fracao = minuto_relativo(max(inicio, timezone.now()), data_inicio, fuso)
+    validos = inicios_validos(
+        livre,
+        servico.duracao_minutos,
+        settings.AGENDA_INTERVALO_MINUTOS,
+        minimo=minimo + 1 if fracao else minimo,
+    )
+    colunas = np.flatnonzero(validos.any(axis=0))
+    if not len(colunas):
+        return None
+
+    minuto = colunas[0]
+    empatados = [funcionarios[i] for i in np.flatnonzero(validos[:, minuto])]
+    momento = momentos_dos_minutos(data_inicio, [minuto], fuso)[0]
+    if len(empatados) > 1:
+        preferidos = set(preferidos)
+        carga = carga_do_dia([f.pk for f in empatados], momento.date())
+        empatados.sort(key=lambda f: (f.pk not in preferidos, carga[f.pk], f.pk))
+    return empatados[0], momento
@@ -0,0 +1,203 @@
+"""
+Escala de trabalho dos funcionários compilada em intervalos
+
+Para cada funcionário, os turnos semanais e as ausências são carregados uma
+vez e expandidos sob demanda em vetores ordenados de intervalos (minuto
+inicial, minuto final) por dia: expediente ∩ turnos − ausências. Os dias já
+expandidos ficam em memória até que turnos, ausências ou o próprio
+funcionário mudem (signals em core/models.py).
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .expediente import MINUTOS_DIA, obter_expediente, periodo_em_minutos
+from .models import Funcionario, TurnoFuncionario, AusenciaFuncionario
+
+PREFIXO_VERSAO = 'escala:versao:'
+
+_escalas = {}
+
+
+def _minutos(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def intersectar(a, b):
+    """Interseção de duas listas ordenadas de intervalos, em tempo linear"""
+    resultado = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        inicio = max(a[i][0], b[j][0])
+        fim = min(a[i][1], b[j][1])
+        if inicio < fim:
+            resultado.append((inicio, fim))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return resultado
+
+
+def subtrair(a, b):
+    """Remove de a (ordenada) os intervalos de b (ordenada), em tempo linear"""
+    resultado = []
+    j = 0
+    for inicio, fim in a:
+        while j < len(b) and b[j][1] <= inicio:
+            j += 1
+        k = j
+        while k < len(b) and b[k][0] < fim:
+            if b[k][0] > inicio:
+                resultado.append((inicio, b[k][0]))
+            inicio = max(inicio, b[k][1])
+            k += 1
+        if inicio < fim:
+            resultado.append((inicio, fim))
+    return resultado
+
+
+class EscalaFuncionario:
+    """Turnos e ausências de um funcionário, expandidos por dia sob demanda"""
+
+    def __init__(self, funcionario_id, contratacao, demissao, turnos, ausencias, versao=None):
+        self.funcionario_id = funcionario_id
+        self.contratacao = contratacao
+        self.demissao = demissao
+        self.versao = versao
+        # None = sem turnos cadastrados, trabalha em todo o expediente
+        self.turnos = None
+        if turnos:
+            self.turnos = {dia: [] for dia in range(7)}
+            for dia, inicio, fim in sorted(turnos):
+                self.turnos[dia].append((inicio, fim))
+        self.ausencias = sorted(ausencias)
+        self._expediente = None
+        self._dias = {}
+
+    @classmethod
+    def carregar(cls, funcionario_ids, versoes):
+        """Carrega as escalas de vários funcionários com três consultas"""
+        turnos = defaultdict(list)
+        for funcionario_id, dia, inicio, fim in TurnoFuncionario.objects.filter(
+            funcionario_id__in=funcionario_ids
+        ).values_list('funcionario_id', 'dia_semana', 'hora_inicio', 'hora_fim'):
+            turnos[funcionario_id].append((dia, _minutos(inicio), _minutos(fim)))
+
+        ausencias = defaultdict(list)
+        for funcionario_id, inicio, fim in AusenciaFuncionario.objects.filter(
+            funcionario_id__in=funcionario_ids
+        ).values_list('funcionario_id', 'inicio', 'fim'):
+            ausencias[funcionario_id].append((inicio, fim))
+
+        return {
+            funcionario_id: cls(
+                funcionario_id, contratacao, demissao,
+                turnos[funcionario_id], ausencias[funcionario_id],
+                versoes.get(funcionario_id)
+            )
+            for funcionario_id, contratacao, demissao in Funcionario.objects.filter(
+                pk__in=funcionario_ids
+            ).values_list('pk', 'data_contratacao', 'data_demissao')
+        }
+
+    def _ausencias_do_dia(self, data):
+        """Ausências recortadas para a data, em minutos locais"""
+        fuso = timezone.get_current_timezone()
+        inicio_dia = datetime.combine(data, time.min, tzinfo=fuso)
+        fim_dia = inicio_dia + timedelta(days=1)
+        recortes = []
+        for inicio, fim in self.ausencias:
+            if inicio >= fim_dia:
+                break
+            if fim <= inicio_dia:
+                continue
+            inicio = max(inicio, inicio_dia).astimezone(fuso)
+            fim = min(fim, fim_dia).astimezone(fuso)
+            minuto_fim = MINUTOS_DIA if fim >= fim_dia else fim.hour * 60 + fim.minute
+            recortes.append((inicio.hour * 60 + inicio.minute, minuto_fim))
+        return sorted(recortes)
+
+    def intervalos_do_dia(self, data, expediente=None):
+        """Vetor (k, 2) ordenado com os intervalos em que o funcionário atende na data"""
+        expediente = expediente or obter_expediente()
+        if expediente is not self._expediente:
+            self._expediente = expediente
+            self._dias = {}
+
+        if data not in self._dias:
+            if data < self.contratacao or (self.demissao and data >= self.demissao):
+                intervalos = []
+            else:
+                intervalos = list(expediente.intervalos_do_dia(data))
+                if self.turnos is not None:
+                    intervalos = intersectar(intervalos, self.turnos[data.weekday()])
+                intervalos = subtrair(intervalos, self._ausencias_do_dia(data))
+            self._dias[data] = np.array(intervalos, dtype=np.int16).reshape(-1, 2)
+        return self._dias[data]
+
+    def mascara(self, data_inicio, n_dias, expediente=None):
+        """Vetor booleano (n_dias * 1440) com os minutos de trabalho"""
+        expediente = expediente or obter_expediente()
+        mascara = np.zeros((n_dias, MINUTOS_DIA), dtype=bool)
+        for dia in range(n_dias):
+            for inicio, fim in self.intervalos_do_dia(data_inicio + timedelta(days=dia), expediente):
+                mascara[dia, inicio:fim] = True
+        return mascara.reshape(-1)
+
+    def comporta(self, inicio, fim, expediente=None):
+        """Verifica se o período [inicio, fim) está inteiramente dentro da escala"""
+        data, primeiro, ultimo, n_dias = periodo_em_minutos(inicio, fim)
+        return bool(self.mascara(data, n_dias, expediente)[primeiro:ultimo].all())
+
+
+def obter_escalas(funcionario_ids):
+    """Retorna {funcionario_id: EscalaFuncionario}, recarregando as que mudaram"""
+    funcionario_ids = list(funcionario_ids)
+    chaves = {f'{PREFIXO_VERSAO}{i}': i for i in funcionario_ids}
+    versoes = {chaves[chave]: versao for chave, versao in cache.get_many(chaves).items()}
+
+    desatualizados = [
+        i for i in funcionario_ids
+        if i not in _escalas or _escalas[i].versao != versoes.get(i)
+    ]
+    if desatualizados:
+        _escalas.update(EscalaFuncionario.carregar(desatualizados, versoes))
+
+    return {i: _escalas[i] for i in funcionario_ids}
+
+
+def obter_escala(funcionario):
+    """Escala de um único funcionário (instância ou id)"""
+    funcionario_id = getattr(funcionario, 'pk', funcionario)
+    return obter_escalas([funcionario_id])[funcionario_id]
+
+
+def mascara_trabalho(funcionario_ids, data_inicio, n_dias):
+    """Matriz booleana (funcionários x minutos) com os minutos de trabalho de cada um"""
+    escalas = obter_escalas(funcionario_ids)
+    expediente = obter_expediente()
+    return np.array(
+        [escalas[i].mascara(data_inicio, n_dias, expediente) for i in funcionario_ids],
+        dtype=bool
+    ).reshape(len(funcionario_ids), n_dias * MINUTOS_DIA)
+
+
+def invalidar_escala(funcionario_id=None):
+    """
+    Descarta a escala compilada do funcionário neste processo e nos demais
+    quando a transação atual for confirmada (ver invalidar_expediente). Sem
+    funcionario_id, descarta na hora todas as escalas deste processo.
+    """
+    if funcionario_id is None:
+        _escalas.clear()
+        return
+
+    def descartar():
+        _escalas.pop(funcionario_id, None)
+        cache.set(f'{PREFIXO_VERSAO}{funcionario_id}', timezone.now().timestamp(), None)
+    transaction.on_commit(descartar)
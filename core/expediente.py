@@ -0,0 +1,142 @@
+"""
+Horário de funcionamento da empresa compilado em memória
+
+As regras cadastradas em HorarioFuncionamento e DataFechamento são lidas do
+banco uma única vez por processo e convertidas em intervalos de minutos por
+dia da semana. A versão compilada é descartada quando as regras mudam
+(signals em core/models.py); a chave de versão no cache do Django avisa os
+demais processos.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import HorarioFuncionamento, DataFechamento
+
+MINUTOS_DIA = 24 * 60
+
+CHAVE_VERSAO = 'expediente:versao'
+
+# Usado enquanto nenhum horário estiver cadastrado: segunda a sexta, 08:00 às 18:00
+HORARIO_PADRAO = {dia: ((8 * 60, 18 * 60),) for dia in range(5)}
+
+_compilado = None
+
+
+def _minutos(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def periodo_em_minutos(inicio, fim):
+    """
+    Converte [inicio, fim) em (data local inicial, minuto inicial, minuto
+    final, dias cobertos), com minutos contados a partir da meia-noite local
+    """
+    inicio = timezone.localtime(inicio)
+    fim = timezone.localtime(fim)
+    data = inicio.date()
+    primeiro = inicio.hour * 60 + inicio.minute
+    ultimo = (fim.date() - data).days * MINUTOS_DIA + fim.hour * 60 + fim.minute
+    if fim.second or fim.microsecond:
+        ultimo += 1
+    return data, primeiro, ultimo, max(1, -(-ultimo // MINUTOS_DIA))
+
+
+def _unir(intervalos):
+    """Ordena e junta intervalos sobrepostos ou adjacentes"""
+    unidos = []
+    for inicio, fim in sorted(intervalos):
+        if unidos and inicio <= unidos[-1][1]:
+            unidos[-1] = (unidos[-1][0], max(unidos[-1][1], fim))
+        else:
+            unidos.append((inicio, fim))
+    return tuple(unidos)
+
+
+class Expediente:
+    """Conjunto de intervalos de funcionamento por dia da semana, feriados e datas fechadas"""
+
+    def __init__(self, horarios, datas_fechadas=(), fechamentos_anuais=(), versao=None):
+        self.versao = versao
+        self.intervalos = {dia: _unir(horarios.get(dia, ())) for dia in range(7)}
+        self.datas_fechadas = frozenset(datas_fechadas)
+        self.fechamentos_anuais = frozenset(fechamentos_anuais)
+
+        self._mascaras = np.zeros((7, MINUTOS_DIA), dtype=bool)
+        for dia, intervalos in self.intervalos.items():
+            for inicio, fim in intervalos:
+                self._mascaras[dia, inicio:fim] = True
+
+    @classmethod
+    def carregar(cls, versao=None):
+        horarios = {}
+        for registro in HorarioFuncionamento.objects.all():
+            horarios.setdefault(registro.dia_semana, []).append(
+                (_minutos(registro.hora_inicio), _minutos(registro.hora_fim))
+            )
+
+        datas_fechadas, fechamentos_anuais = [], []
+        for data, recorrente in DataFechamento.objects.values_list('data', 'recorrente'):
+            if recorrente:
+                fechamentos_anuais.append((data.month, data.day))
+            else:
+                datas_fechadas.append(data)
+
+        return cls(horarios or HORARIO_PADRAO, datas_fechadas, fechamentos_anuais, versao)
+
+    def esta_fechado(self, data):
+        """True para feriados, datas fechadas e dias sem horário de funcionamento"""
+        return (
+            data in self.datas_fechadas
+            or (data.month, data.day) in self.fechamentos_anuais
+            or not self.intervalos[data.weekday()]
+        )
+
+    def intervalos_do_dia(self, data):
+        """Intervalos (minuto inicial, minuto final) de funcionamento na data"""
+        if self.esta_fechado(data):
+            return ()
+        return self.intervalos[data.weekday()]
+
+    def mascara(self, data_inicio, n_dias):
+        """Vetor booleano (n_dias * 1440) com os minutos em que a empresa está aberta"""
+        datas = [data_inicio + timedelta(days=dia) for dia in range(n_dias)]
+        mascara = self._mascaras[[data.weekday() for data in datas]]
+        fechadas = [
+            dia for dia, data in enumerate(datas)
+            if data in self.datas_fechadas or (data.month, data.day) in self.fechamentos_anuais
+        ]
+        if fechadas:
+            mascara[fechadas] = False
+        return mascara.reshape(-1)
+
+    def comporta(self, inicio, fim):
+        """Verifica se o período [inicio, fim) está inteiramente dentro do expediente"""
+        data, primeiro, ultimo, n_dias = periodo_em_minutos(inicio, fim)
+        return bool(self.mascara(data, n_dias)[primeiro:ultimo].all())
+
+
+def obter_expediente():
+    """Retorna o expediente compilado, recompilando se as regras mudaram"""
+    global _compilado
+    versao = cache.get(CHAVE_VERSAO)
+    if _compilado is None or _compilado.versao != versao:
+        _compilado = Expediente.carregar(versao)
+    return _compilado
+
+
+def invalidar_expediente():
+    """
+    Descarta o expediente compilado neste processo e nos demais quando a
+    transação atual for confirmada. Descartar antes faria uma leitura na
+    mesma transação compilar regras ainda não gravadas, que ficariam valendo
+    neste processo mesmo se a transação fosse desfeita.
+    """
+    def descartar():
+        global _compilado
+        _compilado = None
+        cache.set(CHAVE_VERSAO, timezone.now().timestamp(), None)
+    transaction.on_commit(descartar)
@@ -0,0 +1,286 @@
+"""
+Exportação dos relatórios de agendamentos e de receitas em CSV e XLSX
+
+As linhas saem do banco com values_list(...).iterator(chunk_size=...), que
+no PostgreSQL usa um cursor no servidor, e cada bloco é escrito e entregue
+ao StreamingHttpResponse antes de o próximo ser lido. A memória do worker
+fica constante, seja a exportação de mil ou de milhões de linhas.
+
+O XLSX é montado aqui mesmo (sem dependências): um zip escrito em fluxo com
+a planilha em XML gerada linha a linha e textos inline, sem tabela de
+strings compartilhadas para acumular.
+"""
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from .models import Agendamento
+from .resumos import resumo_periodo
+
+TAMANHO_BLOCO = 2000
+
+CONTENT_TYPE_CSV = 'text/csv; charset=utf-8'
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+STATUS = dict(Agendamento.STATUS_CHOICES)
+
+
+def _nome(primeiro, ultimo):
+    return f"{primeiro or ''} {ultimo or ''}".strip()
+
+
+def consulta_agendamentos(data_inicio, data_fim, cliente=None, funcionario=None, servico=None, status=None):
+    """Projeção dos agendamentos do período (datas locais) usada na exportação"""
+    agendamentos = Agendamento.objects.entre(data_inicio, data_fim)
+    filtros = {'cliente': cliente, 'funcionario': funcionario, 'servico': servico, 'status': status}
+    agendamentos = agendamentos.filter(**{campo: valor for campo, valor in filtros.items() if valor})
+    return agendamentos.order_by('data_agendamento', 'pk').values_list(
+        'pk', 'data_agendamento', 'data_fim',
+        'cliente__first_name', 'cliente__last_name',
+        'funcionario__usuario__first_name', 'funcionario__usuario__last_name',
+        'servico__nome', 'status', 'valor_final',
+    )
+
+
+def linhas_agendamentos(consulta):
+    """(cabeçalho, iterador de linhas) de consulta_agendamentos"""
+    cabecalho = [
+        'ID', 'Início', 'Fim', 'Cliente', 'Funcionário', 'Serviço', 'Status', 'Valor (R$)'
+    ]
+    dados = consulta.iterator(chunk_size=TAMANHO_BLOCO)
+
+    def linhas():
+        fuso = timezone.get_current_timezone()
+        for (pk, inicio, fim, cliente_nome, cliente_sobrenome,
+             funcionario_nome, funcionario_sobrenome, servico_nome, codigo, valor) in dados:
+            yield (
+                pk,
+                inicio.astimezone(fuso).replace(tzinfo=None),
+                fim.astimezone(fuso).replace(tzinfo=None),
+                _nome(cliente_nome, cliente_sobrenome),
+                _nome(funcionario_nome, funcionario_sobrenome),
+                servico_nome,
+                STATUS.get(codigo, codigo),
+                valor,
+            )
+
+    return cabecalho, linhas()
+
+
+def consulta_receitas(data_inicio, data_fim, funcionario=None, servico=None):
+    """
+    Receita dos agendamentos concluídos por dia, funcionário e serviço, lida
+    do resumo diário
+    """
+    filtros = {'status': 'concluido'}
+    if funcionario:
+        filtros['funcionario'] = funcionario
+    if servico:
+        filtros['servico'] = servico
+    return resumo_periodo(
+        data_inicio, data_fim,
+        'data', 'funcionario__usuario__first_name', 'funcionario__usuario__last_name',
+        'funcionario_id', 'servico__nome', 'servico_id',
+        **filtros
+    )
+
+
+def linhas_receitas(consulta):
+    """(cabeçalho, iterador de linhas) de consulta_receitas"""
+    cabecalho = ['Data', 'Funcionário', 'Serviço', 'Atendimentos', 'Minutos', 'Receita (R$)']
+    dados = consulta.iterator(chunk_size=TAMANHO_BLOCO)
+
+    def linhas():
+        for grupo in dados:
+            yield (
+                grupo['data'],
+                _nome(grupo['funcionario__usuario__first_name'], grupo['funcionario__usuario__last_name']),
+                grupo['servico__nome'],
+                grupo['quantidade_total'],
+                grupo['minutos_total'],
+                grupo['receita_total'],
+            )
+
+    return cabecalho, linhas()
+
+
+def _em_blocos(linhas):
+    bloco = []
+    for linha in linhas:
+        bloco.append(linha)
+        if len(bloco) >= TAMANHO_BLOCO:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def _texto_csv(valor):
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M')
+    if isinstance(valor, date):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return f'{valor:.2f}'
+    return valor
+
+
+def csv_em_blocos(cabecalho, linhas):
+    """Gera o CSV (UTF-8 com BOM, para o Excel reconhecer os acentos) em blocos de bytes"""
+    saida = io.StringIO()
+    escritor = csv.writer(saida)
+    saida.write('\ufeff')
+    escritor.writerow(cabecalho)
+    for bloco in _em_blocos(linhas):
+        escritor.writerows([_texto_csv(valor) for valor in linha] for linha in bloco)
+        yield saida.getvalue().encode('utf-8')
+        saida.seek(0)
+        saida.truncate()
+    if saida.tell():
+        yield saida.getvalue().encode('utf-8')
+
+
+# Partes fixas do pacote XLSX
+_XLSX_ESTATICOS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Estilos: 0 padrão, 1 data, 2 data e hora, 3 valor com duas casas
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="2">'
+        '<numFmt numFmtId="164" formatCode="dd/mm/yyyy"/>'
+        '<numFmt numFmtId="165" formatCode="dd/mm/yyyy hh:mm"/>'
+        '</numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="4">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '</cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{titulo}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_EPOCA_EXCEL = datetime(1899, 12, 30)
+
+# Caracteres de controle não são aceitos em XML
+_CONTROLE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _celula(valor):
+    if valor is None:
+        return '<c/>'
+    if isinstance(valor, bool):
+        valor = 'Sim' if valor else 'Não'
+    if isinstance(valor, datetime):
+        serial = (valor - _EPOCA_EXCEL).total_seconds() / 86400
+        return f'<c s="2"><v>{serial:.8f}</v></c>'
+    if isinstance(valor, date):
+        return f'<c s="1"><v>{(valor - _EPOCA_EXCEL.date()).days}</v></c>'
+    if isinstance(valor, Decimal):
+        return f'<c s="3"><v>{valor:f}</v></c>'
+    if isinstance(valor, (int, float)):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_CONTROLE.sub('', str(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _linha_xml(linha):
+    return '<row>' + ''.join(_celula(valor) for valor in linha) + '</row>'
+
+
+class _SaidaZip(io.RawIOBase):
+    """Destino do zip sem seek: acumula os bytes até serem retirados"""
+
+    def __init__(self):
+        self.partes = []
+        self.posicao = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def retirar(self):
+        dados = b''.join(self.partes)
+        self.partes = []
+        return dados
+
+
+def xlsx_em_blocos(cabecalho, linhas, titulo='Relatório'):
+    """Gera o arquivo XLSX em blocos de bytes, com uma planilha"""
+    saida = _SaidaZip()
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as pacote:
+        for nome, conteudo in _XLSX_ESTATICOS.items():
+            pacote.writestr(nome, conteudo)
+        pacote.writestr('xl/workbook.xml', _XLSX_WORKBOOK.format(titulo=escape(titulo[:31])))
+        yield saida.retirar()
+
+        with pacote.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as planilha:
+            planilha.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>' + _linha_xml(cabecalho)
+            ).encode('utf-8'))
+            for bloco in _em_blocos(linhas):
+                planilha.write(''.join(_linha_xml(linha) for linha in bloco).encode('utf-8'))
+                yield saida.retirar()
+            planilha.write(b'</sheetData></worksheet>')
+    yield saida.retirar()
@@ -3,11 +3,17 @@ from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth import authenticate
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from .models import (
     Usuario, Funcionario, Cargo, Servico, 
-    Agendamento, ConfiguracaoEmpresa
+    Agendamento, SerieAgendamento, ConfiguracaoEmpresa
 )
+from .conflitos import conflitos_com_duracao, primeiro_conflito
+from .escala import obter_escala
+from .expediente import obter_expediente
+from .habilidades import funcionarios_habilitados, pode_realizar
+from .recorrencia import criar_serie, validar_serie
+from .reservas import confirmar_agendamento, reservas_conflitantes
 
 
 class LoginForm(AuthenticationForm):
@@ -184,7 +190,7 @@ class FuncionarioForm(forms.ModelForm):
         model = Funcionario
         fields = [
             'usuario', 'cargo', 'data_contratacao', 'data_demissao',
-            'salario', 'observacoes', 'ativo'
+            'salario', 'servicos', 'observacoes', 'ativo'
         ]
         widgets = {
             'usuario': forms.Select(attrs={'class': 'form-select'}),
@@ -202,6 +208,7 @@ class FuncionarioForm(forms.ModelForm):
                 'step': '0.01',
                 'min': '0'
             }),
+            'servicos': forms.CheckboxSelectMultiple(attrs={'class': 'form-check-input'}),
             'observacoes': forms.Textarea(attrs={
                 'class': 'form-control',
                 'rows': 3
@@ -212,6 +219,8 @@ class FuncionarioForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
+        self.fields['servicos'].queryset = Servico.objects.filter(ativo=True)
+        
         # Filtrar apenas usuários que não são funcionários ou o próprio se editando
         usuarios_funcionarios = Funcionario.objects.values_list('usuario_id', flat=True)
         queryset = Usuario.objects.filter(tipo__in=['restrito', 'master'])
@@ -268,11 +277,46 @@ class ServicoForm(forms.ModelForm):
             }),
             'ativo': forms.CheckboxInput(attrs={'class': 'form-check-input'})
         }
+    
+    def clean_duracao_minutos(self):
+        duracao_minutos = self.cleaned_data.get('duracao_minutos')
+        
+        # A nova duração vale para os agendamentos pendentes; ela não pode
+        # fazê-los invadir o próximo atendimento do funcionário
+        if duracao_minutos and self.instance.pk and 'duracao_minutos' in self.changed_data:
+            conflitos = conflitos_com_duracao(self.instance, duracao_minutos)
+            if conflitos:
+                pares = '; '.join(f'{a} x {b}' for a, b in conflitos[:5])
+                raise ValidationError(
+                    f'Com esta duração, {len(conflitos)} agendamento(s) passariam a se '
+                    f'sobrepor: {pares}. Remarque-os antes de alterar a duração.'
+                )
+        
+        return duracao_minutos
+
+
+def validar_horario_livre(funcionario, inicio, fim, excluir_pk=None, reserva=None):
+    """
+    Levanta ValidationError se [inicio, fim) conflita com outro agendamento
+    ativo do funcionário ou com uma reserva válida de outro atendimento
+    """
+    conflito = primeiro_conflito(funcionario, inicio, fim, excluir_pk=excluir_pk)
+    if conflito:
+        raise ValidationError(
+            f'Conflito de horário com agendamento: {conflito}'
+        )
+    if reservas_conflitantes(funcionario.pk, inicio, fim, reserva).exists():
+        raise ValidationError(
+            'Este horário está reservado por outro atendimento.'
+        )
 
 
 class AgendamentoForm(forms.ModelForm):
     """Formulário para criação e edição de agendamentos"""
     
+    # Token da reserva de horário feita pela interface (api/reservar-horario)
+    reserva = forms.UUIDField(required=False, widget=forms.HiddenInput)
+    
     class Meta:
         model = Agendamento
         fields = [
@@ -312,6 +356,18 @@ class AgendamentoForm(forms.ModelForm):
             ativo=True, data_demissao__isnull=True
         )
         
+        # Com o serviço já escolhido, listar só quem pode realizá-lo
+        servico_id = (
+            self.data.get(self.add_prefix('servico'))
+            or self.initial.get('servico')
+            or self.instance.servico_id
+        )
+        servico_id = getattr(servico_id, 'pk', servico_id)
+        if servico_id and str(servico_id).isdigit():
+            self.fields['funcionario'].queryset = self.fields['funcionario'].queryset.filter(
+                pk__in=funcionarios_habilitados(int(servico_id))
+            )
+        
         # Filtrar apenas serviços ativos
         self.fields['servico'].queryset = Servico.objects.filter(ativo=True)
     
@@ -323,13 +379,13 @@ class AgendamentoForm(forms.ModelForm):
             if not self.instance.pk and data_agendamento <= timezone.now():
                 raise ValidationError('Data de agendamento deve ser no futuro.')
             
-            # Verificar horário comercial (8h às 18h)
-            if data_agendamento.hour < 8 or data_agendamento.hour >= 18:
-                raise ValidationError('Agendamentos devem ser entre 08:00 e 18:00.')
-            
-            # Verificar dias úteis (segunda a sexta)
-            if data_agendamento.weekday() >= 5:  # 5=sábado, 6=domingo
-                raise ValidationError('Agendamentos apenas em dias úteis (segunda a sexta).')
+            # Verificar horário de funcionamento e datas fechadas
+            expediente = obter_expediente()
+            data = timezone.localdate(data_agendamento)
+            if expediente.esta_fechado(data):
+                raise ValidationError('A empresa não funciona nesta data.')
+            if not expediente.comporta(data_agendamento, data_agendamento + timedelta(minutes=1)):
+                raise ValidationError('Agendamento fora do horário de funcionamento.')
         
         return data_agendamento
     
@@ -340,24 +396,146 @@ class AgendamentoForm(forms.ModelForm):
         servico = cleaned_data.get('servico')
         
         if funcionario and data_agendamento and servico:
-            # Verificar conflito de horários
-            from datetime import timedelta
             data_fim = data_agendamento + timedelta(minutes=servico.duracao_minutos)
             
-            conflitos = Agendamento.objects.filter(
-                funcionario=funcionario,
-                data_agendamento__lt=data_fim,
-                status__in=['agendado', 'em_andamento']
-            ).exclude(pk=self.instance.pk)
+            if not pode_realizar(funcionario, servico):
+                raise ValidationError(
+                    f'{funcionario.usuario.get_full_name()} não está habilitado para {servico.nome}.'
+                )
             
-            for agendamento in conflitos:
-                agendamento_fim = agendamento.data_hora_fim()
-                if data_agendamento < agendamento_fim:
-                    raise ValidationError(
-                        f'Conflito de horário com agendamento: {agendamento}'
-                    )
+            # O atendimento inteiro precisa caber no expediente e na escala do funcionário
+            expediente = obter_expediente()
+            if not expediente.comporta(data_agendamento, data_fim):
+                raise ValidationError(
+                    'O serviço termina fora do horário de funcionamento.'
+                )
+            if not obter_escala(funcionario).comporta(data_agendamento, data_fim, expediente):
+                raise ValidationError(
+                    'O funcionário não atende neste horário (fora do turno ou ausente).'
+                )
+            
+            validar_horario_livre(
+                funcionario, data_agendamento, data_fim,
+                excluir_pk=self.instance.pk, reserva=cleaned_data.get('reserva')
+            )
         
         return cleaned_data
+    
+    def save(self, commit=True):
+        """Grava com a agenda do funcionário travada (core/reservas.py)"""
+        agendamento = super().save(commit=False)
+        if commit:
+            confirmar_agendamento(agendamento, self.cleaned_data.get('reserva'))
+        return agendamento
+
+
+class AgendamentoAdminForm(forms.ModelForm):
+    """
+    Formulário do admin de agendamentos: sem as regras de expediente e escala
+    da interface, mas com a verificação de conflitos e reservas, para que a
+    restrição de sobreposição do banco não apareça como erro 500
+    """
+    
+    class Meta:
+        model = Agendamento
+        fields = '__all__'
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        funcionario = cleaned_data.get('funcionario')
+        data_agendamento = cleaned_data.get('data_agendamento')
+        servico = cleaned_data.get('servico')
+        
+        if (funcionario and data_agendamento and servico
+                and cleaned_data.get('status') in Agendamento.STATUS_ATIVOS):
+            validar_horario_livre(
+                funcionario, data_agendamento,
+                data_agendamento + timedelta(minutes=servico.duracao_minutos),
+                excluir_pk=self.instance.pk
+            )
+        
+        return cleaned_data
+
+
+class SerieAgendamentoForm(forms.ModelForm):
+    """Formulário para criação de séries de agendamentos recorrentes"""
+    
+    excecoes = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 2}),
+        help_text='Datas em que a série não acontece, separadas por vírgula ou linha'
+    )
+    
+    class Meta:
+        model = SerieAgendamento
+        fields = [
+            'cliente', 'funcionario', 'servico', 'regra', 'primeira_data',
+            'quantidade', 'data_limite', 'excecoes', 'observacoes'
+        ]
+        widgets = {
+            'cliente': forms.Select(attrs={'class': 'form-select'}),
+            'funcionario': forms.Select(attrs={'class': 'form-select'}),
+            'servico': forms.Select(attrs={'class': 'form-select'}),
+            'regra': forms.Select(attrs={'class': 'form-select'}),
+            'primeira_data': forms.DateTimeInput(attrs={
+                'class': 'form-control',
+                'type': 'datetime-local'
+            }),
+            'quantidade': forms.NumberInput(attrs={'class': 'form-control', 'min': '1'}),
+            'data_limite': forms.DateInput(attrs={
+                'class': 'form-control',
+                'type': 'date'
+            }),
+            'observacoes': forms.Textarea(attrs={
+                'class': 'form-control',
+                'rows': 3
+            }),
+        }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['cliente'].queryset = Usuario.objects.filter(tipo='cliente', ativo=True)
+        self.fields['funcionario'].queryset = Funcionario.objects.filter(
+            ativo=True, data_demissao__isnull=True
+        )
+        self.fields['servico'].queryset = Servico.objects.filter(ativo=True)
+        if self.instance.pk:
+            self.initial['excecoes'] = ', '.join(self.instance.excecoes or [])
+            self.fields['excecoes'].disabled = True
+    
+    def clean_excecoes(self):
+        campo_data = forms.DateField()
+        texto = self.cleaned_data.get('excecoes') or ''
+        datas = [
+            campo_data.clean(valor.strip())
+            for valor in texto.replace(',', '\n').splitlines() if valor.strip()
+        ]
+        return sorted({data.isoformat() for data in datas})
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        campos = ['cliente', 'funcionario', 'servico', 'regra', 'primeira_data']
+        # Ocorrências validadas, repassadas a criar_serie para não validar de novo
+        self.inicios = None
+        
+        # Séries já gravadas não têm as ocorrências revalidadas
+        if self.instance.pk or any(not cleaned_data.get(campo) for campo in campos):
+            return cleaned_data
+        if (cleaned_data.get('quantidade') is None) == (cleaned_data.get('data_limite') is None):
+            return cleaned_data  # Erro reportado por SerieAgendamento.clean
+        
+        self.inicios = validar_serie(SerieAgendamento(**{
+            campo: cleaned_data.get(campo)
+            for campo in campos + ['quantidade', 'data_limite', 'excecoes']
+        }))
+        return cleaned_data
+    
+    def save(self, commit=True):
+        """Grava a série e cria todas as ocorrências de uma vez"""
+        if commit and not self.instance.pk:
+            self.agendamentos = criar_serie(self.instance, inicios=self.inicios)
+            return self.instance
+        return super().save(commit)
 
 
 class ConfiguracaoEmpresaForm(forms.ModelForm):
@@ -0,0 +1,92 @@
+"""
+Índice em memória de quais funcionários podem realizar cada serviço
+
+A tabela Funcionario.servicos é lida uma vez por processo e convertida em um
+bitset por serviço (um bit por funcionário). A consulta dos habilitados para
+um serviço é O(1) e combinações (ex.: habilitados para dois serviços) são
+operações de bits. O índice é descartado quando as habilitações mudam
+(signals em core/models.py).
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Funcionario
+
+CHAVE_VERSAO = 'habilidades:versao'
+
+_indice = None
+
+
+class IndiceHabilidades:
+    """Bitsets de funcionários habilitados por serviço"""
+
+    def __init__(self, pares, versao=None):
+        self.versao = versao
+        self.funcionario_ids = sorted({funcionario_id for funcionario_id, _ in pares})
+        self.posicoes = {funcionario_id: i for i, funcionario_id in enumerate(self.funcionario_ids)}
+        self.bitsets = {}
+        for funcionario_id, servico_id in pares:
+            self.bitsets[servico_id] = self.bitsets.get(servico_id, 0) | (1 << self.posicoes[funcionario_id])
+        self._conjuntos = {}
+
+    @classmethod
+    def carregar(cls, versao=None):
+        return cls(
+            list(Funcionario.servicos.through.objects.values_list('funcionario_id', 'servico_id')),
+            versao
+        )
+
+    def bitset(self, servico_id):
+        return self.bitsets.get(servico_id, 0)
+
+    def decodificar(self, bitset):
+        """Converte um bitset no conjunto de ids de funcionário"""
+        ids = []
+        while bitset:
+            menor = bitset & -bitset
+            ids.append(self.funcionario_ids[menor.bit_length() - 1])
+            bitset ^= menor
+        return frozenset(ids)
+
+    def habilitados(self, servico_id):
+        """Conjunto de ids dos funcionários que realizam o serviço"""
+        if servico_id not in self._conjuntos:
+            self._conjuntos[servico_id] = self.decodificar(self.bitset(servico_id))
+        return self._conjuntos[servico_id]
+
+    def pode_realizar(self, funcionario_id, servico_id):
+        posicao = self.posicoes.get(funcionario_id)
+        return posicao is not None and bool(self.bitset(servico_id) >> posicao & 1)
+
+
+def obter_indice():
+    """Retorna o índice de habilidades, recarregando se as habilitações mudaram"""
+    global _indice
+    versao = cache.get(CHAVE_VERSAO)
+    if _indice is None or _indice.versao != versao:
+        _indice = IndiceHabilidades.carregar(versao)
+    return _indice
+
+
+def funcionarios_habilitados(servico):
+    """Ids dos funcionários habilitados para o serviço (instância ou id)"""
+    return obter_indice().habilitados(getattr(servico, 'pk', servico))
+
+
+def pode_realizar(funcionario, servico):
+    return obter_indice().pode_realizar(
+        getattr(funcionario, 'pk', funcionario), getattr(servico, 'pk', servico)
+    )
+
+
+def invalidar_habilidades():
+    """
+    Descarta o índice neste processo e nos demais quando a transação atual
+    for confirmada (ver invalidar_expediente)
+    """
+    def descartar():
+        global _indice
+        _indice = None
+        cache.set(CHAVE_VERSAO, timezone.now().timestamp(), None)
+    transaction.on_commit(descartar)
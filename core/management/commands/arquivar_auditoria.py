@@ -0,0 +1,25 @@
+"""
+Cria as próximas partições de LogAuditoria e arquiva os meses fora da retenção
+"""
+from django.core.management.base import BaseCommand
+
+from core.particoes import arquivar_antigos, criar_particoes
+
+
+class Command(BaseCommand):
+    help = 'Arquiva em .jsonl.gz os logs de auditoria mais antigos que AUDITORIA_RETENCAO_MESES'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retencao-meses', type=int,
+            help='Meses mantidos no banco, contando o atual (padrão: AUDITORIA_RETENCAO_MESES)'
+        )
+
+    def handle(self, *args, **options):
+        for nome in criar_particoes():
+            self.stdout.write(f'Partição criada: {nome}')
+
+        arquivados = arquivar_antigos(options['retencao_meses'])
+        for mes, caminho, total in arquivados:
+            self.stdout.write(f'{mes:%m/%Y}: {total} log(s) -> {caminho or "nada a arquivar"}')
+        self.stdout.write(self.style.SUCCESS(f'{len(arquivados)} mês(es) arquivado(s).'))
@@ -0,0 +1,34 @@
+"""
+Recalcula os snapshots de disponibilidade da janela e descarta dias antigos
+"""
+from django.core.management.base import BaseCommand
+
+from core.disponibilidade import funcionarios_ativos, janela_cache, recalcular_disponibilidade
+from core.models import DisponibilidadeDiaria
+
+
+class Command(BaseCommand):
+    help = 'Recalcula a disponibilidade pré-calculada dos funcionários (executar diariamente)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote', type=int, default=20,
+            help='Quantidade de funcionários recalculados por vez'
+        )
+
+    def handle(self, *args, **options):
+        primeiro, limite = janela_cache()
+
+        removidos, _ = DisponibilidadeDiaria.objects.exclude(
+            data__gte=primeiro, data__lt=limite
+        ).delete()
+
+        ids = list(funcionarios_ativos().values_list('pk', flat=True))
+        n_dias = (limite - primeiro).days
+        for i in range(0, len(ids), options['lote']):
+            recalcular_disponibilidade(ids[i:i + options['lote']], primeiro, n_dias)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(ids)} funcionário(s) recalculado(s) de {primeiro:%d/%m/%Y} '
+            f'a {limite:%d/%m/%Y}; {removidos} snapshot(s) antigo(s) removido(s).'
+        ))
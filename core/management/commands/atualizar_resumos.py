@@ -0,0 +1,53 @@
+"""
+Recalcula o resumo diário de agendamentos a partir dos agendamentos
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.models import Agendamento
+from core.resumos import recalcular_resumos
+
+
+class Command(BaseCommand):
+    help = 'Preenche ou corrige o resumo diário de agendamentos, em blocos de dias'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inicio', help='Primeira data (AAAA-MM-DD); padrão: agendamento mais antigo')
+        parser.add_argument('--fim', help='Última data (AAAA-MM-DD); padrão: agendamento mais recente')
+        parser.add_argument(
+            '--dias', type=int, default=31,
+            help='Quantidade de dias recalculados por transação'
+        )
+
+    def handle(self, *args, **options):
+        limites = Agendamento.objects.aggregate(
+            primeiro=Min('data_agendamento'), ultimo=Max('data_agendamento')
+        )
+        if limites['primeiro'] is None and not (options['inicio'] and options['fim']):
+            self.stdout.write('Nenhum agendamento cadastrado.')
+            return
+
+        inicio = (
+            parse_date(options['inicio']) if options['inicio']
+            else timezone.localdate(limites['primeiro'])
+        )
+        fim = parse_date(options['fim']) if options['fim'] else timezone.localdate(limites['ultimo'])
+        if not inicio or not fim or fim < inicio:
+            raise CommandError('Período inválido.')
+        if options['dias'] < 1:
+            raise CommandError('--dias deve ser maior que zero.')
+
+        total = 0
+        bloco = inicio
+        while bloco <= fim:
+            fim_bloco = min(bloco + timedelta(days=options['dias'] - 1), fim)
+            total += recalcular_resumos(bloco, fim_bloco)
+            bloco = fim_bloco + timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Resumo recalculado de {inicio:%d/%m/%Y} a {fim:%d/%m/%Y}: {total} linha(s).'
+        ))
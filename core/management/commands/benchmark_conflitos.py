@@ -0,0 +1,113 @@
+"""
+Mede o custo da verificação de conflitos conforme o histórico cresce
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.conflitos import buscar_conflitos
+from core.models import Usuario, Cargo, Funcionario, Servico, Agendamento
+
+
+class RollbackBenchmark(Exception):
+    """Usada para desfazer os dados gerados pelo benchmark"""
+
+
+class Command(BaseCommand):
+    help = 'Mede o tempo da verificação de conflitos com históricos de tamanhos crescentes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamanhos', default='100,1000,10000,50000',
+            help='Tamanhos de histórico separados por vírgula'
+        )
+        parser.add_argument(
+            '--repeticoes', type=int, default=200,
+            help='Quantidade de verificações por tamanho de histórico'
+        )
+
+    def handle(self, *args, **options):
+        tamanhos = [int(t) for t in options['tamanhos'].split(',')]
+        repeticoes = options['repeticoes']
+
+        try:
+            with transaction.atomic():
+                self._executar(tamanhos, repeticoes)
+                raise RollbackBenchmark
+        except RollbackBenchmark:
+            pass
+
+    def _executar(self, tamanhos, repeticoes):
+        cargo = Cargo.objects.create(nome='Benchmark')
+        servico = Servico.objects.create(nome='Benchmark', preco=50, duracao_minutos=60)
+        cliente = Usuario.objects.create(username='benchmark_cliente', tipo='cliente')
+        funcionario = Funcionario.objects.create(
+            usuario=Usuario.objects.create(username='benchmark_funcionario'),
+            cargo=cargo,
+            data_contratacao=timezone.now().date(),
+            salario=0,
+        )
+
+        agora = timezone.now().replace(minute=0, second=0, microsecond=0)
+        inicio = agora + timedelta(days=1)
+        fim = inicio + timedelta(minutes=servico.duracao_minutos)
+        criados = 0
+
+        self.stdout.write(
+            f"{'histórico':>10} {'ms/verificação':>16} {'ms (sem limite)':>16} "
+            f"{'linhas lidas':>14} {'linhas (sem limite)':>20}"
+        )
+        for tamanho in tamanhos:
+            # Histórico no passado, uma hora por agendamento
+            novos = []
+            for i in range(tamanho - criados):
+                data_agendamento = agora - timedelta(hours=criados + i + 1)
+                novos.append(Agendamento(
+                    cliente=cliente,
+                    funcionario=funcionario,
+                    servico=servico,
+                    data_agendamento=data_agendamento,
+                    data_fim=data_agendamento + timedelta(minutes=servico.duracao_minutos),
+                    status='agendado',
+                ))
+            Agendamento.objects.bulk_create(novos, batch_size=1000)
+            criados = tamanho
+
+            assert not buscar_conflitos(funcionario, inicio, fim)
+
+            tempo = self._medir(lambda: buscar_conflitos(funcionario, inicio, fim), repeticoes)
+            tempo_sem_limite = self._medir(
+                lambda: self._conflitos_sem_limite(funcionario, inicio, fim),
+                max(1, repeticoes // 100)
+            )
+
+            ativos = Agendamento.objects.filter(
+                funcionario=funcionario,
+                status__in=Agendamento.STATUS_ATIVOS,
+                data_agendamento__lt=fim,
+            )
+            linhas = ativos.filter(
+                data_agendamento__gte=inicio - timedelta(minutes=servico.duracao_minutos)
+            ).count()
+            self.stdout.write(
+                f'{tamanho:>10} {tempo:>16.3f} {tempo_sem_limite:>16.3f} '
+                f'{linhas:>14} {ativos.count():>20}'
+            )
+
+    def _medir(self, funcao, repeticoes):
+        comeco = time.perf_counter()
+        for _ in range(repeticoes):
+            funcao()
+        return (time.perf_counter() - comeco) * 1000 / repeticoes
+
+    def _conflitos_sem_limite(self, funcionario, inicio, fim):
+        """Verificação anterior: sem limite inferior e uma consulta de serviço por linha"""
+        conflitos = Agendamento.objects.filter(
+            funcionario=funcionario,
+            data_agendamento__lt=fim,
+            status__in=Agendamento.STATUS_ATIVOS,
+        )
+        return [a for a in conflitos if inicio < a.data_hora_fim()]
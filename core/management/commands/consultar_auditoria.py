@@ -0,0 +1,42 @@
+"""
+Consulta os logs de auditoria dos meses já arquivados
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date
+
+from core.particoes import logs_arquivados
+
+
+class Command(BaseCommand):
+    help = 'Imprime em JSONL os logs arquivados do período que atendem aos filtros'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inicio', required=True, help='Data inicial (AAAA-MM-DD)')
+        parser.add_argument('--fim', required=True, help='Data final, inclusiva (AAAA-MM-DD)')
+        parser.add_argument('--usuario', type=int, help='ID do usuário')
+        parser.add_argument('--acao')
+        parser.add_argument('--modelo')
+        parser.add_argument('--objeto', type=int, help='ID do objeto')
+
+    def handle(self, *args, **options):
+        try:
+            inicio, fim = parse_date(options['inicio']), parse_date(options['fim'])
+        except ValueError:
+            inicio = fim = None
+        if inicio is None or fim is None:
+            raise CommandError('Datas devem estar no formato AAAA-MM-DD.')
+        if fim < inicio:
+            raise CommandError('A data final deve ser posterior à inicial.')
+
+        logs = logs_arquivados(
+            inicio, fim,
+            usuario_id=options['usuario'],
+            acao=options['acao'],
+            modelo=options['modelo'],
+            objeto_id=options['objeto'],
+        )
+        for log in logs:
+            self.stdout.write(json.dumps(log, cls=DjangoJSONEncoder, ensure_ascii=False))
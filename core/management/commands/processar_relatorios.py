@@ -0,0 +1,43 @@
+"""
+Worker que gera os relatórios pedidos em segundo plano
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.particoes import criar_particoes
+from core.relatorios import executar_pendentes, limpar_relatorios_antigos
+
+# Intervalo entre as verificações das partições de auditoria
+PARTICOES_INTERVALO_SEGUNDOS = 3600
+
+
+class Command(BaseCommand):
+    help = 'Processa a fila de relatórios (TarefaRelatorio)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--uma-vez', action='store_true',
+            help='Processa as tarefas pendentes e encerra (para uso com cron)'
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=2,
+            help='Segundos de espera quando a fila está vazia'
+        )
+
+    def handle(self, *args, **options):
+        proximas_particoes = 0
+        while True:
+            close_old_connections()
+            if time.monotonic() >= proximas_particoes:
+                for nome in criar_particoes():
+                    self.stdout.write(f'Partição de auditoria criada: {nome}')
+                proximas_particoes = time.monotonic() + PARTICOES_INTERVALO_SEGUNDOS
+            limpar_relatorios_antigos()
+            processadas = executar_pendentes()
+            if processadas:
+                self.stdout.write(f'{processadas} relatório(s) processado(s).')
+            if options['uma_vez']:
+                return
+            time.sleep(options['intervalo'])
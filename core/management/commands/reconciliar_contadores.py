@@ -0,0 +1,22 @@
+"""
+Recalcula os contadores do dashboard a partir das tabelas
+"""
+from django.core.management.base import BaseCommand
+
+from core.contadores import reconciliar_contadores
+from core.painel import invalidar_estatisticas
+
+
+class Command(BaseCommand):
+    help = 'Corrige os contadores de usuários, clientes, funcionários e serviços ativos'
+
+    def handle(self, *args, **options):
+        corrigidos = reconciliar_contadores()
+        if not corrigidos:
+            self.stdout.write(self.style.SUCCESS('Contadores conferidos; nenhuma diferença.'))
+            return
+
+        invalidar_estatisticas()
+        for nome, (anterior, correto) in sorted(corrigidos.items()):
+            self.stdout.write(f'{nome}: {anterior if anterior is not None else "-"} -> {correto}')
+        self.stdout.write(self.style.SUCCESS(f'{len(corrigidos)} contador(es) corrigido(s).'))
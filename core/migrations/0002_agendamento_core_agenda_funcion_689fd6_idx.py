@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-17 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['funcionario', 'data_agendamento'], name='core_agenda_funcion_689fd6_idx'),
+        ),
+    ]
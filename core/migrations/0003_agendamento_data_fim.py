@@ -0,0 +1,152 @@
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+NOME_RESTRICAO = 'core_agendamento_sem_sobreposicao'
+
+SQL_POSTGRESQL = [
+    'CREATE EXTENSION IF NOT EXISTS btree_gist',
+    f"""
+    ALTER TABLE core_agendamento ADD CONSTRAINT {NOME_RESTRICAO}
+    EXCLUDE USING gist (
+        funcionario_id WITH =,
+        tstzrange(data_agendamento, data_fim, '[)') WITH &&
+    ) WHERE (status IN ('agendado', 'em_andamento'))
+    """,
+]
+
+SQL_POSTGRESQL_REVERSO = [
+    f'ALTER TABLE core_agendamento DROP CONSTRAINT IF EXISTS {NOME_RESTRICAO}',
+]
+
+# O SQLite não tem restrições de exclusão; triggers rejeitam a mesma sobreposição
+CONDICAO_SQLITE = f"""
+    SELECT RAISE(ABORT, '{NOME_RESTRICAO}')
+    WHERE EXISTS (
+        SELECT 1 FROM core_agendamento a
+        WHERE a.funcionario_id = NEW.funcionario_id
+          AND a.id IS NOT NEW.id
+          AND a.status IN ('agendado', 'em_andamento')
+          AND a.data_agendamento < NEW.data_fim
+          AND a.data_fim > NEW.data_agendamento
+    );
+"""
+
+SQL_SQLITE = [
+    f"""
+    CREATE TRIGGER {NOME_RESTRICAO}_insert
+    BEFORE INSERT ON core_agendamento
+    WHEN NEW.status IN ('agendado', 'em_andamento')
+    BEGIN {CONDICAO_SQLITE} END
+    """,
+    f"""
+    CREATE TRIGGER {NOME_RESTRICAO}_update
+    BEFORE UPDATE ON core_agendamento
+    WHEN NEW.status IN ('agendado', 'em_andamento')
+    BEGIN {CONDICAO_SQLITE} END
+    """,
+]
+
+SQL_SQLITE_REVERSO = [
+    f'DROP TRIGGER IF EXISTS {NOME_RESTRICAO}_insert',
+    f'DROP TRIGGER IF EXISTS {NOME_RESTRICAO}_update',
+]
+
+
+def preencher_data_fim(apps, schema_editor):
+    Servico = apps.get_model('core', 'Servico')
+    Agendamento = apps.get_model('core', 'Agendamento')
+    for servico in Servico.objects.all():
+        Agendamento.objects.filter(servico=servico).update(
+            data_fim=models.ExpressionWrapper(
+                models.F('data_agendamento') + timedelta(minutes=servico.duracao_minutos),
+                output_field=models.DateTimeField()
+            )
+        )
+
+
+# Pares de agendamentos ativos do mesmo funcionário que se sobrepõem
+SQL_SOBREPOSICOES = """
+    SELECT a.funcionario_id, a.id, a.data_agendamento, b.id, b.data_agendamento
+    FROM core_agendamento a
+    JOIN core_agendamento b
+      ON b.funcionario_id = a.funcionario_id
+     AND b.id > a.id
+     AND b.data_agendamento < a.data_fim
+     AND b.data_fim > a.data_agendamento
+    WHERE a.status IN ('agendado', 'em_andamento')
+      AND b.status IN ('agendado', 'em_andamento')
+    ORDER BY a.funcionario_id, a.data_agendamento
+"""
+SOBREPOSICOES_EXIBIDAS = 50
+
+
+def verificar_sobreposicoes(apps, schema_editor):
+    """
+    Interrompe a migração se já existem agendamentos ativos sobrepostos: no
+    PostgreSQL a restrição não seria criada, e no SQLite os triggers só
+    valeriam para as próximas gravações, deixando os dois bancos diferentes
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(SQL_SOBREPOSICOES)
+        pares = cursor.fetchall()
+    if not pares:
+        return
+    linhas = [
+        f'  funcionário {funcionario_id}: agendamento {a} ({inicio_a}) x agendamento {b} ({inicio_b})'
+        for funcionario_id, a, inicio_a, b, inicio_b in pares[:SOBREPOSICOES_EXIBIDAS]
+    ]
+    if len(pares) > SOBREPOSICOES_EXIBIDAS:
+        linhas.append(f'  ... e mais {len(pares) - SOBREPOSICOES_EXIBIDAS} par(es)')
+    raise RuntimeError(
+        f'Existem {len(pares)} par(es) de agendamentos ativos sobrepostos; a restrição '
+        f'{NOME_RESTRICAO} não pode ser criada. Cancele ou remarque um agendamento de cada '
+        'par (status "cancelado" ou "concluido" deixa de contar) e rode o migrate de novo:\n'
+        + '\n'.join(linhas)
+    )
+
+
+def _executar(schema_editor, comandos):
+    with schema_editor.connection.cursor() as cursor:
+        for sql in comandos:
+            cursor.execute(sql)
+
+
+def criar_restricao(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _executar(schema_editor, SQL_POSTGRESQL)
+    elif vendor == 'sqlite':
+        _executar(schema_editor, SQL_SQLITE)
+
+
+def remover_restricao(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _executar(schema_editor, SQL_POSTGRESQL_REVERSO)
+    elif vendor == 'sqlite':
+        _executar(schema_editor, SQL_SQLITE_REVERSO)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_agendamento_core_agenda_funcion_689fd6_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agendamento',
+            name='data_fim',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(preencher_data_fim, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='agendamento',
+            name='data_fim',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.RunPython(verificar_sobreposicoes, migrations.RunPython.noop),
+        migrations.RunPython(criar_restricao, remover_restricao),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-17 16:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_agendamento_data_fim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DisponibilidadeDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('minutos_livres', models.BinaryField()),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='disponibilidades', to='core.funcionario')),
+            ],
+            options={
+                'verbose_name': 'Disponibilidade Diária',
+                'verbose_name_plural': 'Disponibilidades Diárias',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='disponibilidadediaria',
+            constraint=models.UniqueConstraint(fields=('funcionario', 'data'), name='core_disponibilidade_funcionario_data_uniq'),
+        ),
+    ]
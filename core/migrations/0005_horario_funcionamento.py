@@ -0,0 +1,57 @@
+# Generated by Django 4.2 on 2026-10-17 16:08
+
+import datetime
+
+from django.db import migrations, models
+
+
+def criar_horario_padrao(apps, schema_editor):
+    # Mesmo horário que era fixo no AgendamentoForm: segunda a sexta, 08:00 às 18:00
+    HorarioFuncionamento = apps.get_model('core', 'HorarioFuncionamento')
+    HorarioFuncionamento.objects.bulk_create([
+        HorarioFuncionamento(
+            dia_semana=dia,
+            hora_inicio=datetime.time(8, 0),
+            hora_fim=datetime.time(18, 0),
+        )
+        for dia in range(5)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_disponibilidadediaria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataFechamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(unique=True)),
+                ('descricao', models.CharField(blank=True, max_length=100)),
+                ('recorrente', models.BooleanField(default=False, help_text='Repete todos os anos no mesmo dia e mês (feriados fixos)')),
+            ],
+            options={
+                'verbose_name': 'Data de Fechamento',
+                'verbose_name_plural': 'Datas de Fechamento',
+                'ordering': ['data'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HorarioFuncionamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Segunda-feira'), (1, 'Terça-feira'), (2, 'Quarta-feira'), (3, 'Quinta-feira'), (4, 'Sexta-feira'), (5, 'Sábado'), (6, 'Domingo')])),
+                ('hora_inicio', models.TimeField()),
+                ('hora_fim', models.TimeField()),
+            ],
+            options={
+                'verbose_name': 'Horário de Funcionamento',
+                'verbose_name_plural': 'Horários de Funcionamento',
+                'ordering': ['dia_semana', 'hora_inicio'],
+            },
+        ),
+        migrations.RunPython(criar_horario_padrao, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-17 16:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_horario_funcionamento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TurnoFuncionario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Segunda-feira'), (1, 'Terça-feira'), (2, 'Quarta-feira'), (3, 'Quinta-feira'), (4, 'Sexta-feira'), (5, 'Sábado'), (6, 'Domingo')])),
+                ('hora_inicio', models.TimeField()),
+                ('hora_fim', models.TimeField()),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnos', to='core.funcionario')),
+            ],
+            options={
+                'verbose_name': 'Turno do Funcionário',
+                'verbose_name_plural': 'Turnos dos Funcionários',
+                'ordering': ['funcionario', 'dia_semana', 'hora_inicio'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AusenciaFuncionario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('ferias', 'Férias'), ('atestado', 'Atestado Médico'), ('folga', 'Folga'), ('outro', 'Outro')], default='folga', max_length=10)),
+                ('inicio', models.DateTimeField()),
+                ('fim', models.DateTimeField()),
+                ('motivo', models.TextField(blank=True, null=True)),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ausencias', to='core.funcionario')),
+            ],
+            options={
+                'verbose_name': 'Ausência do Funcionário',
+                'verbose_name_plural': 'Ausências dos Funcionários',
+                'ordering': ['-inicio'],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-17 16:11
+
+from django.db import migrations, models
+
+
+def habilitar_servicos_existentes(apps, schema_editor):
+    # Até aqui qualquer funcionário podia realizar qualquer serviço
+    Funcionario = apps.get_model('core', 'Funcionario')
+    Servico = apps.get_model('core', 'Servico')
+    Habilitacao = Funcionario.servicos.through
+    servico_ids = list(Servico.objects.values_list('pk', flat=True))
+    Habilitacao.objects.bulk_create([
+        Habilitacao(funcionario_id=funcionario_id, servico_id=servico_id)
+        for funcionario_id in Funcionario.objects.values_list('pk', flat=True)
+        for servico_id in servico_ids
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_turnos_ausencias'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='funcionario',
+            name='servicos',
+            field=models.ManyToManyField(blank=True, help_text='Serviços que o funcionário pode realizar', related_name='funcionarios_habilitados', to='core.servico'),
+        ),
+        migrations.RunPython(habilitar_servicos_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-17 17:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_funcionario_servicos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SerieAgendamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('regra', models.CharField(choices=[('semanal', 'Semanal'), ('quinzenal', 'Quinzenal')], default='semanal', max_length=10)),
+                ('primeira_data', models.DateTimeField()),
+                ('quantidade', models.PositiveSmallIntegerField(blank=True, help_text='Número de ocorrências da regra (incluindo as exceções)', null=True)),
+                ('data_limite', models.DateField(blank=True, help_text='Última data possível da série', null=True)),
+                ('excecoes', models.JSONField(blank=True, default=list, help_text='Datas (AAAA-MM-DD) em que a série não acontece')),
+                ('observacoes', models.TextField(blank=True, null=True)),
+                ('data_criacao', models.DateTimeField(auto_now_add=True)),
+                ('cliente', models.ForeignKey(limit_choices_to={'tipo': 'cliente'}, on_delete=django.db.models.deletion.CASCADE, related_name='series_agendamento', to=settings.AUTH_USER_MODEL)),
+                ('criado_por', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='series_criadas', to=settings.AUTH_USER_MODEL)),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_agendamento', to='core.funcionario')),
+                ('servico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.servico')),
+            ],
+            options={
+                'verbose_name': 'Série de Agendamentos',
+                'verbose_name_plural': 'Séries de Agendamentos',
+                'ordering': ['-primeira_data'],
+            },
+        ),
+        migrations.AddField(
+            model_name='agendamento',
+            name='serie',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='agendamentos', to='core.serieagendamento'),
+        ),
+    ]
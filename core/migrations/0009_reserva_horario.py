@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-17 17:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_serie_agendamento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('inicio', models.DateTimeField()),
+                ('fim', models.DateTimeField()),
+                ('expira_em', models.DateTimeField()),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas_horario', to=settings.AUTH_USER_MODEL)),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='core.funcionario')),
+            ],
+            options={
+                'verbose_name': 'Reserva de Horário',
+                'verbose_name_plural': 'Reservas de Horário',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reservahorario',
+            index=models.Index(fields=['funcionario', 'expira_em'], name='core_reserv_funcion_30b829_idx'),
+        ),
+    ]
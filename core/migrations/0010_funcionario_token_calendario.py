@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-17 17:20
+
+import uuid
+
+from django.db import migrations, models
+
+
+def gerar_tokens(apps, schema_editor):
+    Funcionario = apps.get_model('core', 'Funcionario')
+    for funcionario_id in Funcionario.objects.values_list('pk', flat=True):
+        Funcionario.objects.filter(pk=funcionario_id).update(token_calendario=uuid.uuid4())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_reserva_horario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='funcionario',
+            name='token_calendario',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, null=True),
+        ),
+        migrations.RunPython(gerar_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='funcionario',
+            name='token_calendario',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 4.2 on 2026-10-17 17:21
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def preencher_resumos(apps, schema_editor):
+    """
+    Monta o resumo a partir dos agendamentos existentes, como
+    core.resumos.recalcular_resumos (comando atualizar_resumos), para o
+    dashboard e os relatórios não começarem zerados
+    """
+    Agendamento = apps.get_model('core', 'Agendamento')
+    ResumoDiarioAgendamento = apps.get_model('core', 'ResumoDiarioAgendamento')
+    grupos = Agendamento.objects.order_by().values(
+        'funcionario_id', 'servico_id', 'status',
+        dia=TruncDate('data_agendamento', tzinfo=timezone.get_current_timezone()),
+    ).annotate(
+        total=Count('pk'),
+        total_duracao=Sum(ExpressionWrapper(F('data_fim') - F('data_agendamento'), output_field=DurationField())),
+        total_receita=Coalesce(Sum('valor_final'), Decimal('0')),
+    )
+    ResumoDiarioAgendamento.objects.bulk_create([
+        ResumoDiarioAgendamento(
+            data=grupo['dia'],
+            funcionario_id=grupo['funcionario_id'],
+            servico_id=grupo['servico_id'],
+            status=grupo['status'],
+            quantidade=grupo['total'],
+            minutos=int(grupo['total_duracao'].total_seconds() // 60),
+            receita=grupo['total_receita'],
+        )
+        for grupo in grupos.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_funcionario_token_calendario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoDiarioAgendamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('status', models.CharField(choices=[('agendado', 'Agendado'), ('concluido', 'Concluído'), ('cancelado', 'Cancelado'), ('em_andamento', 'Em Andamento')], max_length=15)),
+                ('quantidade', models.IntegerField(default=0)),
+                ('minutos', models.IntegerField(default=0)),
+                ('receita', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos_diarios', to='core.funcionario')),
+                ('servico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos_diarios', to='core.servico')),
+            ],
+            options={
+                'verbose_name': 'Resumo Diário de Agendamentos',
+                'verbose_name_plural': 'Resumos Diários de Agendamentos',
+                'ordering': ['-data'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='resumodiarioagendamento',
+            index=models.Index(fields=['funcionario', 'data'], name='core_resumo_funcion_f5fecb_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='resumodiarioagendamento',
+            constraint=models.UniqueConstraint(fields=('data', 'funcionario', 'servico', 'status'), name='core_resumo_diario_uniq'),
+        ),
+        migrations.RunPython(preencher_resumos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-17 17:24
+
+from django.db import migrations, models
+
+
+def semear_contadores(apps, schema_editor):
+    # Mesmas regras de core/contadores.py, com a contagem atual das tabelas
+    ContadorEntidade = apps.get_model('core', 'ContadorEntidade')
+    Usuario = apps.get_model('core', 'Usuario')
+    Funcionario = apps.get_model('core', 'Funcionario')
+    Servico = apps.get_model('core', 'Servico')
+    ContadorEntidade.objects.bulk_create([
+        ContadorEntidade(nome='usuarios', valor=Usuario.objects.filter(ativo=True).count()),
+        ContadorEntidade(nome='clientes', valor=Usuario.objects.filter(tipo='cliente', ativo=True).count()),
+        ContadorEntidade(nome='funcionarios', valor=Funcionario.objects.filter(ativo=True).count()),
+        ContadorEntidade(nome='servicos', valor=Servico.objects.filter(ativo=True).count()),
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_resumo_diario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorEntidade',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=30, unique=True)),
+                ('valor', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador',
+                'verbose_name_plural': 'Contadores',
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.RunPython(semear_contadores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-17 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_contador_entidade'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['data_agendamento'], name='core_agenda_data_ag_7e1e01_idx'),
+        ),
+    ]
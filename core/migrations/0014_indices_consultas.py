@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-17 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_agendamento_data_agendamento_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['cliente', 'data_agendamento'], name='core_agenda_cliente_61377d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(fields=['status', 'data_agendamento'], name='core_agenda_status_e7ee48_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(fields=['email'], name='core_usuari_email_bbb8bb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(condition=models.Q(('ativo', True)), fields=['tipo', 'first_name', 'last_name'], name='core_usuario_ativo_tipo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(condition=models.Q(('ativo', True)), fields=['first_name', 'last_name'], name='core_usuario_ativo_nome_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-17 17:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaRelatorio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('agendamentos', 'Agendamentos'), ('receitas', 'Receitas')], max_length=15)),
+                ('formato', models.CharField(choices=[('csv', 'CSV'), ('xlsx', 'XLSX')], default='csv', max_length=4)),
+                ('parametros', models.JSONField(default=dict)),
+                ('chave', models.CharField(max_length=64)),
+                ('versao_dados', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('concluido', 'Concluído'), ('erro', 'Erro')], default='pendente', max_length=15)),
+                ('total_linhas', models.PositiveIntegerField(blank=True, null=True)),
+                ('linhas_processadas', models.PositiveIntegerField(default=0)),
+                ('arquivo', models.CharField(blank=True, max_length=255)),
+                ('erro', models.TextField(blank=True)),
+                ('data_criacao', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('solicitado_por', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tarefas_relatorio', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Tarefa de Relatório',
+                'verbose_name_plural': 'Tarefas de Relatório',
+                'ordering': ['-data_criacao'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tarefarelatorio',
+            index=models.Index(fields=['chave', 'versao_dados'], name='core_tarefa_chave_347a16_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tarefarelatorio',
+            index=models.Index(fields=['status', 'data_criacao'], name='core_tarefa_status_7f578d_idx'),
+        ),
+    ]
@@ -0,0 +1,110 @@
+from datetime import date, datetime, time
+
+from django.db import migrations
+from django.utils import timezone
+
+
+TABELA = 'core_logauditoria'
+PARTICAO_PADRAO = f'{TABELA}_padrao'
+PARTICOES_FUTURAS = 3
+
+INDICES = [
+    ('core_logaud_usuario_0123c3_idx', 'usuario_id, "timestamp"'),
+    ('core_logaud_modelo_f6597c_idx', 'modelo, "timestamp"'),
+    ('core_logaud_acao_ce6ad0_idx', 'acao, "timestamp"'),
+]
+
+COLUNAS = 'id, acao, modelo, objeto_id, objeto_repr, detalhes, ip_address, user_agent, "timestamp", usuario_id'
+
+DEFINICAO_COLUNAS = """
+    acao varchar(10) NOT NULL,
+    modelo varchar(100) NOT NULL,
+    objeto_id integer NULL CHECK (objeto_id >= 0),
+    objeto_repr varchar(200) NOT NULL,
+    detalhes jsonb NOT NULL,
+    ip_address inet NULL,
+    user_agent text NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    usuario_id bigint NULL
+"""
+
+
+def _somar_meses(mes, quantidade):
+    total = mes.year * 12 + mes.month - 1 + quantidade
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _meia_noite(data):
+    return datetime.combine(data, time.min, tzinfo=timezone.get_current_timezone()).isoformat()
+
+
+def _restricoes_e_indices(cursor, chave_primaria):
+    cursor.execute(f'ALTER TABLE {TABELA} ADD CONSTRAINT {TABELA}_pkey PRIMARY KEY ({chave_primaria})')
+    cursor.execute(
+        f'ALTER TABLE {TABELA} ADD CONSTRAINT {TABELA}_usuario_id_fk_core_usuario_id '
+        'FOREIGN KEY (usuario_id) REFERENCES core_usuario (id) DEFERRABLE INITIALLY DEFERRED'
+    )
+    for nome, colunas in INDICES:
+        cursor.execute(f'CREATE INDEX {nome} ON {TABELA} ({colunas})')
+
+
+def particionar(apps, schema_editor):
+    """
+    Recria core_logauditoria particionada por mês de timestamp, com uma
+    partição para cada mês com dados até PARTICOES_FUTURAS meses à frente e
+    a partição padrão. A chave primária passa a ser (id, timestamp), como o
+    PostgreSQL exige; os ids continuam vindo de uma única sequência.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT min("timestamp"), max("timestamp") FROM {TABELA}')
+        primeiro, ultimo = cursor.fetchone()
+        atual = timezone.localdate().replace(day=1)
+        mes = timezone.localdate(primeiro).replace(day=1) if primeiro else atual
+        limite = max(_somar_meses(atual, PARTICOES_FUTURAS), timezone.localdate(ultimo).replace(day=1) if ultimo else atual)
+
+        cursor.execute(f'ALTER TABLE {TABELA} RENAME TO {TABELA}_antiga')
+        cursor.execute(f'CREATE TABLE {TABELA} (id bigint NOT NULL, {DEFINICAO_COLUNAS}) PARTITION BY RANGE ("timestamp")')
+        cursor.execute(f'CREATE TABLE {PARTICAO_PADRAO} PARTITION OF {TABELA} DEFAULT')
+        while mes <= limite:
+            cursor.execute(
+                f"CREATE TABLE {TABELA}_{mes:%Y%m} PARTITION OF {TABELA} "
+                f"FOR VALUES FROM ('{_meia_noite(mes)}') TO ('{_meia_noite(_somar_meses(mes, 1))}')"
+            )
+            mes = _somar_meses(mes, 1)
+
+        cursor.execute(f'INSERT INTO {TABELA} ({COLUNAS}) SELECT {COLUNAS} FROM {TABELA}_antiga')
+        cursor.execute(f'DROP TABLE {TABELA}_antiga')
+
+        cursor.execute(f'CREATE SEQUENCE {TABELA}_id_seq OWNED BY {TABELA}.id')
+        cursor.execute(f"SELECT setval('{TABELA}_id_seq', COALESCE((SELECT max(id) FROM {TABELA}), 0) + 1, false)")
+        cursor.execute(f"ALTER TABLE {TABELA} ALTER COLUMN id SET DEFAULT nextval('{TABELA}_id_seq')")
+        _restricoes_e_indices(cursor, 'id, "timestamp"')
+
+
+def desparticionar(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABELA} RENAME TO {TABELA}_particionada')
+        cursor.execute(
+            f'CREATE TABLE {TABELA} (id bigint NOT NULL GENERATED BY DEFAULT AS IDENTITY, {DEFINICAO_COLUNAS})'
+        )
+        cursor.execute(f'INSERT INTO {TABELA} ({COLUNAS}) SELECT {COLUNAS} FROM {TABELA}_particionada')
+        cursor.execute(f'DROP TABLE {TABELA}_particionada CASCADE')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{TABELA}', 'id'), COALESCE((SELECT max(id) FROM {TABELA}), 0) + 1, false)"
+        )
+        _restricoes_e_indices(cursor, 'id')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_logauditoria_timestamp_na_criacao'),
+    ]
+
+    operations = [
+        migrations.RunPython(particionar, desparticionar),
+    ]
@@ -0,0 +1,168 @@
+import hashlib
+import ipaddress
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# (coluna com o texto, tabela de valores, chave estrangeira, expressão da chave no PostgreSQL)
+VALORES = [
+    ('modelo', 'core_modeloauditoria', 'modelo_auditado_id', None),
+    ('ip_address', 'core_enderecoauditoria', 'endereco_ip_id', None),
+    ('user_agent', 'core_agenteauditoria', 'agente_usuario_id', 'md5({})'),
+]
+
+
+def _chave_ip(valor):
+    try:
+        return str(ipaddress.ip_address(valor.strip()))
+    except ValueError:
+        return None
+
+
+def _preencher_postgresql(cursor):
+    # Um INSERT ... SELECT DISTINCT e um UPDATE ... FROM por tabela, sem trazer os logs para o Python
+    for coluna, tabela, chave_estrangeira, hash in VALORES:
+        if hash:
+            cursor.execute(f"""
+                INSERT INTO {tabela} (valor, hash)
+                SELECT valor, {hash.format('valor')} FROM (
+                    SELECT DISTINCT {coluna} AS valor FROM core_logauditoria WHERE {coluna} IS NOT NULL
+                ) distintos
+            """)
+            condicao = f'v.hash = {hash.format("l." + coluna)}'
+        else:
+            cursor.execute(f"""
+                INSERT INTO {tabela} (valor)
+                SELECT DISTINCT {coluna} FROM core_logauditoria WHERE {coluna} IS NOT NULL
+            """)
+            condicao = f'v.valor = l.{coluna}'
+        cursor.execute(f'UPDATE core_logauditoria l SET {chave_estrangeira} = v.id FROM {tabela} v WHERE {condicao}')
+
+
+def preencher_valores(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        with schema_editor.connection.cursor() as cursor:
+            _preencher_postgresql(cursor)
+        return
+
+    LogAuditoria = apps.get_model('core', 'LogAuditoria')
+    ModeloAuditoria = apps.get_model('core', 'ModeloAuditoria')
+    EnderecoAuditoria = apps.get_model('core', 'EnderecoAuditoria')
+    AgenteAuditoria = apps.get_model('core', 'AgenteAuditoria')
+    logs = LogAuditoria.objects.all()
+
+    for valor in logs.values_list('modelo', flat=True).distinct():
+        modelo = ModeloAuditoria.objects.create(valor=valor)
+        logs.filter(modelo=valor).update(modelo_auditado=modelo)
+
+    for valor in logs.exclude(ip_address=None).values_list('ip_address', flat=True).distinct():
+        chave = _chave_ip(valor)
+        if chave is not None:
+            endereco, _ = EnderecoAuditoria.objects.get_or_create(valor=chave)
+            logs.filter(ip_address=valor).update(endereco_ip=endereco)
+
+    for valor in logs.exclude(user_agent=None).values_list('user_agent', flat=True).distinct():
+        agente = AgenteAuditoria.objects.create(valor=valor, hash=hashlib.md5(valor.encode('utf-8')).hexdigest())
+        logs.filter(user_agent=valor).update(agente_usuario=agente)
+
+
+def restaurar_textos(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for coluna, tabela, chave_estrangeira, _ in VALORES:
+            cursor.execute(f"""
+                UPDATE core_logauditoria SET {coluna} = (
+                    SELECT valor FROM {tabela} WHERE {tabela}.id = core_logauditoria.{chave_estrangeira}
+                ) WHERE {chave_estrangeira} IS NOT NULL
+            """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_logauditoria_particionada'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgenteAuditoria',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('valor', models.TextField()),
+                ('hash', models.CharField(max_length=32, unique=True)),
+            ],
+            options={
+                'verbose_name': 'User Agent Auditado',
+                'verbose_name_plural': 'User Agents Auditados',
+            },
+        ),
+        migrations.CreateModel(
+            name='EnderecoAuditoria',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('valor', models.GenericIPAddressField(unique=True)),
+            ],
+            options={
+                'verbose_name': 'Endereço IP Auditado',
+                'verbose_name_plural': 'Endereços IP Auditados',
+            },
+        ),
+        migrations.CreateModel(
+            name='ModeloAuditoria',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('valor', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Modelo Auditado',
+                'verbose_name_plural': 'Modelos Auditados',
+            },
+        ),
+        migrations.AddField(
+            model_name='logauditoria',
+            name='modelo_auditado',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='core.modeloauditoria', verbose_name='modelo'),
+        ),
+        migrations.AddField(
+            model_name='logauditoria',
+            name='endereco_ip',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='core.enderecoauditoria', verbose_name='IP'),
+        ),
+        migrations.AddField(
+            model_name='logauditoria',
+            name='agente_usuario',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='core.agenteauditoria', verbose_name='user agent'),
+        ),
+        # Anulável antes da cópia para que, ao desfazer, o texto seja restaurado antes do NOT NULL
+        migrations.AlterField(
+            model_name='logauditoria',
+            name='modelo',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.RunPython(preencher_valores, restaurar_textos),
+        migrations.RemoveIndex(
+            model_name='logauditoria',
+            name='core_logaud_modelo_f6597c_idx',
+        ),
+        migrations.RemoveField(
+            model_name='logauditoria',
+            name='modelo',
+        ),
+        migrations.RemoveField(
+            model_name='logauditoria',
+            name='ip_address',
+        ),
+        migrations.RemoveField(
+            model_name='logauditoria',
+            name='user_agent',
+        ),
+        migrations.AlterField(
+            model_name='logauditoria',
+            name='modelo_auditado',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='core.modeloauditoria', verbose_name='modelo'),
+        ),
+        migrations.AddIndex(
+            model_name='logauditoria',
+            index=models.Index(fields=['modelo_auditado', 'timestamp'], name='core_logaud_modelo__980b83_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-17 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_valores_auditoria'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='logauditoria',
+            index=models.Index(fields=['objeto_id', 'timestamp'], name='core_logaud_objeto__6ba206_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logauditoria',
+            index=models.Index(fields=['timestamp', 'id'], name='core_logaud_timesta_21777f_idx'),
+        ),
+    ]
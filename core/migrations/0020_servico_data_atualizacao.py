@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_logauditoria_indices_admin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servico',
+            name='data_atualizacao',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,12 +1,47 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from PIL import Image
+import hashlib
+import ipaddress
 import os
+import uuid
 
 
-class Usuario(AbstractUser):
+class EstadoOriginalMixin:
+    """
+    Guarda os valores carregados do banco para que saves e signals possam
+    comparar o estado anterior com o atual
+    """
+    _estado_original = {}
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._estado_original = dict(zip(field_names, values))
+        return instance
+    
+    def save(self, *args, **kwargs):
+        # Os receivers de post_save rodam na mesma transação da gravação
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+        deferidos = self.get_deferred_fields()
+        self._estado_original = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferidos
+        }
+    
+    def valor_original(self, campo, padrao=None):
+        """Valor do campo (attname) quando o objeto foi carregado ou salvo pela última vez"""
+        return self._estado_original.get(campo, padrao)
+
+
+class Usuario(EstadoOriginalMixin, AbstractUser):
     """
     Modelo customizado de usuário com campos adicionais e tipos
     """
@@ -46,6 +81,21 @@ class Usuario(AbstractUser):
         verbose_name = 'Usuário'
         verbose_name_plural = 'Usuários'
         ordering = ['first_name', 'last_name']
+        indexes = [
+            # LoginForm aceita email no lugar do username
+            models.Index(fields=['email']),
+            # Listas de usuários e de clientes ativos, já na ordem de exibição
+            models.Index(
+                fields=['tipo', 'first_name', 'last_name'],
+                condition=models.Q(ativo=True),
+                name='core_usuario_ativo_tipo_idx'
+            ),
+            models.Index(
+                fields=['first_name', 'last_name'],
+                condition=models.Q(ativo=True),
+                name='core_usuario_ativo_nome_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.first_name} {self.last_name}" if self.first_name else self.username
@@ -105,7 +155,7 @@ class Cargo(models.Model):
         return not self.funcionario_set.exists()
 
 
-class Funcionario(models.Model):
+class Funcionario(EstadoOriginalMixin, models.Model):
     """
     Modelo para funcionários da empresa
     """
@@ -119,6 +169,14 @@ class Funcionario(models.Model):
         decimal_places=2, 
         validators=[MinValueValidator(0)]
     )
+    servicos = models.ManyToManyField(
+        'Servico',
+        blank=True,
+        related_name='funcionarios_habilitados',
+        help_text='Serviços que o funcionário pode realizar'
+    )
+    # Identifica o feed .ics do funcionário (acesso sem login)
+    token_calendario = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     observacoes = models.TextField(blank=True, null=True)
     ativo = models.BooleanField(default=True)
     data_criacao = models.DateTimeField(auto_now_add=True)
@@ -152,7 +210,7 @@ class Funcionario(models.Model):
         return self.ativo and self.data_demissao is None
 
 
-class Servico(models.Model):
+class Servico(EstadoOriginalMixin, models.Model):
     """
     Modelo para serviços oferecidos pela empresa
     """
@@ -168,6 +226,7 @@ class Servico(models.Model):
     )
     ativo = models.BooleanField(default=True)
     data_criacao = models.DateTimeField(auto_now_add=True)
+    data_atualizacao = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Serviço'
@@ -177,6 +236,45 @@ class Servico(models.Model):
     def __str__(self):
         return f"{self.nome} - R$ {self.preco}"
     
+    def agendamentos_pendentes(self, agora=None):
+        """Agendamentos ativos do serviço que ainda não terminaram"""
+        return Agendamento.objects.ativos().filter(
+            servico=self, data_fim__gt=agora or timezone.now()
+        )
+    
+    def save(self, *args, **kwargs):
+        duracao_alterada = bool(self.pk) and Servico.objects.filter(
+            pk=self.pk
+        ).exclude(duracao_minutos=self.duracao_minutos).exists()
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # Só os agendamentos pendentes acompanham a nova duração; o
+            # histórico mantém a duração com que foi atendido
+            if duracao_alterada:
+                from .resumos import contribuicao, registrar_contribuicoes
+                
+                duracao = timedelta(minutes=self.duracao_minutos)
+                pendentes = list(self.agendamentos_pendentes().select_for_update())
+                with traduzir_conflito_horario():
+                    Agendamento.objects.filter(pk__in=[a.pk for a in pendentes]).update(
+                        data_fim=models.ExpressionWrapper(
+                            models.F('data_agendamento') + duracao,
+                            output_field=models.DateTimeField()
+                        ),
+                        data_atualizacao=timezone.now()
+                    )
+                
+                contribuicoes = [(-1, contribuicao(agendamento)) for agendamento in pendentes]
+                for agendamento in pendentes:
+                    agendamento.data_fim = agendamento.data_agendamento + duracao
+                contribuicoes += [(1, contribuicao(agendamento)) for agendamento in pendentes]
+                registrar_contribuicoes(contribuicoes)
+                
+                from .disponibilidade import invalidar_disponibilidade
+                invalidar_disponibilidade({agendamento.funcionario_id for agendamento in pendentes})
+    
     def duracao_formatada(self):
         """Retorna a duração formatada em horas e minutos"""
         horas = self.duracao_minutos // 60
@@ -187,7 +285,75 @@ class Servico(models.Model):
         return f"{minutos}min"
 
 
-class Agendamento(models.Model):
+class ConflitoHorario(ValidationError):
+    """Agendamento rejeitado pelo banco por sobrepor outro do mesmo funcionário"""
+
+
+@contextmanager
+def traduzir_conflito_horario():
+    """Converte a violação da restrição de sobreposição em ConflitoHorario"""
+    try:
+        yield
+    except IntegrityError as e:
+        if Agendamento.RESTRICAO_SOBREPOSICAO in str(e):
+            raise ConflitoHorario(
+                'Conflito de horário: o funcionário já possui um agendamento neste período.'
+            ) from e
+        raise
+
+
+class AgendamentoQuerySet(models.QuerySet):
+    """
+    Filtros por período que comparam data_agendamento direto com timestamps.
+    Datas locais (America/Sao_Paulo) viram intervalos semiabertos
+    [meia-noite local, meia-noite local do dia seguinte), em vez de
+    data_agendamento__date, que converte a coluna e impede o uso do índice.
+    """
+    
+    def iniciando_entre(self, inicio, fim):
+        """Agendamentos que começam em [inicio, fim)"""
+        return self.filter(data_agendamento__gte=inicio, data_agendamento__lt=fim)
+    
+    def entre(self, data_inicio, data_fim):
+        """Agendamentos que começam entre as datas locais (inclusivas)"""
+        from .disponibilidade import inicio_do_dia
+        fuso = timezone.get_current_timezone()
+        return self.iniciando_entre(
+            inicio_do_dia(data_inicio, fuso),
+            inicio_do_dia(data_fim + timedelta(days=1), fuso)
+        )
+    
+    def do_dia(self, data):
+        return self.entre(data, data)
+    
+    def hoje(self):
+        return self.do_dia(timezone.localdate())
+    
+    def proximos(self, dias):
+        """Agendamentos a partir de agora até o fim do dia local hoje + dias"""
+        from .disponibilidade import inicio_do_dia
+        agora = timezone.now()
+        return self.iniciando_entre(
+            agora, inicio_do_dia(timezone.localdate(agora) + timedelta(days=dias + 1))
+        )
+    
+    def sobrepondo(self, inicio, fim):
+        """
+        Agendamentos que se sobrepõem a [inicio, fim). Nenhum agendamento que
+        comece antes de inicio - duração máxima dos serviços termina depois
+        de inicio, então data_agendamento também tem limite inferior.
+        """
+        from .conflitos import duracao_maxima_servicos
+        return self.iniciando_entre(
+            inicio - timedelta(minutes=duracao_maxima_servicos()), fim
+        ).filter(data_fim__gt=inicio)
+    
+    def ativos(self):
+        """Agendamentos que ocupam a agenda do funcionário"""
+        return self.filter(status__in=self.model.STATUS_ATIVOS)
+
+
+class Agendamento(EstadoOriginalMixin, models.Model):
     """
     Modelo principal para agendamentos
     """
@@ -198,6 +364,13 @@ class Agendamento(models.Model):
         ('em_andamento', 'Em Andamento'),
     ]
     
+    # Status que ocupam a agenda do funcionário
+    STATUS_ATIVOS = ['agendado', 'em_andamento']
+    
+    # Restrição criada na migração 0003: exclusão GiST no PostgreSQL e
+    # triggers equivalentes no SQLite
+    RESTRICAO_SOBREPOSICAO = 'core_agendamento_sem_sobreposicao'
+    
     cliente = models.ForeignKey(
         Usuario, 
         on_delete=models.CASCADE, 
@@ -211,6 +384,8 @@ class Agendamento(models.Model):
     )
     servico = models.ForeignKey(Servico, on_delete=models.CASCADE)
     data_agendamento = models.DateTimeField()
+    # Mantido por save() e por Servico.save() quando a duração muda
+    data_fim = models.DateTimeField(editable=False)
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='agendado')
     observacoes = models.TextField(blank=True, null=True)
     valor_final = models.DecimalField(
@@ -227,11 +402,30 @@ class Agendamento(models.Model):
         null=True, 
         related_name='agendamentos_criados'
     )
+    serie = models.ForeignKey(
+        'SerieAgendamento',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='agendamentos'
+    )
+    
+    objects = AgendamentoQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Agendamento'
         verbose_name_plural = 'Agendamentos'
         ordering = ['-data_agendamento']
+        indexes = [
+            # Conflitos, disponibilidade e agenda de cada funcionário
+            models.Index(fields=['funcionario', 'data_agendamento']),
+            # Histórico do cliente
+            models.Index(fields=['cliente', 'data_agendamento']),
+            # Próximos agendamentos por status (dashboard)
+            models.Index(fields=['status', 'data_agendamento']),
+            # Períodos sem funcionário ou status (calendário, resumos)
+            models.Index(fields=['data_agendamento']),
+        ]
     
     def __str__(self):
         return f"{self.cliente.get_full_name()} - {self.servico.nome} - {self.data_agendamento.strftime('%d/%m/%Y %H:%M')}"
@@ -241,13 +435,44 @@ class Agendamento(models.Model):
         if not self.valor_final:
             self.valor_final = self.servico.preco
         
-        super().save(*args, **kwargs)
+        self.data_fim = self.data_hora_fim()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'data_agendamento', 'servico'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'data_fim'}
+        
+        with traduzir_conflito_horario(), transaction.atomic():
+            super().save(*args, **kwargs)
     
     def data_hora_fim(self):
         """Calcula a data/hora de fim baseada na duração do serviço"""
-        from datetime import timedelta
         return self.data_agendamento + timedelta(minutes=self.servico.duracao_minutos)
     
+    def intervalos_ocupados(self, original=False):
+        """
+        Retorna [(funcionario_id, data local)] dos dias em que o agendamento
+        ocupa a agenda. Com original=True usa o estado carregado do banco.
+        """
+        if original:
+            funcionario_id = self.valor_original('funcionario_id')
+            inicio = self.valor_original('data_agendamento')
+            fim = self.valor_original('data_fim')
+            status = self.valor_original('status')
+        else:
+            funcionario_id, inicio, fim, status = (
+                self.funcionario_id, self.data_agendamento, self.data_fim, self.status
+            )
+        
+        if not (funcionario_id and inicio and fim) or status not in self.STATUS_ATIVOS:
+            return []
+        
+        data = timezone.localdate(inicio)
+        ultima = timezone.localdate(fim - timedelta(microseconds=1))
+        dias = []
+        while data <= ultima:
+            dias.append((funcionario_id, data))
+            data += timedelta(days=1)
+        return dias
+    
     def pode_cancelar(self):
         """Verifica se o agendamento pode ser cancelado"""
         return self.status in ['agendado'] and self.data_agendamento > timezone.now()
@@ -257,6 +482,278 @@ class Agendamento(models.Model):
         return self.data_agendamento < timezone.now()
 
 
+class SerieAgendamento(models.Model):
+    """
+    Regra de recorrência de um cliente com o mesmo funcionário e serviço. As
+    ocorrências são criadas de uma vez como Agendamentos (core/recorrencia.py)
+    """
+    REGRA_CHOICES = [
+        ('semanal', 'Semanal'),
+        ('quinzenal', 'Quinzenal'),
+    ]
+    
+    # Dias entre ocorrências de cada regra
+    INTERVALO_DIAS = {'semanal': 7, 'quinzenal': 14}
+    
+    MAXIMO_OCORRENCIAS = 104
+    
+    cliente = models.ForeignKey(
+        Usuario,
+        on_delete=models.CASCADE,
+        related_name='series_agendamento',
+        limit_choices_to={'tipo': 'cliente'}
+    )
+    funcionario = models.ForeignKey(
+        Funcionario,
+        on_delete=models.CASCADE,
+        related_name='series_agendamento'
+    )
+    servico = models.ForeignKey(Servico, on_delete=models.CASCADE)
+    regra = models.CharField(max_length=10, choices=REGRA_CHOICES, default='semanal')
+    primeira_data = models.DateTimeField()
+    quantidade = models.PositiveSmallIntegerField(
+        null=True, blank=True,
+        help_text='Número de ocorrências da regra (incluindo as exceções)'
+    )
+    data_limite = models.DateField(
+        null=True, blank=True,
+        help_text='Última data possível da série'
+    )
+    excecoes = models.JSONField(
+        default=list, blank=True,
+        help_text='Datas (AAAA-MM-DD) em que a série não acontece'
+    )
+    observacoes = models.TextField(blank=True, null=True)
+    data_criacao = models.DateTimeField(auto_now_add=True)
+    criado_por = models.ForeignKey(
+        Usuario,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='series_criadas'
+    )
+    
+    class Meta:
+        verbose_name = 'Série de Agendamentos'
+        verbose_name_plural = 'Séries de Agendamentos'
+        ordering = ['-primeira_data']
+    
+    def __str__(self):
+        return f"{self.cliente.get_full_name()} - {self.servico.nome} - {self.get_regra_display()}"
+    
+    def clean(self):
+        if (self.quantidade is None) == (self.data_limite is None):
+            raise ValidationError('Informe a quantidade de ocorrências ou a data limite.')
+        if self.quantidade is not None and not 1 <= self.quantidade <= self.MAXIMO_OCORRENCIAS:
+            raise ValidationError(
+                f'A quantidade deve estar entre 1 e {self.MAXIMO_OCORRENCIAS}.'
+            )
+    
+    def ocorrencias(self):
+        """
+        Datetimes de início das ocorrências, mantendo o mesmo horário local
+        (também em mudanças de horário de verão) e pulando as exceções
+        """
+        local = timezone.localtime(self.primeira_data)
+        passo = timedelta(days=self.INTERVALO_DIAS[self.regra])
+        excecoes = {str(data) for data in self.excecoes or []}
+        
+        inicios = []
+        data = local.date()
+        for i in range(self.quantidade or self.MAXIMO_OCORRENCIAS):
+            if self.data_limite and data > self.data_limite:
+                break
+            if data.isoformat() not in excecoes:
+                inicios.append(timezone.make_aware(datetime.combine(data, local.time())))
+            data += passo
+        return inicios
+
+
+class DisponibilidadeDiaria(models.Model):
+    """
+    Snapshot dos minutos livres de um funcionário em um dia, mantido para a
+    janela de AGENDA_JANELA_CACHE_DIAS dias a partir de hoje
+    """
+    funcionario = models.ForeignKey(
+        Funcionario,
+        on_delete=models.CASCADE,
+        related_name='disponibilidades'
+    )
+    data = models.DateField()
+    # Um bit por minuto do dia (1440 bits), 1 = livre
+    minutos_livres = models.BinaryField()
+    atualizado_em = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Disponibilidade Diária'
+        verbose_name_plural = 'Disponibilidades Diárias'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['funcionario', 'data'],
+                name='core_disponibilidade_funcionario_data_uniq'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.funcionario_id} - {self.data.strftime('%d/%m/%Y')}"
+
+
+class ReservaHorario(models.Model):
+    """
+    Bloqueio temporário de um horário do funcionário enquanto o agendamento
+    é preenchido. Expira em AGENDA_RESERVA_TTL_SEGUNDOS (core/reservas.py)
+    """
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    funcionario = models.ForeignKey(
+        Funcionario,
+        on_delete=models.CASCADE,
+        related_name='reservas'
+    )
+    inicio = models.DateTimeField()
+    fim = models.DateTimeField()
+    expira_em = models.DateTimeField()
+    criado_por = models.ForeignKey(
+        Usuario,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='reservas_horario'
+    )
+    
+    class Meta:
+        verbose_name = 'Reserva de Horário'
+        verbose_name_plural = 'Reservas de Horário'
+        indexes = [
+            models.Index(fields=['funcionario', 'expira_em']),
+        ]
+    
+    def __str__(self):
+        return f"{self.funcionario_id} - {self.inicio:%d/%m/%Y %H:%M} (até {self.expira_em:%H:%M:%S})"
+
+
+class ResumoDiarioAgendamento(models.Model):
+    """
+    Totais de agendamentos por dia (data local), funcionário, serviço e
+    status, mantidos incrementalmente pelos signals de Agendamento
+    (core/resumos.py)
+    """
+    data = models.DateField()
+    funcionario = models.ForeignKey(
+        Funcionario,
+        on_delete=models.CASCADE,
+        related_name='resumos_diarios'
+    )
+    servico = models.ForeignKey(
+        Servico,
+        on_delete=models.CASCADE,
+        related_name='resumos_diarios'
+    )
+    status = models.CharField(max_length=15, choices=Agendamento.STATUS_CHOICES)
+    quantidade = models.IntegerField(default=0)
+    minutos = models.IntegerField(default=0)
+    receita = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    class Meta:
+        verbose_name = 'Resumo Diário de Agendamentos'
+        verbose_name_plural = 'Resumos Diários de Agendamentos'
+        ordering = ['-data']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['data', 'funcionario', 'servico', 'status'],
+                name='core_resumo_diario_uniq'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['funcionario', 'data']),
+        ]
+    
+    def __str__(self):
+        return f"{self.data:%d/%m/%Y} - {self.funcionario_id} - {self.servico_id} - {self.status}: {self.quantidade}"
+
+
+class ContadorEntidade(models.Model):
+    """
+    Totais exibidos no dashboard (usuários, clientes, funcionários e
+    serviços ativos), mantidos pelos signals em core/contadores.py
+    """
+    nome = models.CharField(max_length=30, unique=True)
+    valor = models.IntegerField(default=0)
+    
+    class Meta:
+        verbose_name = 'Contador'
+        verbose_name_plural = 'Contadores'
+        ordering = ['nome']
+    
+    def __str__(self):
+        return f"{self.nome}: {self.valor}"
+
+
+class TarefaRelatorio(models.Model):
+    """
+    Exportação de relatório processada em segundo plano pelo comando
+    processar_relatorios (core/relatorios.py). O arquivo gerado é reaproveitado
+    por pedidos com os mesmos parâmetros enquanto os dados não mudam.
+    """
+    TIPO_CHOICES = [
+        ('agendamentos', 'Agendamentos'),
+        ('receitas', 'Receitas'),
+    ]
+    
+    FORMATO_CHOICES = [
+        ('csv', 'CSV'),
+        ('xlsx', 'XLSX'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('concluido', 'Concluído'),
+        ('erro', 'Erro'),
+    ]
+    
+    tipo = models.CharField(max_length=15, choices=TIPO_CHOICES)
+    formato = models.CharField(max_length=4, choices=FORMATO_CHOICES, default='csv')
+    parametros = models.JSONField(default=dict)
+    # Hash de tipo, formato e parâmetros
+    chave = models.CharField(max_length=64)
+    # Versão dos agendamentos do período quando o pedido foi feito
+    versao_dados = models.CharField(max_length=64)
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='pendente')
+    total_linhas = models.PositiveIntegerField(null=True, blank=True)
+    linhas_processadas = models.PositiveIntegerField(default=0)
+    arquivo = models.CharField(max_length=255, blank=True)
+    erro = models.TextField(blank=True)
+    solicitado_por = models.ForeignKey(
+        Usuario,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='tarefas_relatorio'
+    )
+    data_criacao = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Tarefa de Relatório'
+        verbose_name_plural = 'Tarefas de Relatório'
+        ordering = ['-data_criacao']
+        indexes = [
+            models.Index(fields=['chave', 'versao_dados']),
+            models.Index(fields=['status', 'data_criacao']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_tipo_display()} ({self.formato}) - {self.get_status_display()}"
+    
+    @property
+    def progresso(self):
+        """Percentual concluído (0 a 100)"""
+        if self.status == 'concluido':
+            return 100
+        if not self.total_linhas:
+            return 0
+        return min(99, self.linhas_processadas * 100 // self.total_linhas)
+
+
 class ConfiguracaoEmpresa(models.Model):
     """
     Modelo para configurações da empresa (Singleton)
@@ -309,6 +806,221 @@ class ConfiguracaoEmpresa(models.Model):
         return obj
 
 
+class HorarioFuncionamento(models.Model):
+    """
+    Faixa de horário de funcionamento da empresa em um dia da semana
+    """
+    DIA_SEMANA_CHOICES = [
+        (0, 'Segunda-feira'),
+        (1, 'Terça-feira'),
+        (2, 'Quarta-feira'),
+        (3, 'Quinta-feira'),
+        (4, 'Sexta-feira'),
+        (5, 'Sábado'),
+        (6, 'Domingo'),
+    ]
+    
+    dia_semana = models.PositiveSmallIntegerField(choices=DIA_SEMANA_CHOICES)
+    hora_inicio = models.TimeField()
+    hora_fim = models.TimeField()
+    
+    class Meta:
+        verbose_name = 'Horário de Funcionamento'
+        verbose_name_plural = 'Horários de Funcionamento'
+        ordering = ['dia_semana', 'hora_inicio']
+    
+    def __str__(self):
+        return f"{self.get_dia_semana_display()}: {self.hora_inicio:%H:%M} - {self.hora_fim:%H:%M}"
+    
+    def clean(self):
+        if self.hora_inicio and self.hora_fim and self.hora_fim <= self.hora_inicio:
+            raise ValidationError('Hora de fim deve ser posterior à hora de início.')
+
+
+class DataFechamento(models.Model):
+    """
+    Feriados e datas em que a empresa não funciona
+    """
+    data = models.DateField(unique=True)
+    descricao = models.CharField(max_length=100, blank=True)
+    recorrente = models.BooleanField(
+        default=False,
+        help_text='Repete todos os anos no mesmo dia e mês (feriados fixos)'
+    )
+    
+    class Meta:
+        verbose_name = 'Data de Fechamento'
+        verbose_name_plural = 'Datas de Fechamento'
+        ordering = ['data']
+    
+    def __str__(self):
+        return f"{self.data.strftime('%d/%m/%Y')} - {self.descricao}" if self.descricao else self.data.strftime('%d/%m/%Y')
+
+
+class TurnoFuncionario(models.Model):
+    """
+    Turno semanal recorrente de um funcionário. Funcionários sem turnos
+    cadastrados trabalham durante todo o horário de funcionamento.
+    """
+    funcionario = models.ForeignKey(
+        Funcionario,
+        on_delete=models.CASCADE,
+        related_name='turnos'
+    )
+    dia_semana = models.PositiveSmallIntegerField(choices=HorarioFuncionamento.DIA_SEMANA_CHOICES)
+    hora_inicio = models.TimeField()
+    hora_fim = models.TimeField()
+    
+    class Meta:
+        verbose_name = 'Turno do Funcionário'
+        verbose_name_plural = 'Turnos dos Funcionários'
+        ordering = ['funcionario', 'dia_semana', 'hora_inicio']
+    
+    def __str__(self):
+        return f"{self.get_dia_semana_display()}: {self.hora_inicio:%H:%M} - {self.hora_fim:%H:%M}"
+    
+    def clean(self):
+        if self.hora_inicio and self.hora_fim and self.hora_fim <= self.hora_inicio:
+            raise ValidationError('Hora de fim deve ser posterior à hora de início.')
+
+
+class AusenciaFuncionario(models.Model):
+    """
+    Período em que o funcionário não atende (férias, atestado, folga)
+    """
+    TIPO_CHOICES = [
+        ('ferias', 'Férias'),
+        ('atestado', 'Atestado Médico'),
+        ('folga', 'Folga'),
+        ('outro', 'Outro'),
+    ]
+    
+    funcionario = models.ForeignKey(
+        Funcionario,
+        on_delete=models.CASCADE,
+        related_name='ausencias'
+    )
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES, default='folga')
+    inicio = models.DateTimeField()
+    fim = models.DateTimeField()
+    motivo = models.TextField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = 'Ausência do Funcionário'
+        verbose_name_plural = 'Ausências dos Funcionários'
+        ordering = ['-inicio']
+    
+    def __str__(self):
+        return f"{self.get_tipo_display()}: {self.inicio:%d/%m/%Y %H:%M} - {self.fim:%d/%m/%Y %H:%M}"
+    
+    def clean(self):
+        if self.inicio and self.fim and self.fim <= self.inicio:
+            raise ValidationError('O fim da ausência deve ser posterior ao início.')
+
+
+class ValorAuditoria(models.Model):
+    """
+    Valor que se repete nos logs de auditoria (modelo, IP, user agent),
+    gravado uma vez; LogAuditoria guarda só o id. O mapeamento valor -> id
+    fica em cache no processo (core/auditoria.py).
+    """
+    CAMPO_CHAVE = 'valor'
+    
+    class Meta:
+        abstract = True
+    
+    def __str__(self):
+        return self.valor
+    
+    @classmethod
+    def chave(cls, valor):
+        """Valor de CAMPO_CHAVE para ``valor``, ou None se não pode ser gravado"""
+        return valor
+    
+    @classmethod
+    def novo(cls, valor):
+        return cls(**{'valor': valor, cls.CAMPO_CHAVE: cls.chave(valor)})
+
+
+class ModeloAuditoria(ValorAuditoria):
+    id = models.SmallAutoField(primary_key=True)
+    valor = models.CharField(max_length=100, unique=True)
+    
+    class Meta:
+        verbose_name = 'Modelo Auditado'
+        verbose_name_plural = 'Modelos Auditados'
+
+
+class EnderecoAuditoria(ValorAuditoria):
+    id = models.AutoField(primary_key=True)
+    valor = models.GenericIPAddressField(unique=True)
+    
+    class Meta:
+        verbose_name = 'Endereço IP Auditado'
+        verbose_name_plural = 'Endereços IP Auditados'
+    
+    @classmethod
+    def chave(cls, valor):
+        # Mesma forma que o banco devolve; X-Forwarded-For inválido é descartado
+        try:
+            return str(ipaddress.ip_address(valor.strip()))
+        except ValueError:
+            return None
+
+
+class AgenteAuditoria(ValorAuditoria):
+    id = models.AutoField(primary_key=True)
+    valor = models.TextField()
+    # User agents não têm tamanho máximo; o índice único fica no hash
+    hash = models.CharField(max_length=32, unique=True)
+    CAMPO_CHAVE = 'hash'
+    
+    class Meta:
+        verbose_name = 'User Agent Auditado'
+        verbose_name_plural = 'User Agents Auditados'
+    
+    @classmethod
+    def chave(cls, valor):
+        return hashlib.md5(valor.encode('utf-8')).hexdigest()
+
+
+def valor_auditoria(campo):
+    """
+    Propriedade de LogAuditoria com o texto de um ValorAuditoria (log.modelo,
+    log.ip_address, log.user_agent). O texto atribuído fica no log até ser
+    gravado; o id é preenchido na hora se o valor já está no cache e, senão,
+    na gravação (save e bulk_create), com uma consulta por lote.
+    """
+    attname = f'{campo}_id'
+    
+    def ler(self):
+        valores = self.__dict__.setdefault('_valores', {})
+        if campo not in valores:
+            id = getattr(self, attname)
+            if id is None:
+                return None
+            from .auditoria import valores_de
+            valores[campo] = valores_de(self._meta.get_field(campo).related_model, [id])[id]
+        return valores[campo]
+    
+    def atribuir(self, valor):
+        self.__dict__.setdefault('_valores', {})[campo] = valor
+        from .auditoria import id_em_cache
+        modelo = self._meta.get_field(campo).related_model
+        setattr(self, attname, None if valor is None else id_em_cache(modelo, valor))
+    
+    return property(ler, atribuir)
+
+
+class LogAuditoriaQuerySet(models.QuerySet):
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        from .auditoria import resolver_valores
+        objs = list(objs)
+        resolver_valores(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class LogAuditoria(models.Model):
     """
     Modelo para logs de auditoria do sistema
@@ -321,16 +1033,36 @@ class LogAuditoria(models.Model):
         ('logout', 'Logout'),
         ('view', 'Visualização'),
     ]
+    # Campo com o texto -> chave estrangeira para o ValorAuditoria
+    CAMPOS_VALOR = {
+        'modelo': 'modelo_auditado',
+        'ip_address': 'endereco_ip',
+        'user_agent': 'agente_usuario',
+    }
     
     usuario = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True)
     acao = models.CharField(max_length=10, choices=ACAO_CHOICES)
-    modelo = models.CharField(max_length=100)
+    modelo_auditado = models.ForeignKey(
+        ModeloAuditoria, on_delete=models.PROTECT, db_index=False, verbose_name='modelo'
+    )
     objeto_id = models.PositiveIntegerField(null=True, blank=True)
     objeto_repr = models.CharField(max_length=200, blank=True)
     detalhes = models.JSONField(default=dict, blank=True)
-    ip_address = models.GenericIPAddressField(null=True, blank=True)
-    user_agent = models.TextField(blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    endereco_ip = models.ForeignKey(
+        EnderecoAuditoria, on_delete=models.PROTECT, null=True, blank=True, verbose_name='IP'
+    )
+    agente_usuario = models.ForeignKey(
+        AgenteAuditoria, on_delete=models.PROTECT, null=True, blank=True, db_index=False,
+        verbose_name='user agent'
+    )
+    # Preenchido na criação do log, não na gravação do lote
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    
+    modelo = valor_auditoria('modelo_auditado')
+    ip_address = valor_auditoria('endereco_ip')
+    user_agent = valor_auditoria('agente_usuario')
+    
+    objects = LogAuditoriaQuerySet.as_manager()
     
     class Meta:
         verbose_name = 'Log de Auditoria'
@@ -338,18 +1070,28 @@ class LogAuditoria(models.Model):
         ordering = ['-timestamp']
         indexes = [
             models.Index(fields=['usuario', 'timestamp']),
-            models.Index(fields=['modelo', 'timestamp']),
+            models.Index(fields=['modelo_auditado', 'timestamp']),
             models.Index(fields=['acao', 'timestamp']),
+            # Busca do admin por id do objeto
+            models.Index(fields=['objeto_id', 'timestamp']),
+            # Paginação do admin por cursor (ORDER BY timestamp DESC, id DESC)
+            models.Index(fields=['timestamp', 'id']),
         ]
     
     def __str__(self):
         usuario_nome = self.usuario.get_full_name() if self.usuario else 'Sistema'
         return f"{usuario_nome} - {self.get_acao_display()} - {self.modelo} - {self.timestamp.strftime('%d/%m/%Y %H:%M')}"
     
+    def save(self, *args, **kwargs):
+        from .auditoria import resolver_valores
+        resolver_valores([self])
+        super().save(*args, **kwargs)
+    
     @classmethod
     def registrar(cls, usuario, acao, modelo, objeto=None, detalhes=None, request=None):
         """
-        Método helper para registrar logs de auditoria
+        Método helper para registrar logs de auditoria. O log é gravado em
+        lote (core/auditoria.py) depois do commit da transação em andamento.
         """
         log = cls(
             usuario=usuario,
@@ -372,32 +1114,55 @@ class LogAuditoria(models.Model):
             
             log.user_agent = request.META.get('HTTP_USER_AGENT', '')
         
-        log.save()
+        from .auditoria import enfileirar
+        enfileirar(log)
         return log
 
 
 # Signals para criar logs automáticos
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
+def _detalhes_do_save(instance, created, update_fields):
+    """
+    Detalhes do log de um save, ou None se o save não alterou nada que
+    interesse à auditoria (login gravando last_login, save sem alterações)
+    """
+    if created:
+        return {}
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return None
+    from .auditoria import alteracoes
+    mudancas = alteracoes(instance)
+    if mudancas is None:
+        return {}
+    return {'alteracoes': mudancas} if mudancas else None
+
+
 @receiver(post_save, sender=Usuario)
-def log_usuario_save(sender, instance, created, **kwargs):
-    acao = 'create' if created else 'update'
+def log_usuario_save(sender, instance, created, update_fields=None, **kwargs):
+    detalhes = _detalhes_do_save(instance, created, update_fields)
+    if detalhes is None:
+        return
     LogAuditoria.registrar(
         usuario=instance,
-        acao=acao,
+        acao='create' if created else 'update',
         modelo=sender,
-        objeto=instance
+        objeto=instance,
+        detalhes=detalhes
     )
 
 @receiver(post_save, sender=Agendamento)
-def log_agendamento_save(sender, instance, created, **kwargs):
-    acao = 'create' if created else 'update'
+def log_agendamento_save(sender, instance, created, update_fields=None, **kwargs):
+    detalhes = _detalhes_do_save(instance, created, update_fields)
+    if detalhes is None:
+        return
     LogAuditoria.registrar(
         usuario=instance.criado_por,
-        acao=acao,
+        acao='create' if created else 'update',
         modelo=sender,
-        objeto=instance
+        objeto=instance,
+        detalhes=detalhes
     )
 
 @receiver(post_delete, sender=Agendamento)
@@ -408,3 +1173,114 @@ def log_agendamento_delete(sender, instance, **kwargs):
         modelo=sender,
         objeto=instance
     )
+
+
+@receiver(post_save, sender=Agendamento)
+def atualizar_disponibilidade_agendamento(sender, instance, created, **kwargs):
+    from .disponibilidade import atualizar_disponibilidade
+    dias = set(instance.intervalos_ocupados())
+    if not created:
+        dias.update(instance.intervalos_ocupados(original=True))
+    atualizar_disponibilidade(dias)
+
+
+@receiver(post_delete, sender=Agendamento)
+def liberar_disponibilidade_agendamento(sender, instance, **kwargs):
+    from .disponibilidade import atualizar_disponibilidade
+    atualizar_disponibilidade(
+        instance.intervalos_ocupados(original=bool(instance._estado_original))
+    )
+
+
+@receiver(post_save, sender=Agendamento)
+def atualizar_resumo_agendamento(sender, instance, created, **kwargs):
+    from .resumos import registrar_alteracao
+    registrar_alteracao(instance, created)
+
+
+@receiver(post_delete, sender=Agendamento)
+def retirar_resumo_agendamento(sender, instance, **kwargs):
+    from .resumos import registrar_exclusao
+    registrar_exclusao(instance)
+
+
+@receiver(post_save, sender=Usuario)
+@receiver(post_save, sender=Funcionario)
+@receiver(post_save, sender=Servico)
+def atualizar_contadores_entidade(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    from .contadores import registrar_alteracao
+    registrar_alteracao(instance, created)
+
+
+@receiver(post_delete, sender=Usuario)
+@receiver(post_delete, sender=Funcionario)
+@receiver(post_delete, sender=Servico)
+def retirar_contadores_entidade(sender, instance, **kwargs):
+    from .contadores import registrar_exclusao
+    registrar_exclusao(instance)
+
+
+@receiver(post_save, sender=HorarioFuncionamento)
+@receiver(post_delete, sender=HorarioFuncionamento)
+@receiver(post_save, sender=DataFechamento)
+@receiver(post_delete, sender=DataFechamento)
+def invalidar_expediente_alterado(sender, **kwargs):
+    from .disponibilidade import invalidar_disponibilidade
+    from .expediente import invalidar_expediente
+    invalidar_expediente()
+    invalidar_disponibilidade()
+
+
+@receiver(post_save, sender=TurnoFuncionario)
+@receiver(post_delete, sender=TurnoFuncionario)
+@receiver(post_save, sender=AusenciaFuncionario)
+@receiver(post_delete, sender=AusenciaFuncionario)
+def invalidar_escala_alterada(sender, instance, **kwargs):
+    from .disponibilidade import invalidar_disponibilidade
+    from .escala import invalidar_escala
+    invalidar_escala(instance.funcionario_id)
+    invalidar_disponibilidade([instance.funcionario_id])
+
+
+@receiver(post_save, sender=Funcionario)
+def invalidar_escala_funcionario(sender, instance, created, **kwargs):
+    if created:
+        return
+    from .disponibilidade import invalidar_disponibilidade
+    from .escala import invalidar_escala
+    invalidar_escala(instance.pk)
+    invalidar_disponibilidade([instance.pk])
+
+
+@receiver(post_save, sender=Agendamento)
+@receiver(post_delete, sender=Agendamento)
+@receiver(post_save, sender=Usuario)
+@receiver(post_delete, sender=Usuario)
+@receiver(post_save, sender=Funcionario)
+@receiver(post_delete, sender=Funcionario)
+@receiver(post_save, sender=Servico)
+@receiver(post_delete, sender=Servico)
+def invalidar_estatisticas_dashboard(sender, update_fields=None, **kwargs):
+    # O login só grava last_login, que não aparece no dashboard
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    from .painel import invalidar_estatisticas
+    invalidar_estatisticas()
+
+
+@receiver(post_save, sender=Servico)
+@receiver(post_delete, sender=Servico)
+def invalidar_duracao_maxima_servicos(sender, **kwargs):
+    from .conflitos import invalidar_duracao_maxima
+    invalidar_duracao_maxima()
+
+
+@receiver(m2m_changed, sender=Funcionario.servicos.through)
+@receiver(post_delete, sender=Funcionario)
+@receiver(post_delete, sender=Servico)
+def invalidar_habilidades_alteradas(sender, **kwargs):
+    if kwargs.get('action', 'post').startswith('post'):
+        from .habilidades import invalidar_habilidades
+        invalidar_habilidades()
@@ -0,0 +1,139 @@
+"""
+Taxa de ocupação dos funcionários
+
+Ocupação = minutos agendados / minutos disponíveis, por funcionário, dia e
+hora. Os minutos disponíveis vêm da escala de trabalho (expediente, turnos e
+ausências) e os agendados das mesmas matrizes por minuto usadas na busca de
+horários livres (core/disponibilidade.py): os agendamentos ativos são
+marcados de uma vez com vetor de diferenças e soma acumulada, e a matriz é
+reduzida com reshape + sum para (funcionários x dias x 24 horas). Minutos
+agendados fora da escala não entram na conta.
+
+O período é processado em blocos de OCUPACAO_BLOCO_DIAS dias para limitar a
+memória das matrizes por minuto.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Q
+
+from .disponibilidade import mapa_ocupacao
+from .escala import mascara_trabalho
+from .models import Funcionario
+
+OCUPACAO_BLOCO_DIAS = 31
+
+DIAS_SEMANA = ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom']
+
+
+def minutos_por_hora(funcionario_ids, data_inicio, n_dias):
+    """
+    Retorna (ocupados, disponiveis): matrizes int16 (funcionários x dias x 24)
+    com os minutos agendados e os minutos de trabalho em cada hora
+    """
+    funcionario_ids = list(funcionario_ids)
+    forma = (len(funcionario_ids), n_dias, 24)
+    ocupados = np.zeros(forma, dtype=np.int16)
+    disponiveis = np.zeros(forma, dtype=np.int16)
+    if not funcionario_ids or n_dias <= 0:
+        return ocupados, disponiveis
+
+    for inicio in range(0, n_dias, OCUPACAO_BLOCO_DIAS):
+        dias = min(OCUPACAO_BLOCO_DIAS, n_dias - inicio)
+        data = data_inicio + timedelta(days=inicio)
+        por_hora = (len(funcionario_ids), dias, 24, 60)
+        trabalho = mascara_trabalho(funcionario_ids, data, dias).reshape(por_hora)
+        ocupado = mapa_ocupacao(funcionario_ids, data, dias).reshape(por_hora) & trabalho
+        ocupados[:, inicio:inicio + dias] = ocupado.sum(axis=-1, dtype=np.int16)
+        disponiveis[:, inicio:inicio + dias] = trabalho.sum(axis=-1, dtype=np.int16)
+    return ocupados, disponiveis
+
+
+def taxa(ocupados, disponiveis):
+    """Ocupados / disponíveis elemento a elemento, com None onde não há minutos disponíveis"""
+    ocupados = np.asarray(ocupados, dtype=np.float64)
+    disponiveis = np.asarray(disponiveis, dtype=np.float64)
+    razao = np.divide(ocupados, disponiveis, out=np.zeros_like(ocupados), where=disponiveis > 0)
+    if razao.ndim == 0:
+        return round(float(razao), 4) if disponiveis > 0 else None
+    return np.where(disponiveis > 0, razao.round(4), None).tolist()
+
+
+def funcionarios_do_periodo(data_inicio, data_fim, funcionario=None):
+    """Funcionários contratados em algum dia do período, inclusive os já demitidos"""
+    funcionarios = Funcionario.objects.filter(
+        Q(data_demissao__isnull=True) | Q(data_demissao__gt=data_inicio),
+        data_contratacao__lte=data_fim,
+    ).select_related('usuario')
+    if funcionario is not None:
+        funcionarios = funcionarios.filter(pk=getattr(funcionario, 'pk', funcionario))
+    return list(funcionarios)
+
+
+def resumo_ocupacao(data_inicio, data_fim, funcionario=None, por_dia_e_hora=False):
+    """
+    Ocupação do período (datas locais, inclusivas) em estruturas
+    serializáveis: por funcionário (total, por dia e por hora do dia) e o mapa
+    de calor dia da semana x hora somando todos. Com por_dia_e_hora, inclui
+    a matriz (dias x 24) de cada funcionário.
+    """
+    n_dias = (data_fim - data_inicio).days + 1
+    funcionarios = funcionarios_do_periodo(data_inicio, data_fim, funcionario)
+    ocupados, disponiveis = minutos_por_hora([f.pk for f in funcionarios], data_inicio, n_dias)
+
+    # Somas em int64: um ano inteiro de minutos não cabe em int16
+    ocupados_dia = ocupados.sum(axis=2, dtype=np.int64)
+    disponiveis_dia = disponiveis.sum(axis=2, dtype=np.int64)
+    ocupados_hora = ocupados.sum(axis=1, dtype=np.int64)
+    disponiveis_hora = disponiveis.sum(axis=1, dtype=np.int64)
+
+    linhas = []
+    for i, funcionario in enumerate(funcionarios):
+        if not disponiveis_dia[i].any():
+            continue
+        linha = {
+            'id': funcionario.pk,
+            'nome': funcionario.usuario.get_full_name(),
+            'minutos_ocupados': int(ocupados_dia[i].sum()),
+            'minutos_disponiveis': int(disponiveis_dia[i].sum()),
+            'taxa': taxa(ocupados_dia[i].sum(), disponiveis_dia[i].sum()),
+            'por_dia': {
+                'minutos_ocupados': ocupados_dia[i].tolist(),
+                'minutos_disponiveis': disponiveis_dia[i].tolist(),
+                'taxa': taxa(ocupados_dia[i], disponiveis_dia[i]),
+            },
+            'por_hora': {
+                'minutos_ocupados': ocupados_hora[i].tolist(),
+                'minutos_disponiveis': disponiveis_hora[i].tolist(),
+                'taxa': taxa(ocupados_hora[i], disponiveis_hora[i]),
+            },
+        }
+        if por_dia_e_hora:
+            linha['por_dia_e_hora'] = {
+                'minutos_ocupados': ocupados[i].tolist(),
+                'minutos_disponiveis': disponiveis[i].tolist(),
+            }
+        linhas.append(linha)
+
+    # Mapa de calor: soma dos funcionários agrupada por dia da semana
+    dia_semana = (data_inicio.weekday() + np.arange(n_dias)) % 7
+    calor_ocupados = np.zeros((7, 24), dtype=np.int64)
+    calor_disponiveis = np.zeros((7, 24), dtype=np.int64)
+    np.add.at(calor_ocupados, dia_semana, ocupados.sum(axis=0, dtype=np.int64))
+    np.add.at(calor_disponiveis, dia_semana, disponiveis.sum(axis=0, dtype=np.int64))
+
+    return {
+        'data_inicio': data_inicio.isoformat(),
+        'data_fim': data_fim.isoformat(),
+        'datas': [(data_inicio + timedelta(days=dia)).isoformat() for dia in range(n_dias)],
+        'minutos_ocupados': int(calor_ocupados.sum()),
+        'minutos_disponiveis': int(calor_disponiveis.sum()),
+        'taxa': taxa(calor_ocupados.sum(), calor_disponiveis.sum()),
+        'funcionarios': linhas,
+        'mapa_calor': {
+            'dias_semana': DIAS_SEMANA,
+            'minutos_ocupados': calor_ocupados.tolist(),
+            'minutos_disponiveis': calor_disponiveis.tolist(),
+            'taxa': taxa(calor_ocupados, calor_disponiveis),
+        },
+    }
@@ -0,0 +1,114 @@
+"""
+Estatísticas do dashboard em cache
+
+O snapshot é montado com uma única consulta agregada (contadores de
+entidades e, a partir do resumo diário, status dos últimos 30 dias e receita
+do mês) mais uma busca com select_related dos próximos agendamentos, e fica
+no cache até que um Agendamento, Usuario, Funcionario ou Servico relevante
+mude (signals em core/models.py). A chave inclui a data local, então a
+virada do dia gera um snapshot novo.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, F, Func, IntegerField, Max, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Agendamento, ContadorEntidade, ResumoDiarioAgendamento
+
+CHAVE_VERSAO = 'dashboard:versao'
+
+
+def _escalar(queryset, funcao, campo, output_field):
+    """
+    Subconsulta escalar (ex.: COUNT(*) do queryset) embrulhada em Max para
+    poder entrar no aggregate de outra tabela
+    """
+    return Max(Subquery(
+        queryset.order_by().annotate(valor=Func(F(campo), function=funcao)).values('valor')[:1],
+        output_field=output_field
+    ))
+
+
+def _soma(queryset, campo, output_field):
+    return _escalar(queryset, 'SUM', campo, output_field)
+
+
+def calcular_estatisticas():
+    """Monta o snapshot do dashboard a partir do banco"""
+    hoje = timezone.localdate()
+
+    # Totais de agendamentos lidos do resumo diário (core/resumos.py)
+    ultimos_30_dias = ResumoDiarioAgendamento.objects.filter(data__gte=hoje - timedelta(days=30))
+    status = {
+        f'status_{codigo}': _soma(ultimos_30_dias.filter(status=codigo), 'quantidade', IntegerField())
+        for codigo, _ in Agendamento.STATUS_CHOICES
+    }
+
+    # Agregado sobre os contadores (core/contadores.py), semeados pela migração
+    dados = ContadorEntidade.objects.aggregate(
+        **{
+            f'total_{nome}': Max('valor', filter=Q(nome=nome))
+            for nome in ('usuarios', 'clientes', 'funcionarios', 'servicos')
+        },
+        agendamentos_hoje=_soma(
+            ResumoDiarioAgendamento.objects.filter(data=hoje), 'quantidade', IntegerField()
+        ),
+        receita_mes=Coalesce(_soma(
+            ResumoDiarioAgendamento.objects.filter(data__gte=hoje.replace(day=1), status='concluido'),
+            'receita', DecimalField(max_digits=12, decimal_places=2)
+        ), 0, output_field=DecimalField(max_digits=12, decimal_places=2)),
+        **status
+    )
+
+    proximos_agendamentos = list(Agendamento.objects.entre(
+        hoje, hoje + timedelta(days=7)
+    ).filter(status='agendado').select_related(
+        'cliente', 'servico', 'funcionario__usuario'
+    ).order_by('data_agendamento')[:5])
+
+    return {
+        'total_usuarios': dados['total_usuarios'] or 0,
+        'total_funcionarios': dados['total_funcionarios'] or 0,
+        'total_clientes': dados['total_clientes'] or 0,
+        'total_servicos': dados['total_servicos'] or 0,
+        'agendamentos_hoje': dados['agendamentos_hoje'] or 0,
+        'receita_mes': dados['receita_mes'],
+        'agendamentos_por_status': [
+            {'status': codigo, 'total': dados[f'status_{codigo}']}
+            for codigo in sorted(codigo for codigo, _ in Agendamento.STATUS_CHOICES)
+            if dados[f'status_{codigo}']
+        ],
+        'proximos_agendamentos': proximos_agendamentos,
+    }
+
+
+def obter_estatisticas():
+    """Snapshot do dashboard, do cache ou recalculado"""
+    versao = cache.get_or_set(CHAVE_VERSAO, 1, None)
+    chave = f'dashboard:{versao}:{timezone.localdate().isoformat()}'
+    estatisticas = cache.get(chave)
+    if estatisticas is None:
+        estatisticas = calcular_estatisticas()
+        cache.set(chave, estatisticas, settings.DASHBOARD_CACHE_SEGUNDOS)
+    return estatisticas
+
+
+def _nova_versao():
+    try:
+        cache.incr(CHAVE_VERSAO)
+    except ValueError:
+        cache.set(CHAVE_VERSAO, 1, None)
+
+
+def invalidar_estatisticas():
+    """
+    Descarta o snapshot atual; o próximo acesso monta um novo. A versão muda
+    de novo no commit para descartar um snapshot montado com dados antigos
+    enquanto a transação estava aberta.
+    """
+    _nova_versao()
+    transaction.on_commit(_nova_versao)
@@ -0,0 +1,288 @@
+"""
+Partições mensais de LogAuditoria e arquivamento dos meses antigos
+
+No PostgreSQL, core_logauditoria é particionada por mês (RANGE em
+timestamp, migração 0017): cada mês é a tabela core_logauditoria_AAAAMM,
+com índices próprios e pequenos, e a partição padrão recebe o que não couber
+em nenhuma outra. criar_particoes() cria as partições do mês atual e dos
+próximos AUDITORIA_PARTICOES_FUTURAS meses; o worker (processar_relatorios)
+a chama periodicamente.
+
+arquivar_mes() grava os logs do mês em
+AUDITORIA_ARQUIVO_DIRETORIO/auditoria_AAAAMM.jsonl.gz e, só com o arquivo
+completo em disco, remove o mês do banco: a partição é desanexada e
+apagada na mesma transação (DETACH + DROP, sem DELETE linha a linha). Meses sem partição
+própria (linhas que caíram na partição padrão) e bancos sem particionamento
+(SQLite) saem com DELETE. logs_arquivados() lê os meses arquivados para
+consultas de auditoria.
+"""
+import glob
+import gzip
+import json
+import os
+import re
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .auditoria import carregar_valores
+from .models import LogAuditoria
+
+TABELA = LogAuditoria._meta.db_table
+PARTICAO_PADRAO = f'{TABELA}_padrao'
+TAMANHO_BLOCO = 2000
+# Chave estrangeira para ValorAuditoria -> campo com o texto
+CAMPOS_TEXTO = {campo: texto for texto, campo in LogAuditoria.CAMPOS_VALOR.items()}
+
+
+def somar_meses(mes, quantidade):
+    """Primeiro dia do mês ``quantidade`` meses depois (ou antes) de ``mes``"""
+    total = mes.year * 12 + mes.month - 1 + quantidade
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _meia_noite(data):
+    return datetime.combine(data, time.min, tzinfo=timezone.get_current_timezone())
+
+
+def limites_do_mes(mes):
+    """(início, fim) do mês em datetimes locais, intervalo semiaberto"""
+    return _meia_noite(mes), _meia_noite(somar_meses(mes, 1))
+
+
+def nome_particao(mes):
+    return f'{TABELA}_{mes:%Y%m}'
+
+
+def particionada():
+    """Indica se core_logauditoria é uma tabela particionada (só no PostgreSQL)"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [TABELA])
+        return cursor.fetchone() is not None
+
+
+def particoes():
+    """{primeiro dia do mês: nome} das partições mensais anexadas"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+        """, [TABELA])
+        nomes = [nome for nome, in cursor.fetchall()]
+    resultado = {}
+    for nome in nomes:
+        encontrado = re.fullmatch(rf'{TABELA}_(\d{{4}})(\d{{2}})', nome)
+        if encontrado:
+            resultado[date(int(encontrado[1]), int(encontrado[2]), 1)] = nome
+    return resultado
+
+
+def _criar_particao(mes):
+    """
+    Cria e anexa a partição do mês, trazendo da partição padrão as linhas
+    que pertencem a ela (o PostgreSQL não deixa criar a partição com elas lá)
+    """
+    nome = connection.ops.quote_name(nome_particao(mes))
+    tabela = connection.ops.quote_name(TABELA)
+    inicio, fim = limites_do_mes(mes)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {nome} (LIKE {tabela} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f"""
+            WITH movidos AS (
+                DELETE FROM {connection.ops.quote_name(PARTICAO_PADRAO)}
+                WHERE "timestamp" >= %s AND "timestamp" < %s
+                RETURNING *
+            )
+            INSERT INTO {nome} SELECT * FROM movidos
+        """, [inicio, fim])
+        cursor.execute(
+            f"ALTER TABLE {tabela} ATTACH PARTITION {nome} "
+            f"FOR VALUES FROM ('{inicio.isoformat()}') TO ('{fim.isoformat()}')"
+        )
+
+
+def criar_particoes(meses_futuros=None):
+    """
+    Cria as partições que faltam do mês atual até ``meses_futuros`` meses à
+    frente (AUDITORIA_PARTICOES_FUTURAS). Retorna os nomes criados.
+    """
+    if not particionada():
+        return []
+    if meses_futuros is None:
+        meses_futuros = settings.AUDITORIA_PARTICOES_FUTURAS
+    existentes = particoes()
+    atual = timezone.localdate().replace(day=1)
+    criadas = []
+    for quantidade in range(meses_futuros + 1):
+        mes = somar_meses(atual, quantidade)
+        if mes not in existentes:
+            _criar_particao(mes)
+            criadas.append(nome_particao(mes))
+    return criadas
+
+
+def arquivos_do_mes(mes):
+    return sorted(glob.glob(os.path.join(settings.AUDITORIA_ARQUIVO_DIRETORIO, f'auditoria_{mes:%Y%m}*.jsonl.gz')))
+
+
+def meses_arquivados():
+    meses = set()
+    for caminho in glob.glob(os.path.join(settings.AUDITORIA_ARQUIVO_DIRETORIO, 'auditoria_*.jsonl.gz')):
+        encontrado = re.match(r'auditoria_(\d{4})(\d{2})', os.path.basename(caminho))
+        if encontrado:
+            meses.add(date(int(encontrado[1]), int(encontrado[2]), 1))
+    return sorted(meses)
+
+
+def _novo_arquivo(mes):
+    """Caminho livre para o arquivo do mês (um mês arquivado de novo ganha sufixo)"""
+    os.makedirs(settings.AUDITORIA_ARQUIVO_DIRETORIO, exist_ok=True)
+    base = os.path.join(settings.AUDITORIA_ARQUIVO_DIRETORIO, f'auditoria_{mes:%Y%m}')
+    caminho, sequencia = f'{base}.jsonl.gz', 1
+    while os.path.exists(caminho):
+        sequencia += 1
+        caminho = f'{base}_{sequencia}.jsonl.gz'
+    return caminho
+
+
+def registro(log):
+    """
+    Log como dicionário serializável, com os campos (attname) do modelo e o
+    texto de modelo, IP e user agent no lugar dos ids
+    """
+    resultado = {}
+    for field in LogAuditoria._meta.concrete_fields:
+        if field.name in CAMPOS_TEXTO:
+            resultado[CAMPOS_TEXTO[field.name]] = getattr(log, CAMPOS_TEXTO[field.name])
+        else:
+            resultado[field.attname] = getattr(log, field.attname)
+    return resultado
+
+
+def _em_blocos(buscar):
+    """Percorre os logs em ordem de id, TAMANHO_BLOCO por consulta"""
+    ultimo = 0
+    while True:
+        bloco = list(buscar(ultimo))
+        if not bloco:
+            return
+        carregar_valores(bloco)
+        yield from bloco
+        ultimo = bloco[-1].pk
+
+
+def _gravar_arquivo(mes, logs):
+    """Grava os logs em JSONL comprimido. Retorna (caminho ou None, quantidade, maior id)."""
+    caminho = _novo_arquivo(mes)
+    parcial = f'{caminho}.parcial'
+    total, maior = 0, None
+    try:
+        with open(parcial, 'wb') as bruto:
+            with gzip.GzipFile(fileobj=bruto, mode='wb') as arquivo:
+                for log in logs:
+                    linha = json.dumps(registro(log), cls=DjangoJSONEncoder, ensure_ascii=False)
+                    arquivo.write(linha.encode('utf-8') + b'\n')
+                    total += 1
+                    maior = log.pk
+            bruto.flush()
+            os.fsync(bruto.fileno())
+    except BaseException:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        raise
+    if not total:
+        os.remove(parcial)
+        return None, 0, None
+    os.replace(parcial, caminho)
+    return caminho, total, maior
+
+
+def arquivar_mes(mes):
+    """
+    Grava os logs do mês em arquivo e os remove do banco. Retorna
+    (caminho do arquivo ou None se o mês estava vazio, quantidade de logs).
+    """
+    inicio, fim = limites_do_mes(mes)
+    nome = particoes().get(mes) if particionada() else None
+
+    if nome is None:
+        periodo = LogAuditoria.objects.filter(timestamp__gte=inicio, timestamp__lt=fim)
+        caminho, total, maior = _gravar_arquivo(mes, _em_blocos(
+            lambda ultimo: periodo.filter(pk__gt=ultimo).order_by('pk')[:TAMANHO_BLOCO]
+        ))
+        if total:
+            periodo.filter(pk__lte=maior).delete()
+        return caminho, total
+
+    # O arquivo é gravado (com fsync) enquanto a partição continua anexada;
+    # só então ela sai da tabela, com DETACH e DROP na mesma transação. Uma
+    # falha no meio deixa o mês no banco, para a próxima execução refazer.
+    tabela = connection.ops.quote_name(TABELA)
+    particao = connection.ops.quote_name(nome)
+    anteriores = arquivos_do_mes(mes)
+    caminho, total, _ = _gravar_arquivo(mes, _em_blocos(lambda ultimo: LogAuditoria.objects.raw(
+        f'SELECT * FROM {particao} WHERE id > %s ORDER BY id LIMIT %s', [ultimo, TAMANHO_BLOCO]
+    )))
+    # Partições só existem do mês em que foram criadas em diante, então um
+    # arquivo anterior do mês é de uma execução interrompida antes do DROP e
+    # repete linhas que o novo arquivo já contém
+    for anterior in anteriores:
+        os.remove(anterior)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {tabela} DETACH PARTITION {particao}')
+        cursor.execute(f'DROP TABLE {particao}')
+    return caminho, total
+
+
+def meses_para_arquivar(retencao_meses=None):
+    """Meses anteriores à janela de retenção (AUDITORIA_RETENCAO_MESES, contando o atual)"""
+    if retencao_meses is None:
+        retencao_meses = settings.AUDITORIA_RETENCAO_MESES
+    limite = somar_meses(timezone.localdate().replace(day=1), 1 - retencao_meses)
+    if particionada():
+        meses = {mes for mes in particoes() if mes < limite}
+        # Logs de meses sem partição própria ficam na partição padrão
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT DISTINCT date_trunc('month', "timestamp" AT TIME ZONE %s)::date
+                FROM {connection.ops.quote_name(PARTICAO_PADRAO)}
+                WHERE "timestamp" < %s
+            """, [timezone.get_current_timezone_name(), _meia_noite(limite)])
+            meses.update(mes for mes, in cursor.fetchall())
+        return sorted(meses)
+    return list(LogAuditoria.objects.filter(
+        timestamp__lt=_meia_noite(limite)
+    ).dates('timestamp', 'month'))
+
+
+def arquivar_antigos(retencao_meses=None):
+    """Arquiva os meses fora da retenção. Retorna [(mês, caminho, quantidade)]."""
+    return [(mes, *arquivar_mes(mes)) for mes in meses_para_arquivar(retencao_meses)]
+
+
+def logs_arquivados(data_inicio, data_fim, **filtros):
+    """
+    Logs arquivados (dicionários com os campos de LogAuditoria) entre as
+    datas locais data_inicio e data_fim, inclusivas, que atendem aos filtros
+    por igualdade (usuario_id, acao, modelo, objeto_id...; None é ignorado)
+    """
+    inicio, fim = _meia_noite(data_inicio), _meia_noite(data_fim + timedelta(days=1))
+    filtros = {campo: valor for campo, valor in filtros.items() if valor is not None}
+    for mes in meses_arquivados():
+        if not (mes <= data_fim and somar_meses(mes, 1) > data_inicio):
+            continue
+        for caminho in arquivos_do_mes(mes):
+            with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+                for linha in arquivo:
+                    log = json.loads(linha)
+                    if not inicio <= parse_datetime(log['timestamp']) < fim:
+                        continue
+                    if all(log.get(campo) == valor for campo, valor in filtros.items()):
+                        yield log
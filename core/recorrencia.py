@@ -0,0 +1,164 @@
+"""
+Criação de séries de agendamentos recorrentes
+
+Todas as ocorrências de uma série são validadas juntas: uma única consulta
+traz os agendamentos do funcionário no período da série e uma varredura
+linear das duas listas ordenadas encontra as ocorrências em conflito;
+reservas de horário ainda válidas (core/reservas.py) também bloqueiam
+ocorrências. A série é gravada com a linha do funcionário travada, com
+bulk_create e um único registro de auditoria.
+"""
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .disponibilidade import atualizar_disponibilidade
+from .escala import obter_escala
+from .expediente import obter_expediente
+from .habilidades import pode_realizar
+from .models import Agendamento, LogAuditoria, SerieAgendamento, traduzir_conflito_horario
+from .painel import invalidar_estatisticas
+from .reservas import reservas_conflitantes, travar_funcionario
+from .resumos import registrar_agendamentos
+
+
+def ocorrencias_em_conflito(funcionario, inicios, duracao_minutos):
+    """
+    Retorna {início: agendamento conflitante} para os inícios (ordenados) que
+    se sobrepõem a agendamentos ativos do funcionário
+    """
+    if not inicios:
+        return {}
+    duracao = timedelta(minutes=duracao_minutos)
+    # Os agendamentos ativos de um funcionário não se sobrepõem, então
+    # ordenados pelo início também ficam ordenados pelo fim
+    existentes = list(Agendamento.objects.ativos().sobrepondo(
+        inicios[0], inicios[-1] + duracao
+    ).filter(funcionario=funcionario).select_related('servico', 'cliente').order_by('data_agendamento'))
+
+    conflitos = {}
+    j = 0
+    for inicio in inicios:
+        while j < len(existentes) and existentes[j].data_fim <= inicio:
+            j += 1
+        if j < len(existentes) and existentes[j].data_agendamento < inicio + duracao:
+            conflitos[inicio] = existentes[j]
+    return conflitos
+
+
+def ocorrencias_reservadas(funcionario_id, inicios, duracao_minutos):
+    """
+    Retorna os inícios (ordenados) que se sobrepõem a reservas ainda válidas
+    na agenda do funcionário (core/reservas.py), com uma única consulta
+    """
+    if not inicios:
+        return set()
+    duracao = timedelta(minutes=duracao_minutos)
+    reservas = list(reservas_conflitantes(
+        funcionario_id, inicios[0], inicios[-1] + duracao
+    ).values_list('inicio', 'fim'))
+    return {
+        inicio for inicio in inicios
+        if any(reserva_inicio < inicio + duracao and reserva_fim > inicio for reserva_inicio, reserva_fim in reservas)
+    }
+
+
+def validar_serie(serie):
+    """
+    Valida todas as ocorrências da série e levanta um único ValidationError
+    listando cada ocorrência com problema. Retorna os inícios válidos.
+    """
+    inicios = serie.ocorrencias()
+    if not inicios:
+        raise ValidationError('A série não tem nenhuma ocorrência.')
+    if not pode_realizar(serie.funcionario, serie.servico):
+        raise ValidationError(
+            f'{serie.funcionario.usuario.get_full_name()} não está habilitado para {serie.servico.nome}.'
+        )
+
+    duracao = timedelta(minutes=serie.servico.duracao_minutos)
+    expediente = obter_expediente()
+    escala = obter_escala(serie.funcionario)
+    conflitos = ocorrencias_em_conflito(serie.funcionario, inicios, serie.servico.duracao_minutos)
+    reservadas = ocorrencias_reservadas(serie.funcionario_id, inicios, serie.servico.duracao_minutos)
+    agora = timezone.now()
+
+    erros = []
+    for inicio in inicios:
+        quando = timezone.localtime(inicio).strftime('%d/%m/%Y %H:%M')
+        if inicio <= agora:
+            erros.append(f'{quando}: data no passado.')
+        elif not expediente.comporta(inicio, inicio + duracao):
+            erros.append(f'{quando}: fora do horário de funcionamento.')
+        elif not escala.comporta(inicio, inicio + duracao, expediente):
+            erros.append(f'{quando}: o funcionário não atende neste horário.')
+        elif inicio in conflitos:
+            erros.append(f'{quando}: conflito com o agendamento {conflitos[inicio]}.')
+        elif inicio in reservadas:
+            erros.append(f'{quando}: horário reservado por outro atendimento.')
+    if erros:
+        raise ValidationError(erros)
+    return inicios
+
+
+def criar_serie(serie, request=None, inicios=None):
+    """
+    Valida e grava a série (instância ainda não salva) e todas as suas
+    ocorrências. Retorna a lista de Agendamentos criados.
+
+    ``inicios`` são as ocorrências já validadas por validar_serie (no
+    formulário), que então não é repetida; sobreposições surgidas depois
+    da validação continuam rejeitadas pelo banco, e reservas feitas depois
+    dela, pela nova consulta com o funcionário travado.
+    """
+    serie.clean()
+    with transaction.atomic(), traduzir_conflito_horario():
+        # Como em confirmar_agendamento: reservas e gravações do funcionário
+        # esperam até a série estar gravada
+        travar_funcionario(serie.funcionario_id)
+        if inicios is None:
+            inicios = validar_serie(serie)
+        else:
+            reservadas = ocorrencias_reservadas(serie.funcionario_id, inicios, serie.servico.duracao_minutos)
+            if reservadas:
+                raise ValidationError([
+                    f'{timezone.localtime(inicio):%d/%m/%Y %H:%M}: horário reservado por outro atendimento.'
+                    for inicio in sorted(reservadas)
+                ])
+        serie.save()
+        duracao = timedelta(minutes=serie.servico.duracao_minutos)
+        agendamentos = Agendamento.objects.bulk_create([
+            Agendamento(
+                cliente=serie.cliente,
+                funcionario=serie.funcionario,
+                servico=serie.servico,
+                data_agendamento=inicio,
+                data_fim=inicio + duracao,
+                valor_final=serie.servico.preco,
+                observacoes=serie.observacoes,
+                criado_por=serie.criado_por,
+                serie=serie,
+            )
+            for inicio in inicios
+        ])
+
+        # bulk_create não dispara os signals de Agendamento
+        atualizar_disponibilidade(
+            dia for agendamento in agendamentos for dia in agendamento.intervalos_ocupados()
+        )
+        registrar_agendamentos(agendamentos)
+        invalidar_estatisticas()
+        LogAuditoria.registrar(
+            usuario=serie.criado_por,
+            acao='create',
+            modelo=SerieAgendamento,
+            objeto=serie,
+            detalhes={
+                'agendamentos': [agendamento.pk for agendamento in agendamentos],
+                'ocorrencias': [inicio.isoformat() for inicio in inicios],
+            },
+            request=request
+        )
+    return agendamentos
@@ -0,0 +1,214 @@
+"""
+Relatórios gerados em segundo plano
+
+Exportações grandes não cabem no proxy_read_timeout de 60s do nginx. O
+pedido vira uma TarefaRelatorio e o comando processar_relatorios (processo
+à parte, serviço worker do docker-compose) gera o arquivo em blocos com os
+geradores de core/exportacao.py, atualizando o progresso a cada bloco, e o
+grava em RELATORIO_DIRETORIO. Um pedido com os mesmos parâmetros
+reaproveita a tarefa enquanto a versão dos dados do período (quantidade
+de agendamentos e maior data_atualizacao deles e dos clientes,
+funcionários e serviços exibidos) não muda.
+"""
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .exportacao import (
+    TAMANHO_BLOCO, consulta_agendamentos, consulta_receitas,
+    csv_em_blocos, linhas_agendamentos, linhas_receitas, xlsx_em_blocos
+)
+from .models import Agendamento, TarefaRelatorio
+
+logger = logging.getLogger(__name__)
+
+# Filtros aceitos por tipo de relatório, além do período
+FILTROS = {
+    'agendamentos': ('cliente', 'funcionario', 'servico', 'status'),
+    'receitas': ('funcionario', 'servico'),
+}
+
+
+def parametros_relatorio(tipo, filtros):
+    """Parâmetros serializáveis (datas ISO e ids) a partir dos filtros validados"""
+    parametros = {
+        'data_inicio': filtros['data_inicio'].isoformat(),
+        'data_fim': filtros['data_fim'].isoformat(),
+    }
+    for campo in FILTROS[tipo]:
+        valor = filtros.get(campo)
+        parametros[campo] = getattr(valor, 'pk', valor) or None
+    return parametros
+
+
+def chave_relatorio(tipo, formato, parametros):
+    conteudo = json.dumps([tipo, formato, parametros], sort_keys=True)
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+
+# Registros cujos nomes aparecem no relatório, além do próprio agendamento
+CAMPOS_VERSAO = (
+    'data_atualizacao', 'cliente__data_atualizacao',
+    'funcionario__usuario__data_atualizacao', 'servico__data_atualizacao',
+)
+
+
+def versao_dados(parametros):
+    """
+    Versão dos dados do período, sem os demais filtros: qualquer agendamento
+    criado, alterado ou excluído no período, ou a alteração do cliente,
+    funcionário ou serviço de um deles, muda a versão
+    """
+    versao = Agendamento.objects.entre(
+        parse_date(parametros['data_inicio']), parse_date(parametros['data_fim'])
+    ).aggregate(total=Count('pk'), **{campo: Max(campo) for campo in CAMPOS_VERSAO})
+    ultimas = [versao[campo].isoformat() if versao[campo] else '-' for campo in CAMPOS_VERSAO]
+    conteudo = ':'.join([str(versao['total'])] + ultimas)
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+
+def caminho_arquivo(tarefa):
+    return os.path.join(settings.RELATORIO_DIRETORIO, tarefa.arquivo)
+
+
+def solicitar_relatorio(tipo, formato, filtros, usuario=None):
+    """
+    Retorna (tarefa, criada). Uma tarefa pendente, em andamento ou concluída
+    com os mesmos parâmetros e a mesma versão dos dados é reaproveitada.
+    """
+    parametros = parametros_relatorio(tipo, filtros)
+    chave = chave_relatorio(tipo, formato, parametros)
+    versao = versao_dados(parametros)
+
+    existente = TarefaRelatorio.objects.filter(
+        chave=chave, versao_dados=versao
+    ).exclude(status='erro').order_by('-data_criacao').first()
+    if existente and (existente.status != 'concluido' or os.path.exists(caminho_arquivo(existente))):
+        return existente, False
+
+    tarefa = TarefaRelatorio.objects.create(
+        tipo=tipo, formato=formato, parametros=parametros,
+        chave=chave, versao_dados=versao, solicitado_por=usuario,
+    )
+    return tarefa, True
+
+
+def proxima_tarefa():
+    """
+    Marca como em andamento e retorna a tarefa pendente mais antiga (ou uma
+    abandonada por um worker que parou), ou None
+    """
+    expiracao = timezone.now() - timedelta(minutes=settings.RELATORIO_TAREFA_EXPIRACAO_MINUTOS)
+    with transaction.atomic():
+        tarefa = TarefaRelatorio.objects.select_for_update(skip_locked=True).filter(
+            Q(status='pendente') | Q(status='processando', iniciado_em__lt=expiracao)
+        ).order_by('data_criacao').first()
+        if tarefa is None:
+            return None
+        tarefa.status = 'processando'
+        tarefa.iniciado_em = timezone.now()
+        tarefa.linhas_processadas = 0
+        tarefa.save(update_fields=['status', 'iniciado_em', 'linhas_processadas'])
+    return tarefa
+
+
+def _com_progresso(tarefa, linhas):
+    """Repassa as linhas gravando o progresso da tarefa a cada bloco"""
+    processadas = 0
+    for linha in linhas:
+        yield linha
+        processadas += 1
+        if processadas % TAMANHO_BLOCO == 0:
+            TarefaRelatorio.objects.filter(pk=tarefa.pk).update(linhas_processadas=processadas)
+
+
+def _consulta(tarefa):
+    parametros = tarefa.parametros
+    periodo = (parse_date(parametros['data_inicio']), parse_date(parametros['data_fim']))
+    filtros = {campo: parametros.get(campo) for campo in FILTROS[tarefa.tipo]}
+    if tarefa.tipo == 'receitas':
+        return consulta_receitas(*periodo, **filtros), linhas_receitas
+    return consulta_agendamentos(*periodo, **filtros), linhas_agendamentos
+
+
+def processar_tarefa(tarefa):
+    """Gera o arquivo de uma tarefa já marcada como em andamento"""
+    # Qualquer falha, inclusive parâmetros que não geram consulta, encerra a
+    # tarefa com erro em vez de deixá-la em andamento até expirar
+    parcial = None
+    try:
+        consulta, gerar_linhas = _consulta(tarefa)
+        total = consulta.count()
+        TarefaRelatorio.objects.filter(pk=tarefa.pk).update(total_linhas=total)
+
+        cabecalho, linhas = gerar_linhas(consulta)
+        linhas = _com_progresso(tarefa, linhas)
+        if tarefa.formato == 'xlsx':
+            blocos = xlsx_em_blocos(cabecalho, linhas, tarefa.get_tipo_display())
+        else:
+            blocos = csv_em_blocos(cabecalho, linhas)
+
+        os.makedirs(settings.RELATORIO_DIRETORIO, exist_ok=True)
+        tarefa.arquivo = f'{tarefa.tipo}_{tarefa.pk}_{tarefa.chave[:12]}.{tarefa.formato}'
+        destino = caminho_arquivo(tarefa)
+        # Nome próprio desta tentativa: um worker que retoma a tarefa
+        # abandonada não escreve no mesmo arquivo parcial do anterior
+        parcial = f'{destino}.{uuid.uuid4().hex}.parcial'
+        with open(parcial, 'wb') as arquivo:
+            for bloco in blocos:
+                arquivo.write(bloco)
+        os.replace(parcial, destino)
+    except Exception as erro:
+        if parcial and os.path.exists(parcial):
+            os.remove(parcial)
+        logger.exception('Falha ao gerar o relatório %s', tarefa.pk)
+        TarefaRelatorio.objects.filter(pk=tarefa.pk).update(
+            status='erro', erro=str(erro) or erro.__class__.__name__, concluido_em=timezone.now()
+        )
+        return False
+
+    TarefaRelatorio.objects.filter(pk=tarefa.pk).update(
+        status='concluido', arquivo=tarefa.arquivo, linhas_processadas=total,
+        concluido_em=timezone.now()
+    )
+
+    # Versões anteriores do mesmo relatório não serão mais entregues
+    _remover(TarefaRelatorio.objects.filter(
+        chave=tarefa.chave, status__in=['concluido', 'erro'], data_criacao__lt=tarefa.data_criacao
+    ))
+    return True
+
+
+def executar_pendentes():
+    """Processa as tarefas da fila até esvaziá-la. Retorna quantas foram processadas."""
+    processadas = 0
+    while True:
+        tarefa = proxima_tarefa()
+        if tarefa is None:
+            return processadas
+        processar_tarefa(tarefa)
+        processadas += 1
+
+
+def _remover(tarefas):
+    for tarefa in tarefas:
+        if tarefa.arquivo and os.path.exists(caminho_arquivo(tarefa)):
+            os.remove(caminho_arquivo(tarefa))
+        tarefa.delete()
+
+
+def limpar_relatorios_antigos():
+    """Exclui tarefas encerradas há mais de RELATORIO_RETENCAO_DIAS, com seus arquivos"""
+    limite = timezone.now() - timedelta(days=settings.RELATORIO_RETENCAO_DIAS)
+    _remover(TarefaRelatorio.objects.filter(
+        status__in=['concluido', 'erro'], concluido_em__lt=limite
+    ))
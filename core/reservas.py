@@ -0,0 +1,101 @@
+"""
+Reserva temporária de horários e gravação serializada por funcionário
+
+Enquanto o formulário é preenchido, a interface reserva o horário por
+AGENDA_RESERVA_TTL_SEGUNDOS. Reservas e gravações de agendamento travam a
+linha do funcionário (SELECT ... FOR UPDATE) durante a transação, então a
+verificação de conflitos e o save acontecem juntos para aquele funcionário
+sem bloquear a agenda dos demais.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .conflitos import primeiro_conflito
+from .models import ConflitoHorario, Funcionario, ReservaHorario
+
+
+def travar_funcionario(funcionario_id):
+    """Trava a linha do funcionário até o fim da transação atual"""
+    list(Funcionario.objects.select_for_update().filter(pk=funcionario_id).values_list('pk'))
+
+
+def reservas_conflitantes(funcionario_id, inicio, fim, token=None):
+    """Reservas ainda válidas de outros atendimentos que se sobrepõem a [inicio, fim)"""
+    reservas = ReservaHorario.objects.filter(
+        funcionario_id=funcionario_id,
+        expira_em__gt=timezone.now(),
+        inicio__lt=fim,
+        fim__gt=inicio,
+    )
+    if token:
+        reservas = reservas.exclude(token=token)
+    return reservas
+
+
+def reservar_horario(funcionario, inicio, fim, usuario=None, token=None):
+    """
+    Reserva [inicio, fim) na agenda do funcionário. Com ``token``, a reserva
+    anterior do mesmo atendimento é substituída se for do mesmo ``usuario``;
+    o token de outro usuário é ignorado e uma reserva nova é criada. Levanta
+    ConflitoHorario se o horário já estiver agendado ou reservado.
+    """
+    funcionario_id = getattr(funcionario, 'pk', funcionario)
+    agora = timezone.now()
+    with transaction.atomic():
+        travar_funcionario(funcionario_id)
+        ReservaHorario.objects.filter(funcionario_id=funcionario_id, expira_em__lte=agora).delete()
+        if token:
+            liberar_reserva(token, usuario)
+            if ReservaHorario.objects.filter(token=token).exists():
+                token = None
+        
+        if primeiro_conflito(funcionario_id, inicio, fim) or reservas_conflitantes(
+            funcionario_id, inicio, fim
+        ).exists():
+            raise ConflitoHorario('Este horário não está mais disponível.')
+        
+        dados = {'token': token} if token else {}
+        return ReservaHorario.objects.create(
+            funcionario_id=funcionario_id,
+            inicio=inicio,
+            fim=fim,
+            expira_em=agora + timedelta(seconds=settings.AGENDA_RESERVA_TTL_SEGUNDOS),
+            criado_por=usuario,
+            **dados
+        )
+
+
+def liberar_reserva(token, usuario=None):
+    """Remove a reserva ``token``; com ``usuario``, apenas se for dele"""
+    reservas = ReservaHorario.objects.filter(token=token)
+    if usuario is not None:
+        reservas = reservas.filter(criado_por=usuario)
+    reservas.delete()
+
+
+def confirmar_agendamento(agendamento, token=None):
+    """
+    Grava o agendamento com a agenda do funcionário travada: conflitos e
+    reservas de outros atendimentos são verificados na mesma transação do
+    save. A reserva ``token`` é consumida.
+    """
+    with transaction.atomic():
+        travar_funcionario(agendamento.funcionario_id)
+        inicio, fim = agendamento.data_agendamento, agendamento.data_hora_fim()
+        
+        if agendamento.status in agendamento.STATUS_ATIVOS:
+            conflito = primeiro_conflito(
+                agendamento.funcionario_id, inicio, fim, excluir_pk=agendamento.pk
+            )
+            if conflito:
+                raise ConflitoHorario(f'Conflito de horário com agendamento: {conflito}')
+            if reservas_conflitantes(agendamento.funcionario_id, inicio, fim, token).exists():
+                raise ConflitoHorario('Este horário está reservado por outro atendimento.')
+        
+        agendamento.save()
+        if token:
+            liberar_reserva(token)
+    return agendamento
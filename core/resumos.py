@@ -0,0 +1,201 @@
+"""
+Resumo diário de agendamentos (quantidade, minutos e receita)
+
+Cada agendamento contribui para uma linha de ResumoDiarioAgendamento,
+identificada por (data local, funcionário, serviço, status). Os signals de
+Agendamento retiram a contribuição do estado anterior e somam a do novo com
+UPDATE ... SET campo = campo + delta, então relatórios mensais e anuais leem
+algumas centenas de linhas em vez dos agendamentos. O comando
+atualizar_resumos recalcula períodos inteiros em blocos.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Agendamento, ResumoDiarioAgendamento
+
+# Duração gravada em cada agendamento (data_fim acompanha o serviço só
+# enquanto o agendamento está pendente, como em contribuicao)
+DURACAO = ExpressionWrapper(F('data_fim') - F('data_agendamento'), output_field=DurationField())
+
+
+def contribuicao(agendamento, original=False):
+    """
+    Retorna (chave, minutos, receita) da contribuição do agendamento, ou
+    None. Com original=True usa o estado carregado do banco.
+    """
+    if original:
+        valores = [agendamento.valor_original(campo) for campo in (
+            'funcionario_id', 'servico_id', 'status', 'data_agendamento', 'data_fim', 'valor_final'
+        )]
+    else:
+        valores = [
+            agendamento.funcionario_id, agendamento.servico_id, agendamento.status,
+            agendamento.data_agendamento, agendamento.data_fim, agendamento.valor_final,
+        ]
+    funcionario_id, servico_id, status, inicio, fim, valor = valores
+    if not (funcionario_id and servico_id and inicio and fim):
+        return None
+    chave = (timezone.localdate(inicio), funcionario_id, servico_id, status)
+    return chave, int((fim - inicio).total_seconds() // 60), valor or Decimal('0')
+
+
+def aplicar(chave, quantidade, minutos, receita):
+    """Soma os deltas à linha do resumo, criando-a se ainda não existir"""
+    data, funcionario_id, servico_id, status = chave
+    linha = ResumoDiarioAgendamento.objects.filter(
+        data=data, funcionario_id=funcionario_id, servico_id=servico_id, status=status
+    )
+    deltas = {
+        'quantidade': F('quantidade') + quantidade,
+        'minutos': F('minutos') + minutos,
+        'receita': F('receita') + receita,
+    }
+    if linha.update(**deltas):
+        return
+    try:
+        with transaction.atomic():
+            ResumoDiarioAgendamento.objects.create(
+                data=data, funcionario_id=funcionario_id, servico_id=servico_id, status=status,
+                quantidade=quantidade, minutos=minutos, receita=receita,
+            )
+    except IntegrityError:
+        # Outra transação criou a linha entre o UPDATE e o INSERT
+        linha.update(**deltas)
+
+
+def registrar_contribuicoes(contribuicoes):
+    """Aplica uma lista de (sinal, contribuição), agrupando pela chave"""
+    totais = defaultdict(lambda: [0, 0, Decimal('0')])
+    for sinal, item in contribuicoes:
+        if item is None:
+            continue
+        chave, minutos, receita = item
+        total = totais[chave]
+        total[0] += sinal
+        total[1] += sinal * minutos
+        total[2] += sinal * receita
+    totais = {chave: total for chave, total in totais.items() if any(total)}
+    if len(totais) > 1:
+        aplicar_em_lote(totais)
+    else:
+        for chave, (quantidade, minutos, receita) in totais.items():
+            aplicar(chave, quantidade, minutos, receita)
+
+
+def aplicar_em_lote(totais):
+    """
+    Versão de aplicar para muitas chaves ({chave: [quantidade, minutos,
+    receita]}): uma leitura com as linhas travadas, um bulk_update e um
+    bulk_create
+    """
+    with transaction.atomic():
+        candidatas = ResumoDiarioAgendamento.objects.select_for_update().filter(
+            data__in={chave[0] for chave in totais},
+            funcionario_id__in={chave[1] for chave in totais},
+            servico_id__in={chave[2] for chave in totais},
+            status__in={chave[3] for chave in totais},
+        )
+        existentes = {
+            (linha.data, linha.funcionario_id, linha.servico_id, linha.status): linha
+            for linha in candidatas
+        }
+
+        alteradas, novas = [], []
+        for chave, (quantidade, minutos, receita) in totais.items():
+            linha = existentes.get(chave)
+            if linha is None:
+                data, funcionario_id, servico_id, status = chave
+                novas.append(ResumoDiarioAgendamento(
+                    data=data, funcionario_id=funcionario_id, servico_id=servico_id, status=status,
+                    quantidade=quantidade, minutos=minutos, receita=receita,
+                ))
+            else:
+                linha.quantidade += quantidade
+                linha.minutos += minutos
+                linha.receita += receita
+                alteradas.append(linha)
+
+        ResumoDiarioAgendamento.objects.bulk_update(
+            alteradas, ['quantidade', 'minutos', 'receita'], batch_size=500
+        )
+        try:
+            with transaction.atomic():
+                ResumoDiarioAgendamento.objects.bulk_create(novas, batch_size=500)
+        except IntegrityError:
+            # Alguma linha foi criada por outra transação; aplicar uma a uma
+            for linha in novas:
+                aplicar(
+                    (linha.data, linha.funcionario_id, linha.servico_id, linha.status),
+                    linha.quantidade, linha.minutos, linha.receita
+                )
+
+
+def registrar_alteracao(agendamento, created):
+    contribuicoes = [(1, contribuicao(agendamento))]
+    if not created:
+        contribuicoes.append((-1, contribuicao(agendamento, original=True)))
+    registrar_contribuicoes(contribuicoes)
+
+
+def registrar_exclusao(agendamento):
+    registrar_contribuicoes([
+        (-1, contribuicao(agendamento, original=bool(agendamento._estado_original)))
+    ])
+
+
+def registrar_agendamentos(agendamentos):
+    """Soma agendamentos criados com bulk_create (que não disparam signals)"""
+    registrar_contribuicoes([(1, contribuicao(agendamento)) for agendamento in agendamentos])
+
+
+def recalcular_resumos(data_inicio, data_fim, **filtros):
+    """
+    Refaz as linhas do resumo entre as datas locais data_inicio e data_fim
+    (inclusivas) a partir dos agendamentos. ``filtros`` restringe por
+    funcionario_id ou servico_id. Retorna a quantidade de linhas gravadas.
+    """
+    fuso = timezone.get_current_timezone()
+    with transaction.atomic():
+        ResumoDiarioAgendamento.objects.filter(
+            data__gte=data_inicio, data__lte=data_fim, **filtros
+        ).delete()
+        grupos = Agendamento.objects.entre(data_inicio, data_fim).filter(**filtros).order_by().values(
+            'funcionario_id', 'servico_id', 'status',
+            dia=TruncDate('data_agendamento', tzinfo=fuso),
+        ).annotate(
+            total=Count('pk'),
+            total_duracao=Sum(DURACAO),
+            total_receita=Coalesce(Sum('valor_final'), Decimal('0')),
+        )
+        linhas = ResumoDiarioAgendamento.objects.bulk_create([
+            ResumoDiarioAgendamento(
+                data=grupo['dia'],
+                funcionario_id=grupo['funcionario_id'],
+                servico_id=grupo['servico_id'],
+                status=grupo['status'],
+                quantidade=grupo['total'],
+                minutos=int(grupo['total_duracao'].total_seconds() // 60),
+                receita=grupo['total_receita'],
+            )
+            for grupo in grupos
+        ], batch_size=1000)
+    return len(linhas)
+
+
+def resumo_periodo(data_inicio, data_fim, *agrupar_por, **filtros):
+    """
+    Totais entre as datas (inclusivas), agrupados pelos campos do resumo
+    informados (ex.: 'status', 'funcionario_id', 'data')
+    """
+    return ResumoDiarioAgendamento.objects.filter(
+        data__gte=data_inicio, data__lte=data_fim, **filtros
+    ).order_by(*agrupar_por).values(*agrupar_por).annotate(
+        quantidade_total=Sum('quantidade'),
+        minutos_total=Sum('minutos'),
+        receita_total=Sum('receita'),
+    )
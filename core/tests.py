@@ -1,3 +1,1801 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import zipfile
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .checks import verificar_cache_com_varios_workers
+from .contadores import obter_contadores
+from .admin import _cursor, _ler_cursor
+from .auditoria import AuditoriaMiddleware, GravadorAuditoria, gravar, limpar_cache_valores
+from .conflitos import buscar_conflitos, duracao_maxima_servicos, invalidar_duracao_maxima
+from .disponibilidade import (
+    atribuir_funcionario, buscar_horarios_livres, mapa_livre, mapa_livre_em_cache, minuto_relativo, minutos_locais
+)
+from .escala import invalidar_escala, obter_escala, subtrair, intersectar
+from .expediente import Expediente, invalidar_expediente, obter_expediente
+from .forms import AgendamentoForm, SerieAgendamentoForm, ServicoForm
+from .habilidades import funcionarios_habilitados, invalidar_habilidades, obter_indice
+from .ocupacao import minutos_por_hora
+from .models import (
+    Usuario, Cargo, Funcionario, Servico, Agendamento, ConflitoHorario,
+    DisponibilidadeDiaria, HorarioFuncionamento, DataFechamento,
+    TurnoFuncionario, AusenciaFuncionario, SerieAgendamento, LogAuditoria, AgenteAuditoria, EnderecoAuditoria,
+    ReservaHorario, ResumoDiarioAgendamento, ContadorEntidade, TarefaRelatorio
+)
+from .painel import calcular_estatisticas, obter_estatisticas
+from .particoes import (
+    _criar_particao, arquivar_antigos, arquivar_mes, arquivos_do_mes, criar_particoes, limites_do_mes,
+    logs_arquivados, meses_para_arquivar, particionada, particoes, somar_meses
+)
+from .recorrencia import criar_serie
+from .relatorios import processar_tarefa
+from .reservas import confirmar_agendamento, reservar_horario, travar_funcionario
+from .resumos import resumo_periodo
+
+
+class AgendaTestMixin:
+    """Dados básicos compartilhados pelos testes de agenda"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cargo = Cargo.objects.create(nome='Atendente')
+        cls.servico = Servico.objects.create(nome='Corte', preco=50, duracao_minutos=60)
+        cls.cliente = Usuario.objects.create(
+            username='cliente', first_name='Ana', last_name='Souza', tipo='cliente'
+        )
+        cls.funcionario = cls.criar_funcionario('funcionario')
+        cls.inicio = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=2)
+        hoje = timezone.localdate()
+        cls.segunda = hoje + timedelta(days=7 - hoje.weekday())
+
+    @classmethod
+    def criar_funcionario(cls, username, servicos=None):
+        funcionario = Funcionario.objects.create(
+            usuario=Usuario.objects.create(username=username, first_name=username),
+            cargo=cls.cargo,
+            data_contratacao=timezone.now().date(),
+            salario=1000,
+        )
+        funcionario.servicos.set(servicos if servicos is not None else [cls.servico])
+        return funcionario
+
+    def setUp(self):
+        super().setUp()
+        # As invalidações valem no commit; aqui, executadas na hora
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidar_expediente()
+            invalidar_escala()
+            invalidar_habilidades()
+        invalidar_duracao_maxima()
+        limpar_cache_valores()
+
+    def horario(self, data, hora, minuto=0):
+        return timezone.make_aware(datetime.combine(data, time(hora, minuto)))
+
+    def dados_formulario(self, inicio, servico=None):
+        return {
+            'cliente': self.cliente.pk,
+            'funcionario': self.funcionario.pk,
+            'servico': (servico or self.servico).pk,
+            'data_agendamento': timezone.localtime(inicio).strftime('%Y-%m-%dT%H:%M'),
+            'status': 'agendado',
+        }
+
+    def agendar(self, inicio, funcionario=None, servico=None, status='agendado'):
+        return Agendamento.objects.create(
+            cliente=self.cliente,
+            funcionario=funcionario or self.funcionario,
+            servico=servico or self.servico,
+            data_agendamento=inicio,
+            status=status,
+        )
+
+
+class ConflitosTest(AgendaTestMixin, TestCase):
+
+    def test_detecta_sobreposicao(self):
+        existente = self.agendar(self.inicio)
+        conflitos = buscar_conflitos(
+            self.funcionario,
+            self.inicio + timedelta(minutes=30),
+            self.inicio + timedelta(minutes=90),
+        )
+        self.assertEqual(conflitos, [existente])
+
+    def test_intervalos_adjacentes_nao_conflitam(self):
+        self.agendar(self.inicio)
+        conflitos = buscar_conflitos(
+            self.funcionario,
+            self.inicio + timedelta(minutes=60),
+            self.inicio + timedelta(minutes=120),
+        )
+        self.assertEqual(conflitos, [])
+
+    def test_ignora_cancelados_e_o_proprio_agendamento(self):
+        cancelado = self.agendar(self.inicio, status='cancelado')
+        proprio = self.agendar(self.inicio + timedelta(hours=2))
+        fim = self.inicio + timedelta(hours=3)
+        self.assertEqual(
+            buscar_conflitos(self.funcionario, self.inicio, fim, excluir_pk=proprio.pk), []
+        )
+        self.assertNotIn(cancelado, buscar_conflitos(self.funcionario, self.inicio, fim))
+
+    def test_historico_nao_afeta_consultas(self):
+        Agendamento.objects.bulk_create([
+            Agendamento(
+                cliente=self.cliente,
+                funcionario=self.funcionario,
+                servico=self.servico,
+                data_agendamento=self.inicio - timedelta(days=3, hours=i),
+                data_fim=self.inicio - timedelta(days=3, hours=i - 1),
+            )
+            for i in range(500)
+        ])
+        duracao_maxima_servicos()
+        with self.assertNumQueries(1):
+            conflitos = buscar_conflitos(
+                self.funcionario, self.inicio, self.inicio + timedelta(hours=1)
+            )
+        self.assertEqual(conflitos, [])
+
+
+class DataFimTest(AgendaTestMixin, TestCase):
+
+    def test_data_fim_calculada_no_save(self):
+        agendamento = self.agendar(self.inicio)
+        self.assertEqual(agendamento.data_fim, self.inicio + timedelta(minutes=60))
+
+        agendamento.data_agendamento += timedelta(hours=1)
+        agendamento.save(update_fields=['data_agendamento'])
+        agendamento.refresh_from_db()
+        self.assertEqual(agendamento.data_fim, self.inicio + timedelta(minutes=120))
+
+    def test_data_fim_acompanha_duracao_do_servico(self):
+        agendamento = self.agendar(self.inicio)
+        self.servico.duracao_minutos = 90
+        self.servico.save()
+        agendamento.refresh_from_db()
+        self.assertEqual(agendamento.data_fim, self.inicio + timedelta(minutes=90))
+
+    def test_historico_mantem_duracao_do_servico(self):
+        passado = self.inicio - timedelta(days=5)
+        concluido = self.agendar(passado, status='concluido')
+        esquecido = self.agendar(passado + timedelta(hours=2))
+        self.servico.duracao_minutos = 90
+        self.servico.save()
+
+        for agendamento in (concluido, esquecido):
+            agendamento.refresh_from_db()
+            self.assertEqual(agendamento.data_fim - agendamento.data_agendamento, timedelta(minutes=60))
+        self.assertEqual(
+            sorted(ResumoDiarioAgendamento.objects.values_list('status', 'minutos')),
+            [('agendado', 60), ('concluido', 60)]
+        )
+
+    def test_formulario_rejeita_duracao_que_sobrepoe(self):
+        self.agendar(self.inicio)
+        self.agendar(self.inicio + timedelta(minutes=60))
+        # Pares do histórico não entram na validação
+        self.agendar(self.inicio - timedelta(days=5))
+        self.agendar(self.inicio - timedelta(days=5, minutes=-60))
+        dados = {'nome': 'Corte', 'preco': '50', 'duracao_minutos': 90, 'ativo': True}
+
+        form = ServicoForm(dados, instance=self.servico)
+        self.assertFalse(form.is_valid())
+        self.assertIn('1 agendamento(s)', form.errors['duracao_minutos'][0])
+
+        form = ServicoForm(dict(dados, duracao_minutos=45), instance=self.servico)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(
+            sorted(self.servico.agendamentos_pendentes().values_list('data_fim', flat=True)),
+            [self.inicio + timedelta(minutes=45), self.inicio + timedelta(minutes=105)]
+        )
+
+    def test_banco_rejeita_sobreposicao(self):
+        self.agendar(self.inicio)
+        with self.assertRaises(ConflitoHorario):
+            self.agendar(self.inicio + timedelta(minutes=30))
+
+        # Outro funcionário, status inativo ou horário adjacente são aceitos
+        self.agendar(self.inicio, funcionario=self.criar_funcionario('outro'))
+        self.agendar(self.inicio, status='cancelado')
+        self.agendar(self.inicio + timedelta(minutes=60))
+
+    def test_banco_rejeita_reativacao_sobreposta(self):
+        self.agendar(self.inicio)
+        cancelado = self.agendar(self.inicio, status='cancelado')
+        cancelado.status = 'agendado'
+        with self.assertRaises(ConflitoHorario):
+            cancelado.save()
+
+
+class DisponibilidadeTest(AgendaTestMixin, TestCase):
+
+    def test_horarios_livres_respeitam_agendamentos_e_expediente(self):
+        outro = self.criar_funcionario('outro')
+        self.agendar(self.horario(self.segunda, 10))
+
+        resultado = dict(buscar_horarios_livres(
+            self.servico, self.segunda, self.segunda, [self.funcionario, outro]
+        ))
+        livres = [timezone.localtime(h).strftime('%H:%M') for h in resultado[self.funcionario]]
+
+        self.assertEqual(livres[0], '08:00')
+        self.assertEqual(livres[-1], '17:00')
+        self.assertIn('09:00', livres)
+        self.assertIn('11:00', livres)
+        for ocupado in ['09:15', '09:45', '10:00', '10:45']:
+            self.assertNotIn(ocupado, livres)
+        self.assertEqual(len(resultado[outro]), 37)
+
+    def test_fim_de_semana_sem_horarios(self):
+        sabado = self.segunda + timedelta(days=5)
+        resultado = buscar_horarios_livres(self.servico, sabado, sabado + timedelta(days=1))
+        self.assertEqual(resultado, [(self.funcionario, [])])
+
+    def test_api_funcionarios_disponiveis(self):
+        self.client.force_login(self.funcionario.usuario)
+        url = reverse('core:api_funcionarios_disponiveis')
+
+        resposta = self.client.get(url, {
+            'servico': self.servico.pk,
+            'data_inicio': self.segunda.isoformat(),
+            'data_fim': (self.segunda + timedelta(days=6)).isoformat(),
+        })
+        self.assertEqual(resposta.status_code, 200)
+        dados = resposta.json()
+        self.assertEqual(dados['funcionarios'][0]['id'], self.funcionario.pk)
+        self.assertEqual(len(dados['funcionarios'][0]['horarios']), 37 * 5)
+
+        self.assertEqual(self.client.get(url, {'servico': 0}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'servico': 'abc'}).status_code, 400)
+        self.assertEqual(
+            self.client.get(url, {'servico': self.servico.pk, 'data_inicio': '2026-02-30'}).status_code, 400
+        )
+
+
+class AtribuicaoTest(AgendaTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.outro = cls.criar_funcionario('outro')
+
+    def atribuir(self, inicio, fim, **kwargs):
+        funcionario, horario = atribuir_funcionario(self.servico, inicio, fim, **kwargs)
+        return funcionario, timezone.localtime(horario)
+
+    def test_primeiro_horario_livre(self):
+        self.agendar(self.horario(self.segunda, 8), self.funcionario)
+        self.agendar(self.horario(self.segunda, 8), self.outro)
+        self.agendar(self.horario(self.segunda, 9), self.outro)
+        self.assertEqual(
+            self.atribuir(self.horario(self.segunda, 0), self.horario(self.segunda, 23)),
+            (self.funcionario, self.horario(self.segunda, 9))
+        )
+        self.assertIsNone(atribuir_funcionario(
+            self.servico, self.horario(self.segunda, 8), self.horario(self.segunda, 9, 30)
+        ))
+
+    def test_empate_por_carga_e_preferencia(self):
+        self.agendar(self.horario(self.segunda, 15), self.funcionario)
+        inicio, fim = self.horario(self.segunda, 8), self.horario(self.segunda, 12)
+        self.assertEqual(self.atribuir(inicio, fim), (self.outro, inicio))
+        self.assertEqual(
+            self.atribuir(inicio, fim, preferidos=[self.funcionario.pk]),
+            (self.funcionario, inicio)
+        )
+
+    def test_api(self):
+        self.client.force_login(self.funcionario.usuario)
+        url = reverse('core:api_atribuir_funcionario')
+        inicio = self.horario(self.segunda, 8)
+        resposta = self.client.get(url, {
+            'servico': self.servico.pk,
+            'inicio': inicio.isoformat(),
+            'fim': self.horario(self.segunda, 18).isoformat(),
+            'preferido': self.outro.pk,
+        })
+        self.assertEqual(resposta.status_code, 200)
+        dados = resposta.json()
+        self.assertEqual(dados['funcionario']['id'], self.outro.pk)
+        self.assertEqual(dados['inicio'], inicio.isoformat())
+
+        self.assertEqual(self.client.get(url, {'servico': 0}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'servico': 'x'}).status_code, 400)
+        self.assertEqual(
+            self.client.get(url, {'servico': self.servico.pk, 'inicio': '2026-02-30T10:00'}).status_code, 400
+        )
+
+
+class DisponibilidadeCacheTest(AgendaTestMixin, TestCase):
+
+    def minutos_livres(self, data):
+        snapshot = DisponibilidadeDiaria.objects.get(funcionario=self.funcionario, data=data)
+        return bytes(snapshot.minutos_livres)
+
+    def test_save_e_delete_atualizam_apenas_o_dia_afetado(self):
+        terca = self.segunda + timedelta(days=1)
+        mapa_livre_em_cache([self.funcionario.pk], self.segunda, 2)
+        antes_segunda = self.minutos_livres(self.segunda)
+        antes_terca = self.minutos_livres(terca)
+
+        agendamento = self.agendar(self.horario(self.segunda, 10))
+        self.assertNotEqual(self.minutos_livres(self.segunda), antes_segunda)
+        self.assertEqual(self.minutos_livres(terca), antes_terca)
+
+        # Mover para terça libera segunda e ocupa terça
+        agendamento.data_agendamento = self.horario(terca, 10)
+        agendamento.save()
+        self.assertEqual(self.minutos_livres(self.segunda), antes_segunda)
+        self.assertNotEqual(self.minutos_livres(terca), antes_terca)
+
+        agendamento.status = 'cancelado'
+        agendamento.save()
+        self.assertEqual(self.minutos_livres(terca), antes_terca)
+
+        agendamento.status = 'agendado'
+        agendamento.save()
+        Agendamento.objects.get(pk=agendamento.pk).delete()
+        self.assertEqual(self.minutos_livres(terca), antes_terca)
+
+    def test_leitura_do_cache_equivale_ao_calculo(self):
+        outro = self.criar_funcionario('outro')
+        self.agendar(self.horario(self.segunda, 9))
+        self.agendar(self.horario(self.segunda + timedelta(days=2), 14), funcionario=outro)
+        ids = [self.funcionario.pk, outro.pk]
+
+        esperado = mapa_livre(ids, self.segunda, 5)
+        self.assertTrue((mapa_livre_em_cache(ids, self.segunda, 5) == esperado).all())
+        with self.assertNumQueries(1):
+            self.assertTrue((mapa_livre_em_cache(ids, self.segunda, 5) == esperado).all())
+
+    def test_leitura_nao_sobrescreve_snapshot_gravado(self):
+        terca = self.segunda + timedelta(days=1)
+        mapa_livre_em_cache([self.funcionario.pk], self.segunda, 2)
+        # Snapshot gravado por uma alteração enquanto a leitura calculava o seu
+        DisponibilidadeDiaria.objects.filter(data=self.segunda).update(minutos_livres=bytes(180))
+        DisponibilidadeDiaria.objects.filter(data=terca).delete()
+
+        mapa_livre_em_cache([self.funcionario.pk], self.segunda, 2)
+        self.assertEqual(bytes(DisponibilidadeDiaria.objects.get(data=self.segunda).minutos_livres), bytes(180))
+        self.assertTrue(DisponibilidadeDiaria.objects.filter(data=terca).exists())
+
+    def test_alterar_duracao_invalida_snapshots(self):
+        self.agendar(self.horario(self.segunda, 10))
+        mapa_livre_em_cache([self.funcionario.pk], self.segunda, 1)
+        self.servico.duracao_minutos = 90
+        self.servico.save()
+        self.assertFalse(DisponibilidadeDiaria.objects.filter(funcionario=self.funcionario).exists())
+
+
+class ExpedienteTest(AgendaTestMixin, TestCase):
+
+    def test_horario_padrao_criado_pela_migracao(self):
+        expediente = obter_expediente()
+        self.assertEqual(expediente.intervalos_do_dia(self.segunda), ((8 * 60, 18 * 60),))
+        self.assertTrue(expediente.esta_fechado(self.segunda + timedelta(days=5)))
+
+    def test_alteracoes_recompilam_o_expediente(self):
+        sabado = self.segunda + timedelta(days=5)
+        HorarioFuncionamento.objects.create(dia_semana=5, hora_inicio=time(9), hora_fim=time(13))
+        DataFechamento.objects.create(data=self.segunda, descricao='Feriado')
+
+        expediente = obter_expediente()
+        self.assertEqual(expediente.intervalos_do_dia(sabado), ((9 * 60, 13 * 60),))
+        self.assertTrue(expediente.esta_fechado(self.segunda))
+
+        resultado = dict(buscar_horarios_livres(self.servico, self.segunda, sabado))
+        dias = {timezone.localdate(h) for h in resultado[self.funcionario]}
+        self.assertNotIn(self.segunda, dias)
+        self.assertIn(sabado, dias)
+
+    def test_alteracao_desfeita_nao_fica_compilada(self):
+        sabado = self.segunda + timedelta(days=5)
+        obter_expediente()
+        try:
+            with transaction.atomic():
+                HorarioFuncionamento.objects.create(dia_semana=5, hora_inicio=time(9), hora_fim=time(13))
+                # Antes do commit vale o expediente anterior
+                self.assertTrue(obter_expediente().esta_fechado(sabado))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertTrue(obter_expediente().esta_fechado(sabado))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            HorarioFuncionamento.objects.create(dia_semana=5, hora_inicio=time(9), hora_fim=time(13))
+        self.assertFalse(obter_expediente().esta_fechado(sabado))
+
+    def test_verifica_cache_compartilhado(self):
+        compartilhado = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}):
+            self.assertEqual([e.id for e in verificar_cache_com_varios_workers(None)], ['core.E001'])
+            with override_settings(CACHES=compartilhado):
+                self.assertEqual(verificar_cache_com_varios_workers(None), [])
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+            self.assertEqual(verificar_cache_com_varios_workers(None), [])
+
+    def test_compilado_uma_vez(self):
+        obter_expediente()
+        with self.assertNumQueries(0):
+            obter_expediente().comporta(
+                self.horario(self.segunda, 9), self.horario(self.segunda, 10)
+            )
+
+    def test_formulario_usa_expediente(self):
+        DataFechamento.objects.create(data=self.segunda + timedelta(days=1))
+
+        form = AgendamentoForm(data=self.dados_formulario(self.horario(self.segunda, 9)))
+        self.assertTrue(form.is_valid(), form.errors)
+
+        form = AgendamentoForm(data=self.dados_formulario(self.horario(self.segunda, 17, 30)))
+        self.assertFalse(form.is_valid())
+
+        form = AgendamentoForm(data=self.dados_formulario(self.horario(self.segunda + timedelta(days=1), 9)))
+        self.assertIn('data_agendamento', form.errors)
+
+
+class EscalaTest(AgendaTestMixin, TestCase):
+
+    def test_operacoes_de_intervalos(self):
+        self.assertEqual(
+            intersectar([(480, 720), (780, 1080)], [(600, 900)]),
+            [(600, 720), (780, 900)]
+        )
+        self.assertEqual(
+            subtrair([(480, 1080)], [(400, 500), (600, 660), (1000, 1200)]),
+            [(500, 600), (660, 1000)]
+        )
+
+    def test_turnos_e_ausencias_reduzem_a_escala(self):
+        terca = self.segunda + timedelta(days=1)
+        TurnoFuncionario.objects.create(
+            funcionario=self.funcionario, dia_semana=0, hora_inicio=time(12), hora_fim=time(20)
+        )
+        TurnoFuncionario.objects.create(
+            funcionario=self.funcionario, dia_semana=1, hora_inicio=time(8), hora_fim=time(12)
+        )
+        AusenciaFuncionario.objects.create(
+            funcionario=self.funcionario, tipo='atestado',
+            inicio=self.horario(terca, 9), fim=self.horario(terca, 10),
+        )
+
+        escala = obter_escala(self.funcionario)
+        self.assertEqual(escala.intervalos_do_dia(self.segunda).tolist(), [[720, 1080]])
+        self.assertEqual(escala.intervalos_do_dia(terca).tolist(), [[480, 540], [600, 720]])
+        self.assertEqual(escala.intervalos_do_dia(terca + timedelta(days=1)).tolist(), [])
+
+        resultado = dict(buscar_horarios_livres(self.servico, self.segunda, terca))
+        livres = [timezone.localtime(h) for h in resultado[self.funcionario]]
+        self.assertNotIn(self.horario(self.segunda, 11), livres)
+        self.assertIn(self.horario(self.segunda, 12), livres)
+        self.assertIn(self.horario(terca, 8), livres)
+        self.assertNotIn(self.horario(terca, 9), livres)
+
+    def test_escala_recarregada_apos_alteracao(self):
+        self.assertTrue(obter_escala(self.funcionario).comporta(
+            self.horario(self.segunda, 9), self.horario(self.segunda, 10)
+        ))
+        with self.captureOnCommitCallbacks(execute=True):
+            AusenciaFuncionario.objects.create(
+                funcionario=self.funcionario, tipo='ferias',
+                inicio=self.horario(self.segunda, 0), fim=self.horario(self.segunda + timedelta(days=7), 0),
+            )
+        self.assertFalse(obter_escala(self.funcionario).comporta(
+            self.horario(self.segunda, 9), self.horario(self.segunda, 10)
+        ))
+        with self.assertNumQueries(0):
+            obter_escala(self.funcionario).intervalos_do_dia(self.segunda)
+
+    def test_usa_o_expediente_informado(self):
+        escala = obter_escala(self.funcionario)
+        inicio, fim = self.horario(self.segunda, 9), self.horario(self.segunda, 10)
+        so_a_tarde = Expediente({self.segunda.weekday(): [(13 * 60, 18 * 60)]})
+        self.assertTrue(escala.comporta(inicio, fim))
+        self.assertFalse(escala.comporta(inicio, fim, so_a_tarde))
+        self.assertFalse(escala.mascara(self.segunda, 1, so_a_tarde)[9 * 60:10 * 60].any())
+        self.assertEqual(escala.intervalos_do_dia(self.segunda, so_a_tarde).tolist(), [[780, 1080]])
+
+
+class HabilidadesTest(AgendaTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.barba = Servico.objects.create(nome='Barba', preco=30, duracao_minutos=30)
+        cls.barbeiro = cls.criar_funcionario('barbeiro', servicos=[cls.servico, cls.barba])
+
+    def test_indice_por_servico(self):
+        self.assertEqual(funcionarios_habilitados(self.servico), {self.funcionario.pk, self.barbeiro.pk})
+        self.assertEqual(funcionarios_habilitados(self.barba), {self.barbeiro.pk})
+        indice = obter_indice()
+        self.assertTrue(indice.pode_realizar(self.barbeiro.pk, self.barba.pk))
+        self.assertFalse(indice.pode_realizar(self.funcionario.pk, self.barba.pk))
+        with self.assertNumQueries(0):
+            funcionarios_habilitados(self.barba)
+
+    def test_alteracao_descarta_indice(self):
+        funcionarios_habilitados(self.barba)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.funcionario.servicos.add(self.barba)
+        self.assertEqual(funcionarios_habilitados(self.barba), {self.funcionario.pk, self.barbeiro.pk})
+
+    def test_busca_e_formulario_so_com_habilitados(self):
+        resultado = dict(buscar_horarios_livres(self.barba, self.segunda, self.segunda))
+        self.assertEqual(list(resultado), [self.barbeiro])
+
+        form = AgendamentoForm(data=self.dados_formulario(self.horario(self.segunda, 9), self.barba))
+        self.assertNotIn(self.funcionario, form.fields['funcionario'].queryset)
+        self.assertIn('funcionario', form.errors)
+
+
+class SerieAgendamentoTest(AgendaTestMixin, TestCase):
+
+    def serie(self, **kwargs):
+        dados = {
+            'cliente': self.cliente,
+            'funcionario': self.funcionario,
+            'servico': self.servico,
+            'regra': 'semanal',
+            'primeira_data': self.horario(self.segunda, 10),
+            'quantidade': 4,
+        }
+        dados.update(kwargs)
+        return SerieAgendamento(**dados)
+
+    def test_ocorrencias_com_excecoes_e_data_limite(self):
+        excecao = self.segunda + timedelta(days=14)
+        self.assertEqual(
+            self.serie(excecoes=[excecao.isoformat()]).ocorrencias(),
+            [self.horario(self.segunda + timedelta(days=d), 10) for d in (0, 7, 21)]
+        )
+        self.assertEqual(
+            self.serie(regra='quinzenal', quantidade=None,
+                       data_limite=self.segunda + timedelta(days=30)).ocorrencias(),
+            [self.horario(self.segunda + timedelta(days=d), 10) for d in (0, 14, 28)]
+        )
+
+    def test_cria_serie_em_lote(self):
+        serie = self.serie()
+        duracao_maxima_servicos()
+        # O log de auditoria é gravado depois do commit, fora da transação
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(24):
+                agendamentos = criar_serie(serie)
+        self.assertEqual(len(agendamentos), 4)
+        self.assertEqual(serie.agendamentos.count(), 4)
+        self.assertTrue(all(a.data_fim == a.data_agendamento + timedelta(hours=1) for a in agendamentos))
+        self.assertEqual(LogAuditoria.objects.filter(modelo_auditado__valor='SerieAgendamento').count(), 1)
+        self.assertFalse(LogAuditoria.objects.filter(modelo_auditado__valor='Agendamento').exists())
+
+    def test_formulario_nao_revalida_ao_gravar(self):
+        form = SerieAgendamentoForm(data={
+            'cliente': self.cliente.pk,
+            'funcionario': self.funcionario.pk,
+            'servico': self.servico.pk,
+            'regra': 'semanal',
+            'primeira_data': timezone.localtime(self.horario(self.segunda, 10)).strftime('%Y-%m-%dT%H:%M'),
+            'quantidade': 4,
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(len(form.inicios), 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as consultas:
+                form.save()
+        self.assertEqual(len(form.agendamentos), 4)
+        # A busca de conflitos (ocorrencias_em_conflito) não se repete na gravação
+        self.assertFalse([
+            q for q in consultas
+            if 'FROM "core_agendamento" INNER JOIN' in q['sql']
+        ])
+
+    def test_reserva_bloqueia_ocorrencia(self):
+        terceira = self.horario(self.segunda + timedelta(days=14), 10)
+        dados = {
+            'cliente': self.cliente.pk,
+            'funcionario': self.funcionario.pk,
+            'servico': self.servico.pk,
+            'regra': 'semanal',
+            'primeira_data': timezone.localtime(self.horario(self.segunda, 10)).strftime('%Y-%m-%dT%H:%M'),
+            'quantidade': 4,
+        }
+        reserva = reservar_horario(self.funcionario, terceira + timedelta(minutes=30), terceira + timedelta(minutes=90))
+        form = SerieAgendamentoForm(data=dados)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.non_field_errors(), [
+            f'{timezone.localtime(terceira):%d/%m/%Y %H:%M}: horário reservado por outro atendimento.'
+        ])
+
+        # Reserva feita entre a validação do formulário e a gravação
+        reserva.delete()
+        form = SerieAgendamentoForm(data=dados)
+        self.assertTrue(form.is_valid(), form.errors)
+        reservar_horario(self.funcionario, terceira, terceira + timedelta(minutes=60))
+        with self.assertRaises(ValidationError):
+            form.save()
+        self.assertFalse(SerieAgendamento.objects.exists())
+        self.assertEqual(Agendamento.objects.count(), 0)
+
+    def test_reporta_todos_os_conflitos(self):
+        self.agendar(self.horario(self.segunda + timedelta(days=7), 10, 30))
+        self.agendar(self.horario(self.segunda + timedelta(days=21), 9, 30))
+        form = SerieAgendamentoForm(data={
+            'cliente': self.cliente.pk,
+            'funcionario': self.funcionario.pk,
+            'servico': self.servico.pk,
+            'regra': 'semanal',
+            'primeira_data': timezone.localtime(self.horario(self.segunda, 10)).strftime('%Y-%m-%dT%H:%M'),
+            'quantidade': 4,
+        })
+        self.assertFalse(form.is_valid())
+        erros = form.non_field_errors()
+        self.assertEqual(len(erros), 2)
+        self.assertTrue(all('conflito' in erro for erro in erros))
+        self.assertFalse(SerieAgendamento.objects.exists())
+
+
+class ReservaHorarioTest(AgendaTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.inicio = self.horario(self.segunda, 10)
+        self.reserva = reservar_horario(self.funcionario, self.inicio, self.inicio + timedelta(hours=1))
+
+    def test_reserva_bloqueia_outros_atendimentos(self):
+        with self.assertRaises(ConflitoHorario):
+            reservar_horario(self.funcionario, self.inicio + timedelta(minutes=30), self.inicio + timedelta(hours=2))
+
+        form = AgendamentoForm(data=self.dados_formulario(self.inicio))
+        self.assertFalse(form.is_valid())
+
+        dados = self.dados_formulario(self.inicio)
+        dados['reserva'] = str(self.reserva.token)
+        form = AgendamentoForm(data=dados)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertFalse(ReservaHorario.objects.exists())
+
+    def test_reserva_expirada_e_busca_de_horarios(self):
+        livres = dict(buscar_horarios_livres(self.servico, self.segunda, self.segunda))[self.funcionario]
+        self.assertNotIn(self.inicio, livres)
+        self.assertNotIn(self.inicio - timedelta(minutes=45), livres)
+
+        ReservaHorario.objects.update(expira_em=timezone.now())
+        livres = dict(buscar_horarios_livres(self.servico, self.segunda, self.segunda))[self.funcionario]
+        self.assertIn(self.inicio, livres)
+        reservar_horario(self.funcionario, self.inicio, self.inicio + timedelta(hours=1))
+
+    def test_confirmar_rejeita_conflito(self):
+        self.agendar(self.inicio + timedelta(hours=2))
+        agendamento = Agendamento(
+            cliente=self.cliente, funcionario=self.funcionario, servico=self.servico,
+            data_agendamento=self.inicio + timedelta(hours=2, minutes=30),
+        )
+        with self.assertRaises(ConflitoHorario):
+            confirmar_agendamento(agendamento)
+
+    def test_api_rejeita_parametros_invalidos(self):
+        self.client.force_login(self.funcionario.usuario)
+        url = reverse('core:api_reservar_horario')
+        dados = {
+            'servico': self.servico.pk,
+            'funcionario': self.funcionario.pk,
+            'inicio': self.horario(self.segunda, 14).isoformat(),
+        }
+        self.assertEqual(self.client.post(url, dados).status_code, 200)
+        for campo, valor in (('servico', 'abc'), ('funcionario', 'x'), ('inicio', '2026-02-30T10:00')):
+            resposta = self.client.post(url, {**dados, campo: valor})
+            self.assertEqual(resposta.status_code, 400, campo)
+
+    def test_apenas_o_dono_libera_a_reserva(self):
+        inicio = self.horario(self.segunda, 14)
+        reserva = reservar_horario(
+            self.funcionario, inicio, inicio + timedelta(hours=1), usuario=self.funcionario.usuario
+        )
+        outro = self.criar_funcionario('outro')
+        self.client.force_login(outro.usuario)
+        self.client.post(reverse('core:api_liberar_reserva'), {'token': reserva.token})
+        self.assertTrue(ReservaHorario.objects.filter(pk=reserva.pk).exists())
+
+        with self.assertRaises(ConflitoHorario):
+            reservar_horario(
+                self.funcionario, inicio, inicio + timedelta(hours=1),
+                usuario=outro.usuario, token=reserva.token
+            )
+        self.assertTrue(ReservaHorario.objects.filter(pk=reserva.pk).exists())
+
+        self.client.force_login(self.funcionario.usuario)
+        self.client.post(reverse('core:api_liberar_reserva'), {'token': reserva.token})
+        self.assertFalse(ReservaHorario.objects.filter(pk=reserva.pk).exists())
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ReservaConcorrenciaTest(AgendaTestMixin, TransactionTestCase):
+    """Gravações paralelas; requer um banco com travas de linha (PostgreSQL)"""
+
+    serialized_rollback = True
+
+    def setUp(self):
+        self.setUpTestData()
+        super().setUp()
+
+    def em_paralelo(self, funcoes):
+        resultados = []
+        barreira = threading.Barrier(len(funcoes))
+
+        def executar(funcao):
+            try:
+                barreira.wait()
+                resultados.append(funcao())
+            except ConflitoHorario:
+                resultados.append(None)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=executar, args=(funcao,)) for funcao in funcoes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        return resultados
+
+    def test_apenas_um_agendamento_vence(self):
+        inicio = self.horario(self.segunda, 10)
+
+        def agendar():
+            return confirmar_agendamento(Agendamento(
+                cliente=self.cliente, funcionario=self.funcionario,
+                servico=self.servico, data_agendamento=inicio,
+            ))
+
+        resultados = self.em_paralelo([agendar] * 8)
+        self.assertEqual(len(resultados), 8)
+        self.assertEqual(len([r for r in resultados if r is not None]), 1)
+        self.assertEqual(Agendamento.objects.filter(funcionario=self.funcionario).count(), 1)
+
+    def test_snapshot_ve_gravacoes_concorrentes(self):
+        # Agendamento.objects.create não passa por confirmar_agendamento (como o
+        # admin antigo): só a trava de atualizar_disponibilidade serializa
+        def agendar(hora):
+            return lambda: self.agendar(self.horario(self.segunda, hora))
+
+        self.em_paralelo([agendar(9), agendar(14)])
+        self.assertEqual(Agendamento.objects.count(), 2)
+        self.assertEqual(DisponibilidadeDiaria.objects.filter(funcionario=self.funcionario).count(), 1)
+        ids = [self.funcionario.pk]
+        self.assertTrue((mapa_livre_em_cache(ids, self.segunda, 1) == mapa_livre(ids, self.segunda, 1)).all())
+
+    def test_trava_nao_bloqueia_outros_funcionarios(self):
+        outro = self.criar_funcionario('outro')
+        travado, liberar = threading.Event(), threading.Event()
+
+        def segurar_trava():
+            try:
+                with transaction.atomic():
+                    travar_funcionario(self.funcionario.pk)
+                    travado.set()
+                    liberar.wait(timeout=30)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=segurar_trava)
+        thread.start()
+        try:
+            self.assertTrue(travado.wait(timeout=10))
+            confirmar_agendamento(Agendamento(
+                cliente=self.cliente, funcionario=outro,
+                servico=self.servico, data_agendamento=self.horario(self.segunda, 10),
+            ))
+        finally:
+            liberar.set()
+            thread.join(timeout=30)
+        self.assertTrue(Agendamento.objects.filter(funcionario=outro).exists())
+
+
+class CalendarioApiTest(AgendaTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.funcionario.usuario)
+        self.url = reverse('core:api_agendamentos_calendario')
+        self.periodo = {
+            'start': self.segunda.isoformat(),
+            'end': (self.segunda + timedelta(days=7)).isoformat(),
+        }
+
+    def eventos(self, resposta):
+        return json.loads(b''.join(resposta.streaming_content))
+
+    def test_eventos_do_periodo(self):
+        agendamento = self.agendar(self.horario(self.segunda, 10))
+        self.agendar(self.horario(self.segunda, 12), status='cancelado')
+        self.agendar(self.horario(self.segunda + timedelta(days=8), 10))
+
+        resposta = self.client.get(self.url, self.periodo)
+        self.assertEqual(resposta.status_code, 200)
+        eventos = self.eventos(resposta)
+        self.assertEqual([evento['id'] for evento in eventos], [agendamento.pk])
+        self.assertEqual(eventos[0]['title'], 'Ana Souza - Corte')
+
+        outro = self.criar_funcionario('outro')
+        resposta = self.client.get(self.url, {**self.periodo, 'funcionario': outro.pk})
+        self.assertEqual(self.eventos(resposta), [])
+
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {**self.periodo, 'start': '2026-02-30'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {**self.periodo, 'end': '2026-02-30T25:00'}).status_code, 400)
+
+    def test_etag_e_if_none_match(self):
+        agendamento = self.agendar(self.horario(self.segunda, 10))
+        etag = self.client.get(self.url, self.periodo)['ETag']
+
+        with self.assertNumQueries(3):  # sessão, usuário e o agregado do período
+            resposta = self.client.get(self.url, self.periodo, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 304)
+
+        agendamento.status = 'em_andamento'
+        agendamento.save()
+        resposta = self.client.get(self.url, self.periodo, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+
+    def test_sem_permissao_ve_apenas_os_proprios(self):
+        proprio = self.agendar(self.horario(self.segunda, 10))
+        outro = self.criar_funcionario('outro')
+        alheio = self.agendar(self.horario(self.segunda, 10), funcionario=outro)
+        outro_cliente = Usuario.objects.create(username='outro_cliente', tipo='cliente')
+        Agendamento.objects.filter(pk=alheio.pk).update(cliente=outro_cliente)
+
+        resposta = self.client.get(self.url, {**self.periodo, 'funcionario': outro.pk})
+        self.assertEqual(self.eventos(resposta), [])
+
+        self.client.force_login(outro_cliente)
+        resposta = self.client.get(self.url, self.periodo)
+        self.assertEqual([evento['id'] for evento in self.eventos(resposta)], [alheio.pk])
+
+        self.client.force_login(self.cliente)
+        resposta = self.client.get(self.url, self.periodo)
+        self.assertEqual([evento['id'] for evento in self.eventos(resposta)], [proprio.pk])
+
+        self.funcionario.usuario.pode_ver_agendamentos = True
+        self.funcionario.usuario.save()
+        self.client.force_login(self.funcionario.usuario)
+        self.assertEqual(len(self.eventos(self.client.get(self.url, self.periodo))), 2)
+
+
+class AgendaIcsTest(AgendaTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('core:agenda_funcionario_ics', args=[self.funcionario.token_calendario])
+
+    def test_feed_ics(self):
+        agendamento = self.agendar(self.horario(self.segunda, 10))
+        agendamento.observacoes = 'Cliente prefere tesoura; sem máquina, por favor'
+        agendamento.save()
+        self.agendar(self.horario(self.segunda, 12), status='cancelado')
+
+        resposta = self.client.get(self.url)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta['Content-Type'], 'text/calendar; charset=utf-8')
+        conteudo = b''.join(resposta.streaming_content).decode()
+        self.assertTrue(conteudo.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(conteudo.count('BEGIN:VEVENT'), 1)
+        self.assertIn(f'UID:agendamento-{agendamento.pk}@', conteudo)
+        self.assertIn('SUMMARY:Corte - Ana Souza\r\n', conteudo)
+        self.assertIn(r'tesoura\; sem máquina\,', conteudo.replace('\r\n ', ''))
+        self.assertTrue(all(len(linha.encode()) <= 75 for linha in conteudo.split('\r\n')))
+
+        outro = reverse('core:agenda_funcionario_ics', args=['00000000-0000-0000-0000-000000000000'])
+        self.assertEqual(self.client.get(outro).status_code, 404)
+
+    def test_get_condicional(self):
+        anterior = self.agendar(self.horario(self.segunda, 10))
+        self.agendar(self.horario(self.segunda, 12))
+        resposta = self.client.get(self.url)
+        etag = resposta['ETag']
+        self.assertFalse(resposta.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Excluir um agendamento mais antigo não altera a maior data_atualizacao
+        anterior.delete()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_MODIFIED_SINCE='Sun, 01 Jan 2090 00:00:00 GMT').status_code, 200
+        )
+
+
+class DashboardTest(AgendaTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.funcionario.usuario)
+        self.url = reverse('core:dashboard')
+
+    def test_estatisticas_em_uma_consulta(self):
+        self.agendar(self.inicio)
+        concluido = self.agendar(timezone.now() - timedelta(hours=1), status='concluido')
+        with self.assertNumQueries(2):
+            estatisticas = calcular_estatisticas()
+        self.assertEqual(estatisticas['total_funcionarios'], 1)
+        self.assertEqual(estatisticas['total_clientes'], 1)
+        self.assertEqual(estatisticas['total_servicos'], 1)
+        self.assertEqual(estatisticas['receita_mes'], concluido.valor_final)
+        self.assertEqual(
+            estatisticas['agendamentos_por_status'],
+            [{'status': 'agendado', 'total': 1}, {'status': 'concluido', 'total': 1}]
+        )
+        self.assertEqual(len(estatisticas['proximos_agendamentos']), 1)
+
+    def test_snapshot_em_cache_e_invalidado(self):
+        self.agendar(self.inicio)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        # Sessão, usuário e configuração da empresa (context processor); as
+        # estatísticas e os próximos agendamentos vêm do cache
+        with self.assertNumQueries(3):
+            resposta = self.client.get(self.url)
+        self.assertEqual(len(resposta.context['proximos_agendamentos']), 1)
+
+        self.funcionario.usuario.last_login = timezone.now()
+        self.funcionario.usuario.save(update_fields=['last_login'])
+        self.assertEqual(obter_estatisticas()['total_servicos'], 1)
+        with self.assertNumQueries(0):
+            obter_estatisticas()
+
+        Servico.objects.create(nome='Barba', preco=30, duracao_minutos=30)
+        self.assertEqual(obter_estatisticas()['total_servicos'], 2)
+
+
+class ResumoDiarioTest(AgendaTestMixin, TestCase):
+
+    def resumo(self):
+        return {
+            (linha.data, linha.status): (linha.quantidade, linha.minutos, linha.receita)
+            for linha in ResumoDiarioAgendamento.objects.exclude(quantidade=0)
+        }
+
+    def test_mantido_pelos_signals(self):
+        segunda = self.horario(self.segunda, 10)
+        agendamento = self.agendar(segunda)
+        self.agendar(segunda + timedelta(hours=2))
+        self.assertEqual(self.resumo(), {(self.segunda, 'agendado'): (2, 120, Decimal('100'))})
+
+        agendamento.status = 'concluido'
+        agendamento.valor_final = Decimal('45')
+        agendamento.data_agendamento += timedelta(days=1)
+        agendamento.save()
+        self.assertEqual(self.resumo(), {
+            (self.segunda, 'agendado'): (1, 60, Decimal('50')),
+            (self.segunda + timedelta(days=1), 'concluido'): (1, 60, Decimal('45')),
+        })
+
+        agendamento.delete()
+        self.servico.duracao_minutos = 90
+        self.servico.save()
+        self.assertEqual(self.resumo(), {(self.segunda, 'agendado'): (1, 90, Decimal('50'))})
+
+    def test_comando_recalcula_em_blocos(self):
+        self.agendar(self.horario(self.segunda, 10))
+        self.agendar(self.horario(self.segunda + timedelta(days=3), 10), status='cancelado')
+        esperado = self.resumo()
+
+        ResumoDiarioAgendamento.objects.all().delete()
+        call_command('atualizar_resumos', dias=2, stdout=StringIO())
+        self.assertEqual(self.resumo(), esperado)
+        self.assertEqual(
+            list(resumo_periodo(self.segunda, self.segunda + timedelta(days=6), 'status')),
+            [
+                {'status': 'agendado', 'quantidade_total': 1, 'minutos_total': 60, 'receita_total': Decimal('50')},
+                {'status': 'cancelado', 'quantidade_total': 1, 'minutos_total': 60, 'receita_total': Decimal('50')},
+            ]
+        )
+
+
+class ExportacaoTest(AgendaTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(Usuario.objects.create(username='gerente', tipo='master'))
+        self.segunda_10h = self.horario(self.segunda, 10)
+        self.agendar(self.segunda_10h)
+        self.agendar(self.horario(self.segunda, 14), status='concluido')
+        self.periodo = {
+            'data_inicio': self.segunda.isoformat(),
+            'data_fim': (self.segunda + timedelta(days=6)).isoformat(),
+        }
+
+    def conteudo(self, resposta):
+        self.assertTrue(resposta.streaming)
+        return b''.join(resposta.streaming_content)
+
+    def test_csv_comprimido(self):
+        url = reverse('core:relatorio_agendamentos_exportar')
+        resposta = self.client.get(url, self.periodo, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(resposta['Content-Encoding'], 'gzip')
+        linhas = gzip.decompress(self.conteudo(resposta)).decode('utf-8-sig').splitlines()
+        self.assertEqual(linhas[0], 'ID,Início,Fim,Cliente,Funcionário,Serviço,Status,Valor (R$)')
+        self.assertEqual(len(linhas), 3)
+        self.assertIn(f'{self.segunda:%Y-%m-%d} 10:00,{self.segunda:%Y-%m-%d} 11:00,Ana Souza', linhas[1])
+        self.assertTrue(linhas[2].endswith(',Concluído,50.00'))
+
+        sem_gzip = self.client.get(url, self.periodo)
+        self.assertNotIn('Content-Encoding', sem_gzip)
+        self.assertEqual(self.conteudo(sem_gzip).decode('utf-8-sig').splitlines(), linhas)
+
+    def test_xlsx_em_fluxo(self):
+        resposta = self.client.get(
+            reverse('core:relatorio_agendamentos_exportar'), {**self.periodo, 'formato': 'xlsx', 'status': 'agendado'}
+        )
+        pacote = zipfile.ZipFile(BytesIO(self.conteudo(resposta)))
+        self.assertIsNone(pacote.testzip())
+        planilha = pacote.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(planilha.count('<row>'), 2)
+        self.assertIn('<t xml:space="preserve">Ana Souza</t>', planilha)
+        self.assertIn('<c s="3"><v>50.00</v></c>', planilha)
+
+    def test_receitas_do_resumo(self):
+        resposta = self.client.get(reverse('core:relatorio_receitas_exportar'), self.periodo)
+        self.assertEqual(self.conteudo(resposta).decode('utf-8-sig').splitlines(), [
+            'Data,Funcionário,Serviço,Atendimentos,Minutos,Receita (R$)',
+            f'{self.segunda.isoformat()},funcionario,Corte,1,60,50.00',
+        ])
+
+    def test_permissao_e_periodo(self):
+        url = reverse('core:relatorio_agendamentos_exportar')
+        self.assertEqual(self.client.get(url, {
+            'data_inicio': self.segunda.isoformat(),
+            'data_fim': (self.segunda + timedelta(days=400)).isoformat(),
+        }).status_code, 400)
+
+        self.client.force_login(self.funcionario.usuario)
+        self.assertEqual(self.client.get(url, self.periodo).status_code, 403)
+
+
+class OcupacaoTest(AgendaTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(Usuario.objects.create(username='gerente', tipo='master'))
+        self.agendar(self.horario(self.segunda, 10))
+        self.agendar(self.horario(self.segunda, 14, 30))
+        self.agendar(self.horario(self.segunda, 16), status='cancelado')
+        self.periodo = {
+            'data_inicio': self.segunda.isoformat(),
+            'data_fim': (self.segunda + timedelta(days=6)).isoformat(),
+        }
+
+    def test_minutos_por_hora(self):
+        ocupados, disponiveis = minutos_por_hora([self.funcionario.pk], self.segunda, 7)
+        self.assertEqual(ocupados.shape, (1, 7, 24))
+        self.assertEqual(ocupados.sum(), 120)
+        self.assertEqual(ocupados[0, 0, [10, 14, 15]].tolist(), [60, 30, 30])
+        self.assertEqual(disponiveis[0, :, 8:18].sum(), 5 * 600)
+        self.assertEqual(disponiveis[0, 5:].sum(), 0)
+
+    def test_minutos_locais_com_horario_de_verao(self):
+        fuso = ZoneInfo('America/New_York')
+        inicio = datetime(2024, 3, 9, tzinfo=fuso)
+        momentos = [inicio + timedelta(minutes=37 * i, seconds=i % 2) for i in range(200)]
+        for para_cima in (False, True):
+            esperado = []
+            for momento in momentos:
+                minuto, fracao = minuto_relativo(momento, inicio.date(), fuso)
+                esperado.append(min(minuto + (para_cima and fracao), 3 * 1440))
+            self.assertEqual(
+                minutos_locais(momentos, inicio.date(), 3, para_cima, fuso).tolist(), esperado
+            )
+
+    def test_api(self):
+        resposta = self.client.get(reverse('core:api_ocupacao'), {**self.periodo, 'detalhe': 'hora'})
+        self.assertEqual(resposta.status_code, 200)
+        dados = resposta.json()
+        self.assertEqual(dados['minutos_ocupados'], 120)
+        self.assertEqual(dados['minutos_disponiveis'], 3000)
+        self.assertEqual(dados['taxa'], 0.04)
+
+        funcionario, = dados['funcionarios']
+        self.assertEqual(funcionario['por_dia']['minutos_ocupados'], [120, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(funcionario['por_dia']['taxa'][:2], [0.2, 0.0])
+        self.assertIsNone(funcionario['por_dia']['taxa'][5])
+        self.assertEqual(funcionario['por_hora']['minutos_ocupados'][14], 30)
+        self.assertEqual(funcionario['por_dia_e_hora']['minutos_ocupados'][0][10], 60)
+
+        calor = dados['mapa_calor']
+        self.assertEqual(calor['taxa'][0][10], 1.0)
+        self.assertEqual(calor['taxa'][0][14], 0.5)
+        self.assertEqual(calor['taxa'][1][10], 0.0)
+        self.assertIsNone(calor['taxa'][6][10])
+
+    def test_relatorio_e_permissao(self):
+        resposta = self.client.get(reverse('core:relatorio_ocupacao'), self.periodo)
+        self.assertContains(resposta, '<th>08h</th>', html=True)
+        self.assertNotContains(resposta, '<th>18h</th>', html=True)
+        self.assertContains(resposta, '100%')
+
+        self.client.force_login(self.funcionario.usuario)
+        self.assertEqual(self.client.get(reverse('core:api_ocupacao'), self.periodo).status_code, 403)
+
+
+class TarefaRelatorioTest(AgendaTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.diretorio = diretorio.name
+        configuracao = override_settings(RELATORIO_DIRETORIO=self.diretorio)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        self.client.force_login(Usuario.objects.create(username='gerente', tipo='master'))
+        self.agendamento = self.agendar(self.horario(self.segunda, 10))
+        self.pedido = {
+            'tipo': 'agendamentos',
+            'data_inicio': self.segunda.isoformat(),
+            'data_fim': (self.segunda + timedelta(days=6)).isoformat(),
+        }
+
+    def solicitar(self):
+        return self.client.post(reverse('core:relatorio_solicitar'), self.pedido)
+
+    def test_fila_progresso_e_arquivo(self):
+        resposta = self.solicitar()
+        self.assertEqual(resposta.status_code, 202)
+        tarefa = resposta.json()
+        self.assertEqual((tarefa['status'], tarefa['progresso'], tarefa['arquivo_url']), ('pendente', 0, None))
+        self.assertEqual(self.solicitar().json()['id'], tarefa['id'])
+
+        call_command('processar_relatorios', uma_vez=True, stdout=StringIO())
+        situacao = self.client.get(tarefa['status_url']).json()
+        self.assertEqual((situacao['status'], situacao['progresso'], situacao['total_linhas']), ('concluido', 100, 1))
+
+        arquivo = self.client.get(situacao['arquivo_url'])
+        conteudo = b''.join(arquivo.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(conteudo), 2)
+        self.assertIn('Ana Souza', conteudo[1])
+
+    def test_reaproveita_ate_os_dados_mudarem(self):
+        primeira = self.solicitar().json()
+        call_command('processar_relatorios', uma_vez=True, stdout=StringIO())
+        repetida = self.solicitar()
+        self.assertEqual(repetida.status_code, 200)
+        self.assertEqual(repetida.json()['id'], primeira['id'])
+        self.assertEqual(repetida.json()['status'], 'concluido')
+
+        self.agendamento.status = 'concluido'
+        self.agendamento.save()
+        nova = self.solicitar()
+        self.assertEqual(nova.status_code, 202)
+
+        # A versão anterior é descartada quando a nova fica pronta
+        antiga = TarefaRelatorio.objects.get(pk=primeira['id'])
+        caminho = os.path.join(self.diretorio, antiga.arquivo)
+        self.assertTrue(os.path.exists(caminho))
+        call_command('processar_relatorios', uma_vez=True, stdout=StringIO())
+        self.assertEqual(list(TarefaRelatorio.objects.values_list('pk', flat=True)), [nova.json()['id']])
+        self.assertFalse(os.path.exists(caminho))
+
+    def test_nova_versao_quando_cliente_ou_servico_mudam(self):
+        primeira = self.solicitar().json()
+        self.cliente.first_name = 'Ana Paula'
+        self.cliente.save()
+        segunda = self.solicitar().json()
+        self.assertNotEqual(segunda['id'], primeira['id'])
+
+        self.servico.nome = 'Corte masculino'
+        self.servico.save()
+        self.assertNotEqual(self.solicitar().json()['id'], segunda['id'])
+
+    def test_arquivo_parcial_por_tentativa(self):
+        tarefa = TarefaRelatorio.objects.get(pk=self.solicitar().json()['id'])
+        destino = os.path.join(self.diretorio, f'{tarefa.tipo}_{tarefa.pk}_{tarefa.chave[:12]}.csv')
+        # Arquivo de um worker anterior que ainda está escrevendo a mesma tarefa
+        with open(f'{destino}.parcial', 'wb') as arquivo:
+            arquivo.write(b'em andamento')
+
+        call_command('processar_relatorios', uma_vez=True, stdout=StringIO())
+        self.assertEqual(sorted(os.listdir(self.diretorio)), sorted([
+            os.path.basename(destino), os.path.basename(destino) + '.parcial'
+        ]))
+        with open(f'{destino}.parcial', 'rb') as arquivo:
+            self.assertEqual(arquivo.read(), b'em andamento')
+
+    def test_parametros_invalidos(self):
+        self.pedido['tipo'] = 'salarios'
+        self.assertEqual(self.solicitar().status_code, 400)
+
+    def test_falha_na_consulta_encerra_com_erro(self):
+        tarefa = TarefaRelatorio.objects.create(
+            tipo='agendamentos', parametros={'data_inicio': self.segunda.isoformat()},
+            chave='a' * 64, versao_dados='v', status='processando'
+        )
+        with self.assertLogs('core.relatorios', 'ERROR'):
+            self.assertFalse(processar_tarefa(tarefa))
+        tarefa.refresh_from_db()
+        self.assertEqual((tarefa.status, tarefa.erro, tarefa.arquivo), ('erro', "'data_fim'", ''))
+        self.assertEqual(os.listdir(self.diretorio), [])
+
+
+class ContadorEntidadeTest(AgendaTestMixin, TestCase):
+
+    def contadores(self):
+        with self.assertNumQueries(1):
+            return obter_contadores()
+
+    def test_mantidos_pelos_signals(self):
+        self.assertEqual(self.contadores(), {
+            'usuarios': 2, 'clientes': 1, 'funcionarios': 1, 'servicos': 1
+        })
+
+        outro = self.criar_funcionario('outro')
+        self.cliente.ativo = False
+        self.cliente.save()
+        outro.usuario.tipo = 'cliente'
+        outro.usuario.save()
+        self.servico.nome = 'Corte masculino'
+        self.servico.save()
+        self.assertEqual(self.contadores(), {
+            'usuarios': 2, 'clientes': 1, 'funcionarios': 2, 'servicos': 1
+        })
+
+        # Excluir o usuário leva junto o funcionário (cascade)
+        outro.usuario.delete()
+        self.servico.ativo = False
+        self.servico.save()
+        self.assertEqual(self.contadores(), {
+            'usuarios': 1, 'clientes': 0, 'funcionarios': 1, 'servicos': 0
+        })
+
+    def test_login_nao_altera_contadores(self):
+        usuario = Usuario.objects.get(pk=self.funcionario.usuario_id)
+        with CaptureQueriesContext(connection) as consultas:
+            usuario.last_login = timezone.now()
+            usuario.save(update_fields=['last_login'])
+        self.assertFalse([
+            consulta for consulta in consultas.captured_queries
+            if 'core_contadorentidade' in consulta['sql']
+        ])
+
+    def test_comando_reconcilia(self):
+        # update() não passa pelos signals
+        Servico.objects.update(ativo=False)
+        ContadorEntidade.objects.filter(nome='usuarios').delete()
+
+        saida = StringIO()
+        call_command('reconciliar_contadores', stdout=saida)
+        self.assertIn('servicos: 1 -> 0', saida.getvalue())
+        self.assertIn('usuarios: - -> 2', saida.getvalue())
+        self.assertEqual(self.contadores(), {
+            'usuarios': 2, 'clientes': 1, 'funcionarios': 1, 'servicos': 0
+        })
+
+
+class PeriodoAgendamentoTest(AgendaTestMixin, TestCase):
+
+    def test_datas_locais_viram_intervalos_semiabertos(self):
+        ultimo_horario = self.agendar(self.horario(self.segunda, 23))
+        meia_noite = self.agendar(self.horario(self.segunda + timedelta(days=1), 0))
+
+        self.assertEqual(list(Agendamento.objects.do_dia(self.segunda)), [ultimo_horario])
+        self.assertEqual(
+            list(Agendamento.objects.entre(self.segunda, self.segunda + timedelta(days=1))),
+            [meia_noite, ultimo_horario]
+        )
+        sql = str(Agendamento.objects.do_dia(self.segunda).query)
+        self.assertNotIn('django_datetime_cast_date', sql)
+        self.assertNotIn('AT TIME ZONE', sql)
+
+    def test_hoje_e_proximos(self):
+        passado = self.agendar(timezone.now() - timedelta(minutes=1), status='concluido')
+        futuro = self.agendar(self.inicio)
+        self.assertNotIn(futuro, Agendamento.objects.hoje())
+        if timezone.localdate(passado.data_agendamento) == timezone.localdate():
+            self.assertIn(passado, Agendamento.objects.hoje())
+        self.assertEqual(list(Agendamento.objects.proximos(7)), [futuro])
+        self.assertFalse(Agendamento.objects.proximos(0).filter(pk=futuro.pk).exists())
+
+
+class PlanoConsultaMixin:
+    """EXPLAIN das consultas no PostgreSQL"""
+
+    def plano(self, queryset, sem_seqscan=False):
+        with transaction.atomic(), connection.cursor() as cursor:
+            if sem_seqscan:
+                # Sem seq scan o planner só usa um índice se o filtro permitir
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+
+    def nome_indice(self, modelo, *campos):
+        return next(
+            indice.name for indice in modelo._meta.indexes
+            if tuple(indice.fields) == campos
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN com nomes de índice do PostgreSQL')
+class PlanoPeriodoAgendamentoTest(PlanoConsultaMixin, AgendaTestMixin, TestCase):
+    """Os filtros por período usam os índices de data_agendamento"""
+
+    def assertUsaIndice(self, queryset):
+        plano = self.plano(queryset, sem_seqscan=True)
+        self.assertRegex(plano, r'Index Cond: .*data_agendamento >=', plano)
+
+    def test_periodos_usam_indice(self):
+        hoje = timezone.localdate()
+        self.assertUsaIndice(Agendamento.objects.hoje())
+        self.assertUsaIndice(Agendamento.objects.entre(hoje, hoje + timedelta(days=30)))
+        self.assertUsaIndice(Agendamento.objects.proximos(7).filter(status='agendado'))
+        self.assertUsaIndice(
+            Agendamento.objects.ativos().sobrepondo(self.inicio, self.inicio + timedelta(hours=1))
+            .filter(funcionario=self.funcionario)
+        )
+
+    def test_filtro_por_data_convertida_nao_usa_indice(self):
+        plano = self.plano(
+            Agendamento.objects.filter(data_agendamento__date=timezone.localdate()), sem_seqscan=True
+        )
+        self.assertIsNone(re.search(r'Index Cond: .*data_agendamento', plano), plano)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN com nomes de índice do PostgreSQL')
+class PlanoIndicesTest(PlanoConsultaMixin, AgendaTestMixin, TestCase):
+    """
+    Com um volume parecido com o de produção (5 mil usuários, 20
+    funcionários e 30 mil agendamentos em dois anos) e estatísticas
+    atualizadas, o planner escolhe os índices pensados para cada consulta
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        tipos = ['cliente'] * 8 + ['restrito', 'master']
+        usuarios = Usuario.objects.bulk_create([
+            Usuario(
+                username=f'usuario{i}', first_name=f'Nome{i % 500}', last_name=f'Sobrenome{i}',
+                email=f'usuario{i}@exemplo.com', tipo=tipos[i % 10], ativo=i % 7 != 0,
+            )
+            for i in range(5000)
+        ], batch_size=1000)
+        cls.clientes = [usuario for usuario in usuarios if usuario.tipo == 'cliente']
+        funcionarios = [cls.funcionario] + [
+            cls.criar_funcionario(f'profissional{i}') for i in range(19)
+        ]
+
+        # Um agendamento a cada 12 horas por funcionário, de 600 dias atrás
+        # até pouco mais de 4 meses à frente
+        agora = timezone.now()
+        base = agora.replace(minute=0, second=0, microsecond=0) - timedelta(days=600)
+        agendamentos = []
+        for f, funcionario in enumerate(funcionarios):
+            for k in range(1500):
+                inicio = base + timedelta(hours=12 * k + f % 12)
+                if inicio > agora:
+                    status = 'agendado'
+                else:
+                    status = 'cancelado' if k % 20 == 0 else 'concluido'
+                agendamentos.append(Agendamento(
+                    cliente=cls.clientes[(k * 7 + f) % len(cls.clientes)],
+                    funcionario=funcionario,
+                    servico=cls.servico,
+                    data_agendamento=inicio,
+                    data_fim=inicio + timedelta(hours=1),
+                    status=status,
+                    valor_final=cls.servico.preco,
+                ))
+        Agendamento.objects.bulk_create(agendamentos, batch_size=2000)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_usuario')
+            cursor.execute('ANALYZE core_agendamento')
+
+    def assertUsaIndice(self, queryset, indice):
+        plano = self.plano(queryset)
+        self.assertIn(indice, plano, plano)
+
+    def test_agenda_do_funcionario(self):
+        # Busca de conflitos do AgendamentoForm
+        self.assertUsaIndice(
+            Agendamento.objects.ativos().sobrepondo(self.inicio, self.inicio + timedelta(hours=1))
+            .filter(funcionario=self.funcionario),
+            self.nome_indice(Agendamento, 'funcionario', 'data_agendamento')
+        )
+
+    def test_historico_do_cliente(self):
+        self.assertUsaIndice(
+            Agendamento.objects.filter(cliente=self.clientes[0]).order_by('-data_agendamento')[:20],
+            self.nome_indice(Agendamento, 'cliente', 'data_agendamento')
+        )
+
+    def test_status_no_periodo(self):
+        hoje = timezone.localdate()
+        self.assertUsaIndice(
+            Agendamento.objects.entre(hoje - timedelta(days=365), hoje).filter(status='cancelado'),
+            self.nome_indice(Agendamento, 'status', 'data_agendamento')
+        )
+
+    def test_periodo_do_calendario(self):
+        self.assertUsaIndice(
+            Agendamento.objects.sobrepondo(self.inicio, self.inicio + timedelta(days=7))
+            .exclude(status='cancelado'),
+            self.nome_indice(Agendamento, 'data_agendamento')
+        )
+
+    def test_login_por_email(self):
+        self.assertUsaIndice(
+            Usuario.objects.filter(email='usuario123@exemplo.com'),
+            self.nome_indice(Usuario, 'email')
+        )
+
+    def test_lista_de_usuarios_ativos(self):
+        self.assertUsaIndice(
+            Usuario.objects.filter(ativo=True, tipo='restrito').order_by('first_name', 'last_name')[:20],
+            'core_usuario_ativo_tipo_idx'
+        )
+        self.assertUsaIndice(
+            Usuario.objects.filter(ativo=True).order_by('first_name', 'last_name')[:20],
+            'core_usuario_ativo_nome_idx'
+        )
+
+
+class AuditoriaTest(AgendaTestMixin, TestCase):
+
+    def inserts(self, consultas):
+        return [q for q in consultas if q['sql'].startswith('INSERT INTO "core_logauditoria"')]
+
+    def requisicao(self, view):
+        with CaptureQueriesContext(connection) as consultas:
+            AuditoriaMiddleware(view)(RequestFactory().get('/'))
+        return self.inserts(consultas)
+
+    def test_lote_gravado_no_fim_da_requisicao(self):
+        def view(request):
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(3):
+                    LogAuditoria.registrar(None, 'view', 'Teste', detalhes={'i': i}, request=request)
+            self.assertFalse(LogAuditoria.objects.filter(modelo_auditado__valor='Teste').exists())
+            return HttpResponse()
+
+        self.assertEqual(len(self.requisicao(view)), 1)
+        logs = LogAuditoria.objects.filter(modelo_auditado__valor='Teste').order_by('pk')
+        self.assertEqual([log.detalhes['i'] for log in logs], [0, 1, 2])
+        self.assertEqual(logs[0].ip_address, '127.0.0.1')
+        self.assertLessEqual(logs[0].timestamp, logs[2].timestamp)
+
+    @override_settings(AUDITORIA_LOTE_TAMANHO=2)
+    def test_fila_cheia_gravada_durante_a_requisicao(self):
+        def view(request):
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(5):
+                    LogAuditoria.registrar(None, 'view', 'Teste')
+            return HttpResponse()
+
+        self.assertEqual(len(self.requisicao(view)), 3)
+        self.assertEqual(LogAuditoria.objects.filter(modelo_auditado__valor='Teste').count(), 5)
+
+    def test_fora_de_requisicao_e_apos_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            LogAuditoria.registrar(None, 'view', 'Teste')
+        self.assertEqual(LogAuditoria.objects.filter(modelo_auditado__valor='Teste').count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    LogAuditoria.registrar(None, 'view', 'Desfeito')
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertFalse(LogAuditoria.objects.filter(modelo_auditado__valor='Desfeito').exists())
+
+    @override_settings(AUDITORIA_LOTE_TAMANHO=2)
+    def test_falha_no_lote_descarta_apenas_o_log_invalido(self):
+        logs = [LogAuditoria(acao='view', modelo='Teste', objeto_id=i) for i in (1, 2, -1, 4)]
+        with self.assertLogs('core.auditoria', 'ERROR') as registro:
+            gravar(logs)
+        self.assertEqual(len(registro.records), 1)
+        self.assertIn('view Teste -1', registro.output[0])
+        self.assertEqual(
+            sorted(LogAuditoria.objects.filter(modelo_auditado__valor='Teste').values_list('objeto_id', flat=True)),
+            [1, 2, 4]
+        )
+
+    @override_settings(AUDITORIA_LOTE_TAMANHO=3, AUDITORIA_LOTE_SEGUNDOS=60)
+    def test_gravador_assincrono_agrupa_em_lotes(self):
+        lotes = []
+
+        class Gravador(GravadorAuditoria):
+            def gravar(self, lote):
+                lotes.append(lote)
+
+        gravador = Gravador()
+        for i in range(7):
+            gravador.fila.put(i)
+        gravador.start()
+        gravador.encerrar()
+        self.assertFalse(gravador.is_alive())
+        self.assertEqual(lotes, [[0, 1, 2], [3, 4, 5], [6]])
+
+    def logs_do_save(self, objeto, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            objeto.save(**kwargs)
+        return list(LogAuditoria.objects.filter(modelo_auditado__valor=objeto.__class__.__name__, objeto_id=objeto.pk))
+
+    def test_somente_campos_alterados(self):
+        usuario = Usuario.objects.get(pk=self.cliente.pk)
+        self.assertEqual(self.logs_do_save(usuario), [])
+
+        usuario.last_login = timezone.now()
+        self.assertEqual(self.logs_do_save(usuario, update_fields=['last_login']), [])
+
+        usuario.first_name = 'Ana Maria'
+        usuario.set_password('nova-senha')
+        log, = self.logs_do_save(usuario)
+        self.assertEqual(log.acao, 'update')
+        self.assertEqual(log.detalhes, {'alteracoes': {
+            'first_name': ['Ana', 'Ana Maria'], 'password': ['***', '***'],
+        }})
+
+        agendamento = Agendamento.objects.get(pk=self.agendar(self.inicio).pk)
+        agendamento.valor_final = Decimal('45')
+        agendamento.status = 'cancelado'
+        log, = self.logs_do_save(agendamento)
+        self.assertEqual(log.detalhes, {'alteracoes': {
+            'status': ['agendado', 'cancelado'], 'valor_final': ['50.00', '45'],
+        }})
+
+    def test_signal_e_view_mesclados_na_requisicao(self):
+        gerente = Usuario.objects.create(username='gerente', tipo='master')
+
+        def view(request):
+            with self.captureOnCommitCallbacks(execute=True):
+                novo = Usuario.objects.create(username='novo', first_name='Novo')
+                LogAuditoria.registrar(gerente, 'create', Usuario, objeto=novo, request=request)
+                novo.telefone = '11999999999'
+                novo.save()
+            return HttpResponse()
+
+        self.assertEqual(len(self.requisicao(view)), 1)
+        log = LogAuditoria.objects.get(modelo_auditado__valor='Usuario', objeto_id=Usuario.objects.get(username='novo').pk)
+        self.assertEqual(log.acao, 'create')
+        self.assertEqual(log.usuario, gerente)
+        self.assertEqual(log.ip_address, '127.0.0.1')
+        self.assertEqual(log.detalhes, {'alteracoes': {'telefone': [None, '11999999999']}})
+
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_valores_repetidos_gravados_uma_vez(self):
+        def view(request):
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(3):
+                    LogAuditoria.registrar(None, 'view', 'Teste', request=request)
+            return HttpResponse()
+
+        requisicao = RequestFactory().get('/', HTTP_USER_AGENT='Mozilla/5.0')
+        AuditoriaMiddleware(view)(requisicao)
+        logs = list(LogAuditoria.objects.filter(modelo_auditado__valor='Teste'))
+        self.assertEqual(len({(log.modelo_auditado_id, log.endereco_ip_id, log.agente_usuario_id) for log in logs}), 1)
+        self.assertEqual(EnderecoAuditoria.objects.count(), 1)
+        self.assertEqual(AgenteAuditoria.objects.count(), 1)
+
+        # Valores já em cache: só o INSERT dos logs, no savepoint do lote
+        with CaptureQueriesContext(connection) as consultas:
+            AuditoriaMiddleware(view)(requisicao)
+        self.assertEqual(len(self.inserts(consultas)), 1)
+        self.assertEqual(len(consultas), 3)
+
+        log = LogAuditoria.objects.filter(modelo_auditado__valor='Teste').first()
+        self.assertEqual((log.modelo, log.ip_address, log.user_agent), ('Teste', '127.0.0.1', 'Mozilla/5.0'))
+
+        self.client.force_login(Usuario.objects.create(username='admin', is_staff=True, is_superuser=True))
+        pagina = self.client.get(reverse('admin:core_logauditoria_change', args=[log.pk]))
+        self.assertContains(pagina, 'Mozilla/5.0')
+        self.assertContains(self.client.get(reverse('admin:core_logauditoria_changelist')), '127.0.0.1')
+
+
+class ArquivamentoAuditoriaTest(AgendaTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.diretorio = diretorio.name
+        configuracao = override_settings(AUDITORIA_ARQUIVO_DIRETORIO=self.diretorio)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        self.mes_atual = timezone.localdate().replace(day=1)
+        self.mes_antigo = somar_meses(self.mes_atual, -14)
+        antigo = self.horario(self.mes_antigo + timedelta(days=9), 10)
+        LogAuditoria.objects.bulk_create([
+            LogAuditoria(usuario=self.cliente, acao='update', modelo='Agendamento', objeto_id=1,
+                         detalhes={'alteracoes': {'status': ['agendado', 'cancelado']}}, timestamp=antigo),
+            LogAuditoria(acao='delete', modelo='Servico', objeto_id=2, timestamp=antigo + timedelta(days=1)),
+            LogAuditoria(acao='view', modelo='Relatorio', timestamp=self.horario(somar_meses(self.mes_atual, -13), 0)),
+            LogAuditoria(acao='view', modelo='Relatorio', timestamp=timezone.now()),
+        ])
+
+    def test_arquiva_meses_fora_da_retencao(self):
+        self.assertEqual(meses_para_arquivar(12), [self.mes_antigo, somar_meses(self.mes_atual, -13)])
+        saida = StringIO()
+        call_command('arquivar_auditoria', retencao_meses=12, stdout=saida)
+        self.assertIn('2 mês(es) arquivado(s)', saida.getvalue())
+        self.assertEqual(LogAuditoria.objects.count(), 1)
+        self.assertEqual(meses_para_arquivar(12), [])
+
+        caminho, = arquivos_do_mes(self.mes_antigo)
+        with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+            registros = [json.loads(linha) for linha in arquivo]
+        self.assertEqual([r['acao'] for r in registros], ['update', 'delete'])
+        self.assertEqual(registros[0]['usuario_id'], self.cliente.pk)
+        self.assertEqual(registros[0]['detalhes'], {'alteracoes': {'status': ['agendado', 'cancelado']}})
+
+    def test_consulta_meses_arquivados(self):
+        arquivar_antigos(12)
+        fim = somar_meses(self.mes_atual, -12) - timedelta(days=1)
+        self.assertEqual(len(list(logs_arquivados(self.mes_antigo, fim))), 3)
+        self.assertEqual(
+            [log['modelo'] for log in logs_arquivados(self.mes_antigo, fim, usuario_id=self.cliente.pk)],
+            ['Agendamento'],
+        )
+        self.assertEqual(list(logs_arquivados(self.mes_antigo, self.mes_antigo + timedelta(days=9), acao='delete')), [])
+
+        saida = StringIO()
+        call_command(
+            'consultar_auditoria', inicio=self.mes_antigo.isoformat(), fim=fim.isoformat(),
+            modelo='Servico', stdout=saida,
+        )
+        linha, = saida.getvalue().splitlines()
+        self.assertEqual(json.loads(linha)['objeto_id'], 2)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Particionamento só existe no PostgreSQL')
+    def test_particoes_mensais(self):
+        self.assertTrue(particionada())
+        criar_particoes(3)
+        self.assertTrue({somar_meses(self.mes_atual, i) for i in range(4)} <= set(particoes()))
+
+        # Os meses antigos não têm partição: os logs estão na partição padrão
+        self.assertNotIn(self.mes_antigo, particoes())
+        self.assertEqual(meses_para_arquivar(12), [self.mes_antigo, somar_meses(self.mes_atual, -13)])
+        arquivar_antigos(12)
+        self.assertEqual(LogAuditoria.objects.count(), 1)
+        self.assertEqual(meses_para_arquivar(12), [])
+        self.assertEqual(len(arquivos_do_mes(self.mes_antigo)), 1)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Particionamento só existe no PostgreSQL')
+    def test_falha_ao_gravar_mantem_particao(self):
+        _criar_particao(self.mes_antigo)
+        inicio, fim = limites_do_mes(self.mes_antigo)
+        do_mes = LogAuditoria.objects.filter(timestamp__gte=inicio, timestamp__lt=fim)
+
+        # Um arquivo no lugar do diretório faz a gravação falhar
+        bloqueado = os.path.join(self.diretorio, 'bloqueado')
+        open(bloqueado, 'w').close()
+        with override_settings(AUDITORIA_ARQUIVO_DIRETORIO=bloqueado):
+            with self.assertRaises(OSError):
+                arquivar_mes(self.mes_antigo)
+        self.assertIn(self.mes_antigo, particoes())
+        self.assertEqual(do_mes.count(), 2)
+
+        self.assertEqual(arquivar_mes(self.mes_antigo)[1], 2)
+        self.assertNotIn(self.mes_antigo, particoes())
+        self.assertEqual(do_mes.count(), 0)
+        self.assertEqual(len(arquivos_do_mes(self.mes_antigo)), 1)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AgendamentoAdminTest(AgendaTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = Usuario.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(self.admin)
+
+    def enviar(self, inicio):
+        local = timezone.localtime(inicio)
+        return self.client.post(reverse('admin:core_agendamento_add'), {
+            'cliente': self.cliente.pk,
+            'funcionario': self.funcionario.pk,
+            'servico': self.servico.pk,
+            'data_agendamento_0': local.strftime('%Y-%m-%d'),
+            'data_agendamento_1': local.strftime('%H:%M:%S'),
+            'status': 'agendado',
+            'valor_final': '50',
+            'criado_por': self.admin.pk,
+        })
+
+    def test_sobreposicao_vira_erro_do_formulario(self):
+        existente = self.agendar(self.inicio)
+        resposta = self.enviar(self.inicio + timedelta(minutes=30))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertContains(resposta, f'Conflito de horário com agendamento: {existente}')
+        self.assertEqual(Agendamento.objects.count(), 1)
+
+        reserva = reservar_horario(self.funcionario, self.inicio + timedelta(hours=2), self.inicio + timedelta(hours=3))
+        resposta = self.enviar(reserva.inicio)
+        self.assertContains(resposta, 'Este horário está reservado por outro atendimento.')
+
+        self.assertEqual(self.enviar(self.inicio + timedelta(hours=1)).status_code, 302)
+        self.assertEqual(Agendamento.objects.count(), 2)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class LogAuditoriaAdminTest(PlanoConsultaMixin, AgendaTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        modelo_admin = admin.site._registry[LogAuditoria]
+        modelo_admin.list_per_page = 2
+        self.addCleanup(delattr, modelo_admin, 'list_per_page')
+
+        agora = timezone.now()
+        LogAuditoria.objects.bulk_create([
+            LogAuditoria(usuario=self.cliente, acao='update', modelo='Agendamento', objeto_id=i,
+                         ip_address='10.0.0.1', timestamp=agora - timedelta(minutes=i))
+            for i in range(4)
+        ] + [LogAuditoria(acao='view', modelo='Relatorio', ip_address='10.0.0.2', timestamp=agora - timedelta(minutes=4))])
+        self.client.force_login(Usuario.objects.create(username='admin', is_staff=True, is_superuser=True))
+
+    def pagina(self, consulta=''):
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(reverse('admin:core_logauditoria_changelist') + consulta)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertFalse([q for q in consultas if 'OFFSET' in q['sql']])
+        return resposta.context['cl']
+
+    def test_paginacao_por_cursor(self):
+        primeira = self.pagina()
+        self.assertEqual(primeira.result_count, 5)
+        self.assertEqual([log.objeto_id for log in primeira.result_list], [0, 1])
+        self.assertIsNone(primeira.url_mais_recentes)
+
+        segunda = self.pagina(primeira.url_mais_antigos)
+        self.assertEqual([log.objeto_id for log in segunda.result_list], [2, 3])
+        terceira = self.pagina(segunda.url_mais_antigos)
+        self.assertEqual([log.modelo for log in terceira.result_list], ['Relatorio'])
+        self.assertIsNone(terceira.url_mais_antigos)
+
+        voltando = self.pagina(terceira.url_anteriores)
+        self.assertEqual([log.objeto_id for log in voltando.result_list], [2, 3])
+        self.assertEqual([log.objeto_id for log in self.pagina(voltando.url_anteriores).result_list], [0, 1])
+
+    def test_pagina_lida_pelo_indice_de_timestamp(self):
+        cl = self.pagina()
+        momento, pk = _ler_cursor(_cursor(cl.result_list[-1]))
+        seguinte = cl.queryset.filter(timestamp__lte=momento).exclude(timestamp=momento, pk__gte=pk)
+        for queryset in (cl.queryset, seguinte):
+            plano = self.plano(queryset[:3], sem_seqscan=connection.vendor == 'postgresql')
+            if connection.vendor == 'postgresql':
+                # Partições lidas pelo índice em ordem (Merge Append), sem ordenar a tabela
+                self.assertIn('Index Scan Backward', plano)
+                self.assertNotRegex(plano, r'\bSort +\(', plano)
+            else:
+                self.assertIn(self.nome_indice(LogAuditoria, 'timestamp', 'id'), plano)
+                self.assertNotIn('TEMP B-TREE', plano)
+
+    def test_busca_por_colunas_indexadas(self):
+        self.assertEqual([log.objeto_id for log in self.pagina('?q=3').result_list], [3])
+        self.assertEqual([log.modelo for log in self.pagina('?q=10.0.0.2').result_list], ['Relatorio'])
+        self.assertEqual(self.pagina('?q=ana').result_count, 4)
+        self.assertEqual(self.pagina('?q=relat').result_count, 1)
+        self.assertEqual(self.pagina('?q=ana&acao__exact=view').result_count, 0)
@@ -52,12 +52,26 @@ urlpatterns = [
     # path('relatorios/agendamentos/', views.relatorio_agendamentos_view, name='relatorio_agendamentos'),
     # path('relatorios/receitas/', views.relatorio_receitas_view, name='relatorio_receitas'),
     
+    path('relatorios/agendamentos/exportar/', views.exportar_agendamentos_view, name='relatorio_agendamentos_exportar'),
+    path('relatorios/receitas/exportar/', views.exportar_receitas_view, name='relatorio_receitas_exportar'),
+    path('relatorios/ocupacao/', views.relatorio_ocupacao_view, name='relatorio_ocupacao'),
+    path('relatorios/tarefas/', views.solicitar_relatorio_view, name='relatorio_solicitar'),
+    path('relatorios/tarefas/<int:pk>/', views.tarefa_relatorio_view, name='relatorio_tarefa'),
+    path('relatorios/tarefas/<int:pk>/arquivo/', views.baixar_relatorio_view, name='relatorio_tarefa_arquivo'),
+    
     # # Configurações
     # path('configuracoes/', views.ConfiguracaoEmpresaUpdateView.as_view(), name='configuracoes'),
     
-    # # API endpoints (para AJAX)
-    # path('api/agendamentos-calendario/', views.agendamentos_calendario_api, name='api_agendamentos_calendario'),
-    # path('api/funcionarios-disponiveis/', views.funcionarios_disponiveis_api, name='api_funcionarios_disponiveis'),
+    # Agenda do funcionário para aplicativos de calendário
+    path('agenda/<uuid:token>.ics', views.agenda_funcionario_ics, name='agenda_funcionario_ics'),
+    
+    # API endpoints (para AJAX)
+    path('api/agendamentos-calendario/', views.agendamentos_calendario_api, name='api_agendamentos_calendario'),
+    path('api/funcionarios-disponiveis/', views.funcionarios_disponiveis_api, name='api_funcionarios_disponiveis'),
+    path('api/atribuir-funcionario/', views.atribuir_funcionario_api, name='api_atribuir_funcionario'),
+    path('api/reservar-horario/', views.reservar_horario_api, name='api_reservar_horario'),
+    path('api/liberar-reserva/', views.liberar_reserva_api, name='api_liberar_reserva'),
+    path('api/ocupacao/', views.ocupacao_api, name='api_ocupacao'),
 ]
 
 # Servir arquivos de media em desenvolvimento
@@ -3,27 +3,47 @@ from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib import messages
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.core.paginator import Paginator
-from django.db.models import Count, Q, Sum
-from django.http import JsonResponse
-from django.urls import reverse_lazy
+from django.db.models import Q
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.utils.dateparse import parse_date, parse_datetime
+from django.urls import reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from django.views.decorators.http import condition, require_POST
 from django.views.generic import (
     ListView, CreateView, UpdateView, DeleteView, 
     DetailView, TemplateView
 )
 from datetime import datetime, timedelta, date
 import json
+import re
 
 from .models import (
     Usuario, Funcionario, Cargo, Servico, 
-    Agendamento, ConfiguracaoEmpresa, LogAuditoria
+    ConfiguracaoEmpresa, LogAuditoria, ConflitoHorario, TarefaRelatorio
 )
 from .forms import (
     LoginForm, UsuarioForm, PermissoesUsuarioForm, CargoForm,
     FuncionarioForm, ServicoForm, AgendamentoForm, 
     ConfiguracaoEmpresaForm, FiltroAgendamentoForm
 )
+from .calendario import (
+    agendamentos_no_periodo, etag_periodo, eventos_ics, eventos_json, versao_periodo
+)
+from .disponibilidade import atribuir_funcionario, buscar_horarios_livres, funcionarios_ativos
+from .exportacao import (
+    CONTENT_TYPE_CSV, CONTENT_TYPE_XLSX, consulta_agendamentos, consulta_receitas,
+    csv_em_blocos, linhas_agendamentos, linhas_receitas, xlsx_em_blocos
+)
+from .habilidades import funcionarios_habilitados
+from .ocupacao import resumo_ocupacao
+from .painel import obter_estatisticas
+from .relatorios import caminho_arquivo, solicitar_relatorio
+from .reservas import liberar_reserva, reservar_horario
 
 
 # Mixins personalizados
@@ -97,56 +117,16 @@ def logout_view(request):
 def dashboard_view(request):
     """Dashboard principal com estatísticas"""
     
-    # Estatísticas gerais
-    total_usuarios = Usuario.objects.filter(ativo=True).count()
-    total_funcionarios = Funcionario.objects.filter(ativo=True).count()
-    total_clientes = Usuario.objects.filter(tipo='cliente', ativo=True).count()
-    total_servicos = Servico.objects.filter(ativo=True).count()
-    
-    # Agendamentos de hoje
-    hoje = timezone.now().date()
-    agendamentos_hoje = Agendamento.objects.filter(
-        data_agendamento__date=hoje
-    ).count()
-    
-    # Próximos agendamentos (próximos 7 dias)
-    proximo_semana = hoje + timedelta(days=7)
-    proximos_agendamentos = Agendamento.objects.filter(
-        data_agendamento__date__range=[hoje, proximo_semana],
-        status='agendado'
-    ).order_by('data_agendamento')[:5]
-    
-    # Agendamentos por status (últimos 30 dias)
-    ultimo_mes = hoje - timedelta(days=30)
-    agendamentos_status = Agendamento.objects.filter(
-        data_agendamento__date__gte=ultimo_mes
-    ).values('status').annotate(
-        total=Count('id')
-    ).order_by('status')
-    
-    # Receita do mês atual
-    primeiro_dia_mes = hoje.replace(day=1)
-    receita_mes = Agendamento.objects.filter(
-        data_agendamento__date__gte=primeiro_dia_mes,
-        status='concluido'
-    ).aggregate(
-        total=Sum('valor_final')
-    )['total'] or 0
+    estatisticas = obter_estatisticas()
     
     # Dados para gráficos
     chart_data = {
-        'agendamentos_por_status': list(agendamentos_status),
-        'receita_mes': float(receita_mes)
+        'agendamentos_por_status': estatisticas['agendamentos_por_status'],
+        'receita_mes': float(estatisticas['receita_mes'])
     }
     
     context = {
-        'total_usuarios': total_usuarios,
-        'total_funcionarios': total_funcionarios,
-        'total_clientes': total_clientes,
-        'total_servicos': total_servicos,
-        'agendamentos_hoje': agendamentos_hoje,
-        'proximos_agendamentos': proximos_agendamentos,
-        'receita_mes': receita_mes,
+        **estatisticas,
         'chart_data': json.dumps(chart_data),
     }
     
@@ -254,14 +234,15 @@ class UsuarioUpdateView(LoginRequiredMixin, UpdateView):
     def form_valid(self, form):
         response = super().form_valid(form)
         
-        # Registrar log
-        LogAuditoria.registrar(
-            usuario=self.request.user,
-            acao='update',
-            modelo=Usuario,
-            objeto=self.object,
-            request=self.request
-        )
+        # Registrar log (as alterações vêm do signal e são mescladas neste log)
+        if form.has_changed():
+            LogAuditoria.registrar(
+                usuario=self.request.user,
+                acao='update',
+                modelo=Usuario,
+                objeto=self.object,
+                request=self.request
+            )
         
         messages.success(
             self.request, 
@@ -349,3 +330,424 @@ def usuario_toggle_ativo(request, pk):
     
     messages.success(request, f'Usuário {status} com sucesso!')
     return redirect('core:usuarios_list')
+
+
+# API endpoints (para AJAX)
+def _parse_momento(valor):
+    """Aceita datetime ISO ou apenas a data (meia-noite local); None se inválido"""
+    try:
+        momento = parse_datetime(valor or '')
+        if momento is None:
+            data = parse_date(valor or '')
+            if data is None:
+                return None
+            momento = datetime.combine(data, datetime.min.time())
+    except ValueError:
+        # Formato certo, data inexistente (ex.: 2026-02-30)
+        return None
+    if timezone.is_naive(momento):
+        momento = timezone.make_aware(momento)
+    return momento
+
+
+def _agendamentos_calendario(request):
+    """Agendamentos do período pedido ao calendário, ou None se inválido"""
+    inicio = _parse_momento(request.GET.get('start'))
+    fim = _parse_momento(request.GET.get('end'))
+    if not inicio or not fim or fim <= inicio:
+        return None
+    if (fim - inicio).days > settings.AGENDA_CALENDARIO_MAXIMO_DIAS:
+        return None
+    ids = [i for i in request.GET.getlist('funcionario') if i.isdigit()]
+    agendamentos = agendamentos_no_periodo(inicio, fim, ids)
+    # Sem pode_ver_agendamentos, só os agendamentos do próprio usuário
+    # (como cliente ou como funcionário)
+    if not request.user.tem_permissao('pode_ver_agendamentos'):
+        agendamentos = agendamentos.filter(Q(cliente=request.user) | Q(funcionario__usuario=request.user))
+    return agendamentos
+
+
+def _etag_calendario(request):
+    agendamentos = _agendamentos_calendario(request)
+    return etag_periodo(agendamentos) if agendamentos is not None else None
+
+
+@login_required
+@condition(etag_func=_etag_calendario)
+def agendamentos_calendario_api(request):
+    """Eventos do calendário entre start e end (ISO), opcionalmente por funcionário"""
+    agendamentos = _agendamentos_calendario(request)
+    if agendamentos is None:
+        return JsonResponse({
+            'erro': f'Informe start e end (período máximo de {settings.AGENDA_CALENDARIO_MAXIMO_DIAS} dias).'
+        }, status=400)
+    
+    resposta = StreamingHttpResponse(eventos_json(agendamentos), content_type='application/json')
+    resposta['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+
+def _servico_ativo(valor):
+    """Serviço ativo com o id informado, ou None se o id não for numérico ou não existir"""
+    if not (valor or '').isdigit():
+        return None
+    return Servico.objects.filter(pk=valor, ativo=True).first()
+
+
+@login_required
+def funcionarios_disponiveis_api(request):
+    """Horários livres por funcionário para um serviço em um intervalo de datas"""
+    servico = _servico_ativo(request.GET.get('servico'))
+    if not servico:
+        return JsonResponse({'erro': 'Serviço inválido.'}, status=400)
+    
+    try:
+        data_inicio = parse_date(request.GET.get('data_inicio', '')) or timezone.localdate()
+        data_fim = parse_date(request.GET.get('data_fim', '')) or data_inicio
+    except ValueError:
+        # Formato certo, data inexistente (ex.: 2026-02-30)
+        return JsonResponse({'erro': 'Período inválido.'}, status=400)
+    if data_fim < data_inicio:
+        return JsonResponse({'erro': 'Período inválido.'}, status=400)
+    if (data_fim - data_inicio).days >= settings.AGENDA_BUSCA_MAXIMO_DIAS:
+        return JsonResponse({
+            'erro': f'O período máximo de busca é de {settings.AGENDA_BUSCA_MAXIMO_DIAS} dias.'
+        }, status=400)
+    
+    funcionarios = funcionarios_ativos().filter(pk__in=funcionarios_habilitados(servico))
+    ids = request.GET.getlist('funcionario')
+    if ids:
+        funcionarios = funcionarios.filter(pk__in=[i for i in ids if i.isdigit()])
+    
+    disponibilidade = buscar_horarios_livres(servico, data_inicio, data_fim, funcionarios)
+    
+    return JsonResponse({
+        'servico': servico.pk,
+        'duracao_minutos': servico.duracao_minutos,
+        'funcionarios': [
+            {
+                'id': funcionario.pk,
+                'nome': funcionario.usuario.get_full_name(),
+                'horarios': [timezone.localtime(h).isoformat() for h in horarios],
+            }
+            for funcionario, horarios in disponibilidade
+        ]
+    })
+
+
+@login_required
+def atribuir_funcionario_api(request):
+    """Primeiro funcionário livre para um serviço dentro de um intervalo"""
+    servico = _servico_ativo(request.GET.get('servico'))
+    if not servico:
+        return JsonResponse({'erro': 'Serviço inválido.'}, status=400)
+    
+    try:
+        inicio = parse_datetime(request.GET.get('inicio', '')) or timezone.now()
+        fim = parse_datetime(request.GET.get('fim', ''))
+    except ValueError:
+        return JsonResponse({'erro': 'Período inválido.'}, status=400)
+    if timezone.is_naive(inicio):
+        inicio = timezone.make_aware(inicio)
+    if fim is None:
+        fim = timezone.make_aware(datetime.combine(
+            timezone.localtime(inicio).date() + timedelta(days=1), datetime.min.time()
+        ))
+    elif timezone.is_naive(fim):
+        fim = timezone.make_aware(fim)
+    if fim <= inicio:
+        return JsonResponse({'erro': 'Período inválido.'}, status=400)
+    if (fim - inicio).days >= settings.AGENDA_BUSCA_MAXIMO_DIAS:
+        return JsonResponse({
+            'erro': f'O período máximo de busca é de {settings.AGENDA_BUSCA_MAXIMO_DIAS} dias.'
+        }, status=400)
+    
+    preferidos = [int(i) for i in request.GET.getlist('preferido') if i.isdigit()]
+    resultado = atribuir_funcionario(servico, inicio, fim, preferidos=preferidos)
+    if resultado is None:
+        return JsonResponse({'erro': 'Nenhum horário livre no período.'}, status=404)
+    
+    funcionario, horario = resultado
+    return JsonResponse({
+        'servico': servico.pk,
+        'funcionario': {
+            'id': funcionario.pk,
+            'nome': funcionario.usuario.get_full_name(),
+        },
+        'inicio': timezone.localtime(horario).isoformat(),
+        'fim': timezone.localtime(horario + timedelta(minutes=servico.duracao_minutos)).isoformat(),
+    })
+
+
+def _agenda_ics(request, token):
+    """(funcionário, agendamentos publicados, versão), calculado uma vez por request"""
+    if not hasattr(request, '_agenda_ics'):
+        funcionario = Funcionario.objects.filter(
+            token_calendario=token, ativo=True
+        ).select_related('usuario').first()
+        if funcionario is None:
+            raise Http404
+        agora = timezone.now()
+        agendamentos = agendamentos_no_periodo(
+            agora - timedelta(days=settings.AGENDA_ICS_DIAS_PASSADOS),
+            agora + timedelta(days=settings.AGENDA_ICS_DIAS_FUTUROS),
+            [funcionario.pk]
+        )
+        request._agenda_ics = (funcionario, agendamentos, versao_periodo(agendamentos))
+    return request._agenda_ics
+
+
+def _etag_ics(request, token):
+    _, agendamentos, versao = _agenda_ics(request, token)
+    return etag_periodo(agendamentos, versao)
+
+
+# Sem Last-Modified: a maior data_atualizacao não muda quando um agendamento
+# é excluído ou sai do período publicado; o ETag inclui a quantidade
+@condition(etag_func=_etag_ics)
+def agenda_funcionario_ics(request, token):
+    """Feed iCalendar da agenda do funcionário (assinatura via link com token)"""
+    funcionario, agendamentos, _ = _agenda_ics(request, token)
+    resposta = StreamingHttpResponse(
+        eventos_ics(agendamentos, f'Agenda - {funcionario.usuario.get_full_name()}', request.get_host()),
+        content_type='text/calendar; charset=utf-8'
+    )
+    resposta['Content-Disposition'] = 'inline; filename="agenda.ics"'
+    resposta['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+
+@login_required
+@require_POST
+def reservar_horario_api(request):
+    """Reserva um horário do funcionário enquanto o agendamento é preenchido"""
+    servico = _servico_ativo(request.POST.get('servico'))
+    funcionario_id = request.POST.get('funcionario', '')
+    funcionario = funcionarios_ativos().filter(pk=funcionario_id).first() if funcionario_id.isdigit() else None
+    try:
+        inicio = parse_datetime(request.POST.get('inicio', ''))
+    except ValueError:
+        inicio = None
+    if not servico or not funcionario or not inicio:
+        return JsonResponse({'erro': 'Serviço, funcionário e início são obrigatórios.'}, status=400)
+    if timezone.is_naive(inicio):
+        inicio = timezone.make_aware(inicio)
+    
+    try:
+        reserva = reservar_horario(
+            funcionario, inicio, inicio + timedelta(minutes=servico.duracao_minutos),
+            usuario=request.user, token=request.POST.get('token') or None
+        )
+    except ConflitoHorario as e:
+        return JsonResponse({'erro': e.messages[0]}, status=409)
+    except ValidationError:
+        return JsonResponse({'erro': 'Reserva inválida.'}, status=400)
+    
+    return JsonResponse({
+        'token': str(reserva.token),
+        'expira_em': timezone.localtime(reserva.expira_em).isoformat(),
+    })
+
+
+@login_required
+@require_POST
+def liberar_reserva_api(request):
+    """Libera uma reserva de horário antes de expirar"""
+    token = request.POST.get('token', '')
+    try:
+        liberar_reserva(token, request.user)
+    except ValidationError:
+        return JsonResponse({'erro': 'Reserva inválida.'}, status=400)
+    return JsonResponse({'liberada': True})
+
+
+# Exportação de relatórios
+def _filtros_exportacao(request, dados):
+    """Filtros validados da exportação, ou None se inválidos"""
+    if not request.user.tem_permissao('pode_ver_relatorios'):
+        raise PermissionDenied
+    
+    form = FiltroAgendamentoForm(dados)
+    if not form.is_valid():
+        return None
+    filtros = form.cleaned_data
+    hoje = timezone.localdate()
+    filtros['data_inicio'] = filtros['data_inicio'] or hoje.replace(day=1)
+    filtros['data_fim'] = filtros['data_fim'] or hoje
+    dias = (filtros['data_fim'] - filtros['data_inicio']).days
+    if dias < 0 or dias >= settings.RELATORIO_EXPORTACAO_MAXIMO_DIAS:
+        return None
+    return filtros
+
+
+def _resposta_exportacao(request, nome_arquivo, cabecalho, linhas):
+    """StreamingHttpResponse em CSV (comprimido se o cliente aceitar gzip) ou XLSX"""
+    if request.GET.get('formato') == 'xlsx':
+        resposta = StreamingHttpResponse(
+            xlsx_em_blocos(cabecalho, linhas, nome_arquivo.capitalize()), content_type=CONTENT_TYPE_XLSX
+        )
+        resposta['Content-Disposition'] = f'attachment; filename="{nome_arquivo}.xlsx"'
+        return resposta
+    
+    conteudo = csv_em_blocos(cabecalho, linhas)
+    comprimir = re.search(r'\bgzip\b', request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    resposta = StreamingHttpResponse(
+        compress_sequence(conteudo) if comprimir else conteudo, content_type=CONTENT_TYPE_CSV
+    )
+    if comprimir:
+        resposta['Content-Encoding'] = 'gzip'
+    patch_vary_headers(resposta, ('Accept-Encoding',))
+    resposta['Content-Disposition'] = f'attachment; filename="{nome_arquivo}.csv"'
+    return resposta
+
+
+@login_required
+def exportar_agendamentos_view(request):
+    """Agendamentos do período (data_inicio e data_fim locais) em CSV ou XLSX"""
+    filtros = _filtros_exportacao(request, request.GET)
+    if filtros is None:
+        return JsonResponse({
+            'erro': f'Filtros inválidos (período máximo de {settings.RELATORIO_EXPORTACAO_MAXIMO_DIAS} dias).'
+        }, status=400)
+    
+    cabecalho, linhas = linhas_agendamentos(consulta_agendamentos(**filtros))
+    nome = f"agendamentos_{filtros['data_inicio']:%Y%m%d}_{filtros['data_fim']:%Y%m%d}"
+    return _resposta_exportacao(request, nome, cabecalho, linhas)
+
+
+@login_required
+def exportar_receitas_view(request):
+    """Receita dos agendamentos concluídos por dia, funcionário e serviço, em CSV ou XLSX"""
+    filtros = _filtros_exportacao(request, request.GET)
+    if filtros is None:
+        return JsonResponse({
+            'erro': f'Filtros inválidos (período máximo de {settings.RELATORIO_EXPORTACAO_MAXIMO_DIAS} dias).'
+        }, status=400)
+    
+    cabecalho, linhas = linhas_receitas(consulta_receitas(
+        filtros['data_inicio'], filtros['data_fim'],
+        funcionario=filtros['funcionario'], servico=filtros['servico']
+    ))
+    nome = f"receitas_{filtros['data_inicio']:%Y%m%d}_{filtros['data_fim']:%Y%m%d}"
+    return _resposta_exportacao(request, nome, cabecalho, linhas)
+
+
+def _linhas_mapa_calor(mapa):
+    """Linhas (dia da semana, células por hora) do mapa de calor, só com as horas de expediente"""
+    horas = [
+        hora for hora in range(24)
+        if any(dia[hora] for dia in mapa['minutos_disponiveis'])
+    ]
+    return horas, [
+        (nome, [
+            {
+                'hora': hora,
+                'percentual': None if taxa is None else round(taxa * 100),
+                'opacidade': f'{taxa or 0:.2f}',
+            }
+            for hora, taxa in ((hora, mapa['taxa'][dia][hora]) for hora in horas)
+        ])
+        for dia, nome in enumerate(mapa['dias_semana'])
+    ]
+
+
+@login_required
+def relatorio_ocupacao_view(request):
+    """Taxa de ocupação por funcionário e mapa de calor (dia da semana x hora)"""
+    filtros = _filtros_exportacao(request, request.GET)
+    if filtros is None:
+        messages.error(
+            request, f'Filtros inválidos (período máximo de {settings.RELATORIO_EXPORTACAO_MAXIMO_DIAS} dias).'
+        )
+        hoje = timezone.localdate()
+        filtros = {'data_inicio': hoje.replace(day=1), 'data_fim': hoje, 'funcionario': None}
+    
+    resumo = resumo_ocupacao(filtros['data_inicio'], filtros['data_fim'], filtros['funcionario'])
+    horas, mapa_calor = _linhas_mapa_calor(resumo['mapa_calor'])
+    context = {
+        'form': FiltroAgendamentoForm(request.GET or None),
+        'resumo': resumo,
+        'horas': horas,
+        'mapa_calor': mapa_calor,
+        'data_inicio': filtros['data_inicio'],
+        'data_fim': filtros['data_fim'],
+    }
+    return render(request, 'core/relatorios/ocupacao.html', context)
+
+
+@login_required
+def ocupacao_api(request):
+    """
+    Ocupação do período (data_inicio e data_fim locais) por funcionário, dia e
+    hora; detalhe=hora inclui a matriz dia x hora de cada funcionário
+    """
+    filtros = _filtros_exportacao(request, request.GET)
+    if filtros is None:
+        return JsonResponse({
+            'erro': f'Filtros inválidos (período máximo de {settings.RELATORIO_EXPORTACAO_MAXIMO_DIAS} dias).'
+        }, status=400)
+    
+    return JsonResponse(resumo_ocupacao(
+        filtros['data_inicio'], filtros['data_fim'], filtros['funcionario'],
+        por_dia_e_hora=request.GET.get('detalhe') == 'hora',
+    ))
+
+
+def _tarefa_json(tarefa):
+    return {
+        'id': tarefa.pk,
+        'tipo': tarefa.tipo,
+        'formato': tarefa.formato,
+        'status': tarefa.status,
+        'progresso': tarefa.progresso,
+        'linhas_processadas': tarefa.linhas_processadas,
+        'total_linhas': tarefa.total_linhas,
+        'erro': tarefa.erro or None,
+        'status_url': reverse('core:relatorio_tarefa', args=[tarefa.pk]),
+        'arquivo_url': (
+            reverse('core:relatorio_tarefa_arquivo', args=[tarefa.pk])
+            if tarefa.status == 'concluido' else None
+        ),
+    }
+
+
+@login_required
+@require_POST
+def solicitar_relatorio_view(request):
+    """Coloca uma exportação na fila do worker (ou reaproveita uma igual) e responde na hora"""
+    tipo = request.POST.get('tipo')
+    formato = request.POST.get('formato', 'csv')
+    filtros = _filtros_exportacao(request, request.POST)
+    if (
+        filtros is None
+        or tipo not in dict(TarefaRelatorio.TIPO_CHOICES)
+        or formato not in dict(TarefaRelatorio.FORMATO_CHOICES)
+    ):
+        return JsonResponse({
+            'erro': f'Parâmetros inválidos (período máximo de {settings.RELATORIO_EXPORTACAO_MAXIMO_DIAS} dias).'
+        }, status=400)
+    
+    tarefa, criada = solicitar_relatorio(tipo, formato, filtros, request.user)
+    return JsonResponse(_tarefa_json(tarefa), status=202 if criada else 200)
+
+
+@login_required
+def tarefa_relatorio_view(request, pk):
+    """Situação e progresso de uma tarefa de relatório (para polling)"""
+    if not request.user.tem_permissao('pode_ver_relatorios'):
+        raise PermissionDenied
+    tarefa = get_object_or_404(TarefaRelatorio, pk=pk)
+    return JsonResponse(_tarefa_json(tarefa))
+
+
+@login_required
+def baixar_relatorio_view(request, pk):
+    """Arquivo de uma tarefa de relatório concluída"""
+    if not request.user.tem_permissao('pode_ver_relatorios'):
+        raise PermissionDenied
+    tarefa = get_object_or_404(TarefaRelatorio, pk=pk, status='concluido')
+    try:
+        arquivo = open(caminho_arquivo(tarefa), 'rb')
+    except FileNotFoundError:
+        raise Http404
+    return FileResponse(arquivo, as_attachment=True, filename=tarefa.arquivo)